@@ -0,0 +1,46 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from metricas import registrar_evento
+
+# --- AGENDADOR: TAREFAS COM HORA MARCADA ---
+#
+# Um heap de (instante, tarefa) atendido por uma única thread em segundo
+# plano, que dorme até o próximo vencimento. Usado para fechar os leilões
+# exatamente no fim do prazo, sem depender de alguém abrir uma página.
+# Não há cancelamento: a tarefa confere, quando roda, se ainda tem o que fazer.
+
+
+class Agendador:
+    def __init__(self):
+        self._fila = []
+        self._seq = itertools.count()
+        self._condicao = threading.Condition()
+        self._thread = None
+
+    def agendar(self, instante, funcao, *args):
+        """Roda funcao(*args) em segundo plano no instante (time.time()) informado."""
+        with self._condicao:
+            heapq.heappush(self._fila, (instante, next(self._seq), funcao, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._rodar, name='agendador', daemon=True)
+                self._thread.start()
+            self._condicao.notify()
+
+    def pendentes(self):
+        with self._condicao:
+            return len(self._fila)
+
+    def _rodar(self):
+        while True:
+            with self._condicao:
+                while not self._fila or self._fila[0][0] > time.time():
+                    self._condicao.wait(self._fila[0][0] - time.time() if self._fila else None)
+                _, _, funcao, args = heapq.heappop(self._fila)
+            try:
+                funcao(*args)
+            except Exception as e:
+                registrar_evento(logging.ERROR, 'erro_tarefa_agendada', tarefa=funcao.__name__, erro=e)
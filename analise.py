@@ -0,0 +1,183 @@
+try:
+    import numpy as np
+except ImportError:  # opcional: sem o pacote, não há relatório
+    np = None
+
+# --- ANÁLISE: RELATÓRIO DE FIM DE PARTIDA ---
+#
+# As colunas do ledger da sala (seq, remetente, recebedor, valor) viram arrays
+# NumPy, com os participantes trocados por índices: 0 é o Banco, depois os
+# jogadores na ordem da partida. Todas as métricas saem de agrupamentos
+# vetorizados (bincount/cumsum/searchsorted) sobre essas colunas, sem laços
+# Python por transação, o que permite processar arquivos de muitas partidas.
+#
+# As colunas e os saldos são copiados com sala.lock e o cálculo roda sem
+# ela: uma view (frombuffer) sobre os arrays vivos impediria o ledger de
+# crescer enquanto o relatório estivesse na memória. As somas de valores são
+# feitas em int64 (np.add.at): bincount com pesos passaria por float64 e
+# perderia precisão em valores grandes.
+#
+# A riqueza de cada jogador (saldo + poupança) ao longo do tempo é refeita de
+# trás para frente a partir do valor atual, descontando o fluxo do ledger.
+# O rendimento da poupança não passa pelo ledger e fica no ponto final.
+#
+# O efeito de uma manchete é o fluxo líquido do Banco para os jogadores
+# enquanto ela era a última sorteada (até o sorteio seguinte).
+
+PONTOS_SERIE = 60
+
+
+def disponivel():
+    return np is not None
+
+
+def colunas_do_ledger(ledger, indice):
+    """Colunas do ledger da sala como arrays NumPy: (seq, remetente, recebedor, valor).
+
+    As colunas do Ledger são copiadas de uma vez (quem chama segura
+    sala.lock); os índices de participante do ledger são traduzidos para os
+    de `indice` (id -> posição). Participantes que só aparecem no ledger
+    (jogador removido) ganham uma posição nova no próprio dicionário.
+    """
+    traducao = np.array([indice.setdefault(pid, len(indice)) for pid in ledger.participantes], dtype=np.intp)
+    seq = np.array(ledger.ids, dtype=np.int64)
+    valor = np.array(ledger.valores, dtype=np.int64)
+    remetente = traducao[np.array(ledger.remetentes, dtype=np.intp)]
+    recebedor = traducao[np.array(ledger.recebedores, dtype=np.intp)]
+    return seq, remetente, recebedor, valor
+
+
+def somar_por(chaves, valores, tamanho):
+    """total[c] = soma (int64, exata) dos valores com chave c."""
+    total = np.zeros(tamanho, dtype=np.int64)
+    np.add.at(total, chaves, valores)
+    return total
+
+
+def matriz_de_fluxo(remetente, recebedor, valor, k):
+    """M[i, j] = total pago por i a j."""
+    return somar_por(remetente * k + recebedor, valor, k * k).reshape(k, k)
+
+
+def fluxo_acumulado(remetente, recebedor, valor, k, pontos=PONTOS_SERIE):
+    """Fluxo líquido acumulado de cada participante em até `pontos` cortes do ledger.
+
+    Retorna (cortes, F): cortes[b] é a posição no ledger logo após o bloco b,
+    e F[b, p] o saldo de entradas menos saídas de p até ali.
+    """
+    n = len(valor)
+    cortes = np.unique(np.linspace(0, n, min(pontos, n) + 1).astype(np.int64)[1:])
+    bloco = np.searchsorted(cortes, np.arange(n), side='right')
+    tamanho = len(cortes) * k
+    fluxo = somar_por(bloco * k + recebedor, valor, tamanho) - somar_por(bloco * k + remetente, valor, tamanho)
+    return cortes, fluxo.reshape(len(cortes), k).cumsum(axis=0)
+
+
+def gini(riqueza):
+    """Índice de Gini de cada linha (riquezas negativas contam como zero)."""
+    x = np.sort(np.clip(riqueza, 0, None), axis=1).astype(np.float64)
+    n = x.shape[1]
+    total = x.sum(axis=1)
+    posicoes = np.arange(1, n + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        g = 2 * (x * posicoes).sum(axis=1) / (n * total) - (n + 1) / n
+    return np.where(total > 0, g, 0.0)
+
+
+def efeito_das_manchetes(seq, remetente, recebedor, valor, historico_manchetes, catalogo):
+    """Sorteios e efeito total (fluxo líquido Banco -> jogadores) por tipo de manchete."""
+    tipos = list(dict.fromkeys([m.get('tipo') for m in catalogo] + [m.get('tipo') for m in historico_manchetes]))
+    codigo = {tipo: i for i, tipo in enumerate(tipos)}
+    tipo_sorteio = np.fromiter((codigo[m.get('tipo')] for m in historico_manchetes), np.intp, len(historico_manchetes))
+    seq_sorteio = np.fromiter((m['seq'] for m in historico_manchetes), np.int64, len(historico_manchetes))
+    ordem = np.argsort(seq_sorteio, kind='stable')
+    seq_sorteio, tipo_sorteio = seq_sorteio[ordem], tipo_sorteio[ordem]
+
+    # Manchete em jogo em cada transação (-1: antes do primeiro sorteio).
+    vigente = np.searchsorted(seq_sorteio, seq, side='left') - 1
+    do_banco = np.where(remetente == 0, valor, 0) - np.where(recebedor == 0, valor, 0)
+    em_jogo = vigente >= 0
+    efeito = somar_por(tipo_sorteio[vigente[em_jogo]], do_banco[em_jogo], len(tipos))
+    sorteios = np.bincount(tipo_sorteio, minlength=len(tipos))
+    return [{'tipo': tipo, 'sorteios': int(sorteios[i]), 'efeito': int(efeito[i])} for i, tipo in enumerate(tipos)]
+
+
+def estatisticas_leiloes(historico_leiloes):
+    vendidos = [l for l in historico_leiloes if l.get('valor') is not None]
+    resumo = {'total': len(historico_leiloes), 'vendidos': len(vendidos)}
+    if not vendidos:
+        return resumo
+    precos = np.array([l['valor'] for l in vendidos], dtype=np.float64)
+    minimos = np.array([l.get('lance_minimo') or 0 for l in vendidos], dtype=np.float64)
+    lances = np.array([l.get('total_lances', 0) for l in historico_leiloes], dtype=np.float64)
+    com_minimo = minimos > 0
+    resumo.update({
+        'arrecadado': int(precos.sum()),
+        'media': int(precos.mean()),
+        'mediana': int(np.median(precos)),
+        'minimo': int(precos.min()),
+        'maximo': int(precos.max()),
+        'desvio': int(precos.std()),
+        'agio_medio': round(float((precos[com_minimo] / minimos[com_minimo] - 1).mean() * 100), 1) if com_minimo.any() else None,
+        'lances_por_leilao': round(float(lances.mean()), 1)
+    })
+    return resumo
+
+
+def relatorio(sala, catalogo_manchetes=(), pontos=PONTOS_SERIE):
+    """Relatório de fim de partida da sala, pronto para virar JSON."""
+    # Só as cópias com a trava; o cálculo, longo, não segura as transações da sala.
+    with sala.lock:
+        jogadores = [(pid, dict(dados)) for pid, dados in sala.jogadores()]
+        indice = {'Banco': 0}
+        for pid, _ in jogadores:
+            indice[pid] = len(indice)
+        ledger = sala.ledger
+        seq, remetente, recebedor, valor = colunas_do_ledger(ledger, indice)
+        historico_manchetes, historico_leiloes = list(sala.historico_manchetes), list(sala.historico_leiloes)
+    k = len(indice)
+    ids = list(indice)
+    nomes = {pid: dados.get('name', pid) for pid, dados in jogadores}
+    nomes['Banco'] = 'Banco Central'
+
+    fluxo = matriz_de_fluxo(remetente, recebedor, valor, k)
+    pago, recebido = fluxo.sum(axis=1), fluxo.sum(axis=0)
+    # Líquido de i para j: quem i mais pagou (credor) e quem mais pagou a i (devedor).
+    liquido = fluxo - fluxo.T
+    credor, devedor = liquido.argmax(axis=1), liquido.argmax(axis=0)
+
+    def par(j, v):
+        return {'id': ids[j], 'nome': nomes.get(ids[j], ids[j]), 'valor': int(v)} if v > 0 else None
+
+    cortes, acumulado = fluxo_acumulado(remetente, recebedor, valor, k, pontos)
+    posicoes = [indice[pid] for pid, _ in jogadores]
+    riqueza_final = np.array([dados.get('saldo', 0) + dados.get('poupanca', 0) for _, dados in jogadores], dtype=np.int64)
+    # Riqueza no corte = riqueza de hoje menos o que ainda entrou (líquido) depois dele.
+    riqueza = riqueza_final - (acumulado[-1:, posicoes] - acumulado[:, posicoes])
+    indices_gini = gini(riqueza) if posicoes else np.zeros(len(riqueza))
+
+    return {
+        'sala': sala.id,
+        'transacoes': len(seq),
+        'movimentado': int(valor.sum()),
+        'jogadores': [{
+            'id': pid,
+            'nome': nomes[pid],
+            'cor': dados.get('color'),
+            'pago': int(pago[i]),
+            'recebido': int(recebido[i]),
+            'liquido': int(recebido[i] - pago[i]),
+            'riqueza': int(dados.get('saldo', 0) + dados.get('poupanca', 0)),
+            'maior_credor': par(credor[i], liquido[i, credor[i]]),
+            'maior_devedor': par(devedor[i], liquido[devedor[i], i])
+        } for (pid, dados), i in zip(jogadores, posicoes)],
+        'serie': {
+            'seq': [int(seq[c - 1]) for c in cortes],
+            'hora': [ledger[c - 1].get('data_hora') for c in cortes],
+            'fluxo': {pid: acumulado[:, i].tolist() for (pid, _), i in zip(jogadores, posicoes)},
+            'riqueza': {pid: riqueza[:, n].tolist() for n, (pid, _) in enumerate(jogadores)},
+            'gini': [round(float(v), 4) for v in indices_gini]
+        },
+        'manchetes': efeito_das_manchetes(seq, remetente, recebedor, valor, historico_manchetes, catalogo_manchetes),
+        'leiloes': estatisticas_leiloes(historico_leiloes)
+    }
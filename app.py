@@ -1,137 +1,374 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, abort, jsonify, Response, stream_with_context
+from flask import before_render_template, request_started, template_rendered
+from markupsafe import Markup
+import click
 import uuid
 import time
 import random 
 import json 
+import logging
 import os
-
-app = Flask(__name__)
+import shutil
+from array import array
+from bisect import bisect_left
+import analise
+from agendador import Agendador
+from conteudo import Conteudo, validar
+from efeitos import calcular_transferencias
+from estaticos import CACHE_IMUTAVEL, TAMANHO_MINIMO_COMPRESSAO, TIPOS_COMPRIMIVEIS, Estaticos, comprimir, escolher_codificacao
+from eventos import INTERVALO_PING
+from idempotencia import CONFLITO, EM_ANDAMENTO, NOVA, CacheIdempotencia
+from lances import FilaLances
+from ledger import VALOR_MAXIMO
+from metricas import METRICAS, configurar_log, registrar_evento
+from persistencia import converter_snapshot
+from salas import MODOS_SQLITE, ErroPersistencia, GerenciadorSalas, Sala, com_trava, slug_sala
+from snapshot_binario import compressoes_disponiveis
+
+# Os arquivos de static/ são servidos pela rota estatico_versionado (nome com hash).
+app = Flask(__name__, static_folder=None)
 app.secret_key = 'chave_chaves'
 
 PRESET_COLORS = ['#3B82F6', '#EF4444', '#10B981', '#F59E0B', '#8B5CF6', '#EC4899', '#6B7280', '#06B6D4']
+# Arquivos da versão de partida única; migrados para a sala padrão na primeira execução.
 DATA_FILE = 'banco_imobiliario_state.json' 
-PARTIDA = {}
+JOURNAL_FILE = 'banco_imobiliario_state.journal'
+SALAS_DIR = os.environ.get('BANCO_SALAS_DIR', 'salas')
+SALA_PADRAO = 'principal'
+# 'journal': cada jogada vira uma linha no journal (compactado a cada N registros).
+# 'snapshot': comportamento antigo, regrava o arquivo inteiro a cada jogada.
+# 'sqlite': um banco SQLite (WAL) por sala; cada jogada atualiza só as linhas afetadas.
+# 'compartilhado': o mesmo banco SQLite servindo vários workers (gunicorn -w N), cada um com a sua
+# cópia da sala sincronizada pela versão do jogo (ver salas.py).
+MODO_PERSISTENCIA = os.environ.get('BANCO_PERSISTENCIA', 'journal')
+# Formato do snapshot nos modos journal/snapshot: 'json' ou 'binario' (seções, ledger lido sob demanda),
+# com compressão opcional ('zlib', ou 'zstd' com o pacote zstandard instalado).
+FORMATO_SNAPSHOT = os.environ.get('BANCO_SNAPSHOT_FORMATO', 'json')
+COMPRESSAO_SNAPSHOT = os.environ.get('BANCO_SNAPSHOT_COMPRESSAO') or None
+# Salas sem acesso há mais que isso (em segundos) são salvas e tiradas da memória.
+SALA_OCIOSA_SEGUNDOS = int(os.environ.get('BANCO_SALA_OCIOSA', 1800))
+MAX_SALAS_CARREGADAS = int(os.environ.get('BANCO_MAX_SALAS', 200))
+SALAS = GerenciadorSalas(SALAS_DIR, MODO_PERSISTENCIA, SALA_OCIOSA_SEGUNDOS, MAX_SALAS_CARREGADAS,
+                         formato_snapshot=FORMATO_SNAPSHOT, compressao=COMPRESSAO_SNAPSHOT)
 BANK_PIN = "2525"
-LEILAO_ATUAL = {}
-COBRANCAS_PARCELADAS = {}
 SALDO_INICIAL = 500000
-SOLICITACOES_SALARIO = {}
-MANCHETES_VIGENTES = []
-MANCHETES_DISPONIVEIS = []
+ITENS_POR_PAGINA = 20
+# Leilões: duração padrão e quanto um lance garante de tempo restante (anti-sniping), em segundos.
+LEILAO_DURACAO = 90
+LEILAO_EXTENSAO = 30
+# Modo compartilhado: de quanto em quanto tempo (s) um fluxo de eventos aberto busca o que outros workers gravaram.
+INTERVALO_SINCRONIA = 2
+AGENDADOR = Agendador()
+# Resultados dos POSTs com chave de idempotência: reenvios recebem a resposta original (ver idempotencia.py).
+IDEMPOTENCIA = CacheIdempotencia(maximo=10000, ttl=600)
+CAMPO_IDEMPOTENCIA = 'idempotencia'
+HTML_CAMPO_IDEMPOTENCIA = f'<input type="hidden" name="{CAMPO_IDEMPOTENCIA}" value="{{}}">'
+# Log estruturado (logfmt) em stderr: DEBUG registra cada requisição; INFO, cargas e salvamentos de sala.
+configurar_log(os.environ.get('BANCO_LOG_NIVEL', 'WARNING'))
+ESTATICOS = Estaticos(os.path.join(app.root_path, 'static'))
+
+# Objetivos, manchetes e catálogo de propriedades; relido sozinho quando o arquivo muda.
+CONTEUDO = Conteudo(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conteudo_jogo.json'))
+
+def obter_proxima_manchete(sala):
+    """Tira a carta do topo do baralho da sala (None se não há manchetes no conteúdo).
+
+    O baralho é uma permutação dos índices das manchetes e a posição da
+    próxima carta. Quando acaba, ou quando as manchetes do arquivo mudam,
+    é embaralhado de novo. Chamado com sala.lock.
+    """
+    conteudo = CONTEUDO.atual()
+    baralho = sala.baralho
+    if baralho['versao'] != conteudo.versao or baralho['posicao'] >= len(baralho['ordem']):
+        ordem = list(range(len(conteudo.manchetes)))
+        random.shuffle(ordem)
+        baralho = {'versao': conteudo.versao, 'ordem': ordem, 'posicao': 0}
+    if not baralho['ordem']:
+        return None
+    sala.baralho = dict(baralho, posicao=baralho['posicao'] + 1)
+    return conteudo.manchetes[baralho['ordem'][baralho['posicao']]]
+
+# As ações de Multinacionais não contam como propriedades no salário da passagem pelo início.
+CLASSE_ACOES = 'Multinacional'
 
-def obter_proxima_manchete():
-    global MANCHETES_DISPONIVEIS, POOL_MANCHETES
-    
-    # Se o "baralho" acabar, recarregamos e embaralhamos de novo
-    if not MANCHETES_DISPONIVEIS:
-        MANCHETES_DISPONIVEIS = POOL_MANCHETES.copy()
-        random.shuffle(MANCHETES_DISPONIVEIS)
-    
-    # Retira a carta do topo do baralho
-    return MANCHETES_DISPONIVEIS.pop(0)
+# --- FUNÇÕES DE APOIO E PERSISTÊNCIA ---
 
-def carregar_conteudo_estatico():
-    base_path = os.path.dirname(os.path.abspath(__file__))
-    caminho_json = os.path.join(base_path, 'conteudo_jogo.json')
-    
-    try:
-        if not os.path.exists(caminho_json):
-            print(f"!!! ERRO: Arquivo {caminho_json} não encontrado.")
-            return [], []
-            
-        with open(caminho_json, 'r', encoding='utf-8') as f:
-            conteudo = json.load(f)
-            return conteudo.get('objetivos', []), conteudo.get('manchetes', [])
-    except json.JSONDecodeError:
-        print("!!! ERRO: O arquivo conteudo_jogo.json está com erro de sintaxe (vírgula faltando ou aspas erradas).")
-        return [], []
-    except Exception as e:
-        print(f"!!! ERRO INESPERADO: {e}")
-        return [], []
-
-OBJETIVOS_LISTA, POOL_MANCHETES = carregar_conteudo_estatico()
+def agendar_encerramento(sala, leilao_id):
+    """Marca no agendador o fechamento do leilão no seu expira_em atual."""
+    AGENDADOR.agendar(sala.leiloes[leilao_id]['expira_em'], encerrar_leilao_agendado, sala.id, leilao_id)
 
-# --- FUNÇÕES DE APOIO E PERSISTÊNCIA ---
+def agendar_leiloes_da_sala(sala):
+    """Chamado quando a sala volta do disco: leilões vencidos no meio-tempo fecham na hora."""
+    for leilao_id in list(sala.leiloes):
+        agendar_encerramento(sala, leilao_id)
 
-def verificar_encerramento_leilao():
-    global LEILAO_ATUAL
-    if LEILAO_ATUAL.get('ativo') and time.time() > LEILAO_ATUAL.get('expira_em', 0):
-        vencedor_id = LEILAO_ATUAL.get('jogador_atual_id')
-        valor_final = LEILAO_ATUAL.get('lance_atual')
-        propriedade = LEILAO_ATUAL.get('propriedade')
+def encerrar_leilao_agendado(sala_id, leilao_id):
+    # Busca a sala pelo id: ela pode ter sido tirada da memória desde o agendamento.
+    with SALAS.usar(sala_id) as sala:
+        if sala is not None:
+            encerrar_leilao(sala, leilao_id)
+
+def encerrar_leilao(sala, leilao_id, forcar=False):
+    """Bate o martelo: cobra o vencedor, guarda o leilão no histórico e avisa as páginas.
+
+    Sem `forcar`, só encerra se o prazo (talvez estendido por lances) já acabou.
+    Retorna a mensagem do resultado, ou None se não havia o que encerrar.
+    """
+    # Os lances que chegaram a este leilão antes do martelo são resolvidos antes dele (e podem estender o prazo).
+    LANCES.aguardar_leilao(sala, leilao_id)
+    with sala.lock_leilao:
+        leilao = sala.leiloes.get(leilao_id)
+        if not leilao or (not forcar and time.time() < leilao['expira_em']):
+            return None
+        vencedor_id = leilao['jogador_atual_id']
+        valor_final = leilao['lance_atual']
+        propriedade = leilao['propriedade']
         if vencedor_id:
-            executar_transacao(vencedor_id, 'Banco', valor_final)
-            flash(f"MARTELO BATIDO! {PARTIDA[vencedor_id]['name']} comprou {propriedade} por R$ {format_brl(valor_final)}!", 'success')
-        LEILAO_ATUAL = {}
-        save_game_state()
-
-def load_game_state():
-    global PARTIDA, LEILAO_ATUAL, COBRANCAS_PARCELADAS
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                PARTIDA = data.get('partida', {})
-                LEILAO_ATUAL = data.get('leilao', {})
-                COBRANCAS_PARCELADAS = data.get('cobrancas_parceladas', {})
-        except: PARTIDA, LEILAO_ATUAL, COBRANCAS_PARCELADAS = {}, {}, {}
-
-def save_game_state():
-    global PARTIDA, LEILAO_ATUAL, COBRANCAS_PARCELADAS
+            registrar_transacao(sala, vencedor_id, 'Banco', valor_final)
+            transferir_propriedade(sala, propriedade, vencedor_id)
+        fim = {
+            'id': leilao_id,
+            'propriedade': propriedade,
+            'lance_minimo': leilao['lance_minimo'],
+            'valor': valor_final if vencedor_id else None,
+            'vencedor_id': vencedor_id,
+            'vencedor_nome': leilao['jogador_atual_nome'],
+            'total_lances': leilao.get('total_lances', 0),
+            'encerrado_em': time.strftime('%H:%M:%S'),
+            'martelo': 'banco' if forcar else 'tempo'
+        }
+        sala.leiloes = {k: v for k, v in sala.leiloes.items() if k != leilao_id}
+        sala.historico_leiloes = sala.historico_leiloes + [fim]
+        sala.persistir('leilao', id=leilao_id, v=None, fim=fim)
+        mensagem = mensagem_encerramento(fim)
+        sala.eventos.publicar('leilao_encerrado', {'id': leilao_id, 'mensagem': mensagem}, 'todos')
+        return mensagem
+
+def mensagem_encerramento(fim):
+    if fim['vencedor_id']:
+        return f"MARTELO BATIDO! {fim['vencedor_nome']} comprou {fim['propriedade']} por R$ {format_brl(fim['valor'])}!"
+    return f"Leilão de {fim['propriedade']} encerrado sem lances."
+
+@com_trava
+def transferir_propriedade(sala, nome, dono_id):
+    """Registra `dono_id` como dono da propriedade ('Banco' ou None: volta para o banco)."""
+    catalogo = CONTEUDO.atual().catalogo
+    nome = (catalogo.buscar(nome) or {'nome': nome})['nome']
+    posse = None if dono_id in (None, 'Banco') else catalogo.posse(nome, dono_id)
+    if posse is None and sala.posses.dono(nome) is None:
+        return
+    sala.posses.atribuir(nome, posse)
+    sala.persistir('propriedade', id=nome, v=posse)
+
+@com_trava
+def sortear_manchete(sala):
+    """Tira a próxima manchete do baralho da sala, põe em jogo e avisa as páginas.
+
+    Retorna a manchete sorteada, ou None se o conteúdo não tem manchetes.
+    """
+    carta = obter_proxima_manchete(sala)
+    if carta is None:
+        return None
+    nova = carta.copy()
+    
+    nova['id'] = str(uuid.uuid4())[:8]
+    nova['data_hora'] = time.strftime('%H:%M')
+    
+    sala.manchetes_vigentes = ([nova] + sala.manchetes_vigentes)[:4]
+    # As transações com id maior que 'seq' aconteceram com esta manchete em jogo.
+    sorteio = {'id': nova['id'], 'titulo': nova['titulo'], 'tipo': nova.get('tipo'), 'seq': sala.partida.get('timestamp', 0)}
+    sala.historico_manchetes = sala.historico_manchetes + [sorteio]
+    sala.persistir('manchetes', v=sala.manchetes_vigentes, nova=sorteio, baralho=sala.baralho)
+    sala.eventos.publicar('manchete', nova, 'todos')
+    return nova
+
+def efeito_da_manchete(sala, manchete_id, beneficiario_id=None):
+    """(manchete vigente, transferências do efeito calculadas sobre os saldos de agora)."""
+    manchete = next((m for m in sala.manchetes_vigentes if m['id'] == manchete_id), None)
+    if manchete is None or 'regra' not in manchete:
+        return manchete, []
+    return manchete, calcular_transferencias(manchete['regra'], sala.jogadores(), sala.posses, beneficiario_id)
+
+def versao_do_efeito(sala):
+    """Muda sempre que um saldo ou uma posse muda: a prévia confirmada tem de ser a de agora."""
+    return sala.etag(*(pid for pid, _ in sala.jogadores()), 'propriedades')
+
+@com_trava
+def aplicar_efeito_manchete(sala, manchete_id, beneficiario_id, versao):
+    """Aplica o efeito da prévia confirmada pelo banco, num único lote."""
+    manchete, transferencias = efeito_da_manchete(sala, manchete_id, beneficiario_id)
+    if manchete is None or 'regra' not in manchete:
+        return "Erro: Manchete fora de vigência ou sem efeito automático."
+    if manchete.get('aplicada'):
+        return "Erro: O efeito desta manchete já foi aplicado."
+    if manchete['regra']['alvo'] == 'individual' and beneficiario_id not in dict(sala.jogadores()):
+        return "Erro: Escolha o jogador atingido pela manchete."
+    if versao != versao_do_efeito(sala):
+        return "Erro: Saldos ou propriedades mudaram desde a prévia. Confira os valores de novo."
+    aplicada = dict(manchete, aplicada=time.strftime('%H:%M'))
+    registrar_lote(sala, transferencias, manchetes=[aplicada if m['id'] == manchete_id else m for m in sala.manchetes_vigentes])
+    total = sum(valor for _, _, valor in transferencias)
+    return f"Efeito de '{manchete['titulo']}' aplicado: {len(transferencias)} transferência(s), R$ {format_brl(total)} movimentados."
+
+def iniciar_partida(sala, jogadores_data, saldo_ini):
+    """Começa uma partida nova na sala com os jogadores ({'name', 'color'}) e o saldo inicial."""
+    partida = {'Banco': {'poupanca_trancada': False}, 'timestamp': 0}
+    
+    # SORTEIO DE OBJETIVOS (CORREÇÃO CRÍTICA)
+    pool_objetivos = CONTEUDO.atual().objetivos.copy()
+    random.shuffle(pool_objetivos)
+    
+    for p in jogadores_data:
+        player_id = str(uuid.uuid4())
+        obj = pool_objetivos.pop() if pool_objetivos else "Dominar o Mercado: R$ 1M de saldo total."
+        partida[player_id] = {'name': p['name'], 'saldo': saldo_ini, 'historico_idx': array('l'), 'color': p['color'], 'poupanca': 0, 'pin': None, 'objetivo': obj}
+    
+    with sala.lock_leilao, sala.lock:
+        sala.zerar()
+        sala.partida = partida
+        sala.agregados = sala.calcular_agregados()
+        sala.salvar()
+        sala.tocar('jogadores')
+
+def manter_sala_ativa(sala):
+    """Usado pelos fluxos de eventos: sala com página aberta não é tirada da memória.
+
+    No modo compartilhado, também traz o que os outros workers gravaram (e os
+    eventos disso), a cada INTERVALO_SINCRONIA segundos.
+    """
+    sala.ultimo_acesso = time.monotonic()
+    if sala.modo_persistencia != 'compartilhado':
+        return INTERVALO_PING
+    sala.sincronizar()
+    return INTERVALO_SINCRONIA
+
+def transmitir_eventos(sala, canais):
+    """Fluxo SSE dos canais; a sala fica retida (não é despejada) enquanto a página estiver aberta."""
+    SALAS.reter(sala)
     try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump({'partida': PARTIDA, 'leilao': LEILAO_ATUAL, 'cobrancas_parceladas': COBRANCAS_PARCELADAS}, f, indent=4)
-    except Exception as e: print(f"Erro ao salvar: {e}")
+        yield from sala.eventos.transmitir(canais, lambda: manter_sala_ativa(sala))
+    finally:
+        SALAS.soltar(sala)
+
+def publicar_mudancas(sala, registros):
+    """Modo compartilhado: avisa as páginas abertas neste worker do que outro worker gravou."""
+    if registros is None:
+        # Sala recarregada inteira (as páginas já foram mandadas reconectar).
+        agendar_leiloes_da_sala(sala)
+        return
+    jogadores = set()
+    for registro in registros:
+        op = registro['op']
+        if op == 'tx':
+            jogadores.update((registro['r'], registro['d']))
+        elif op == 'lote':
+            jogadores.update(pid for t in registro['t'] for pid in t[1:3])
+        elif op == 'jogador':
+            jogadores.add(registro['id'])
+        elif op == 'leilao' and registro.get('v'):
+            leilao = registro['v']
+            # O outro worker pode cair antes do prazo: este também agenda o martelo (encerrar confere de novo).
+            agendar_encerramento(sala, leilao['id'])
+            if leilao.get('total_lances'):
+                sala.eventos.publicar('lance', {k: leilao.get(k) for k in ('id', 'lance_atual', 'jogador_atual_nome', 'expira_em', 'ultimos_lances')}, 'todos')
+            else:
+                sala.eventos.publicar('leilao_iniciado', {'id': leilao['id'], 'propriedade': leilao['propriedade'], 'lance_atual': leilao['lance_atual']}, 'todos')
+        elif op == 'leilao' and 'fim' in registro:
+            sala.eventos.publicar('leilao_encerrado', {'id': registro['id'], 'mensagem': mensagem_encerramento(registro['fim'])}, 'todos')
+        elif op == 'manchetes' and 'nova' in registro:
+            sala.eventos.publicar('manchete', registro['v'][0], 'todos')
+    publicar_saldos(sala, *(pid for pid in jogadores if pid in sala.partida))
+
+def publicar_saldos(sala, *player_ids):
+    """Avisa cada jogador (e o banco) dos saldos que mudaram."""
+    saldos = {}
+    for pid in player_ids:
+        if pid != 'Banco' and pid not in saldos:
+            saldos[pid] = {'saldo': sala.partida[pid]['saldo'], 'poupanca': sala.partida[pid]['poupanca']}
+            sala.eventos.publicar('saldo', saldos[pid], pid)
+    if saldos:
+        sala.eventos.publicar('saldos', saldos, 'banco')
+        sala.eventos.publicar('economia', sala.agregados, 'banco')
 
 def format_brl(value):
-    try: return f"{int(value):,.0f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except: return value
+    """Formata um número inteiro para o formato BRL com separador de milhar (ex: 1.500)."""
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            return value # Retorna o valor original se não puder ser convertido
+    
+    # Usa a formatação local para o Brasil
+    # No seu ambiente Python 3.13, isto deve funcionar bem.
+    # Ex: 1500 -> 1.500
+    return f"{value:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
 app.jinja_env.filters['format_brl'] = format_brl
 
-def get_id_to_name_map():
-    m = {id: data['name'] for id, data in PARTIDA.items() if id not in ('Banco', 'timestamp')}
-    m['Banco'] = 'Banco'
-    return m
-
-# --- LÓGICA DE TRANSAÇÕES ---
-
-def registrar_transacao(remetente_id, recebedor_id, valor):
-    agora_ts = PARTIDA.get('timestamp', 0) + 1
-    PARTIDA['timestamp'] = agora_ts
-    
-    transacao = {
-        'id': agora_ts,
-        'valor': valor,
-        'remetente_id': remetente_id,
-        'recebedor_id': recebedor_id,
-        'timestamp': agora_ts,
-        'data_hora': time.strftime('%H:%M:%S')
-    }
-    
-    PARTIDA['Banco']['historico'].append(transacao)
-    if remetente_id != 'Banco':
-        PARTIDA[remetente_id]['historico'].append(transacao)
-    if recebedor_id != 'Banco':
-        PARTIDA[recebedor_id]['historico'].append(transacao)
-
-def executar_transacao(remetente_id, recebedor_id, valor):
-    try: valor = int(valor)
-    except: return "Erro: Valor inválido."
-    if valor <= 0: return "Erro: Valor deve ser positivo."
-    if remetente_id != 'Banco':
-        if PARTIDA[remetente_id]['saldo'] < valor: flash(f"ALERTA: {PARTIDA[remetente_id]['name']} com saldo negativo!", "warning")
-        PARTIDA[remetente_id]['saldo'] -= valor
-    if recebedor_id != 'Banco': PARTIDA[recebedor_id]['saldo'] += valor
-    registrar_transacao(remetente_id, recebedor_id, valor)
-    save_game_state()
-    return "Transação realizada!"
+# --- VISÕES DERIVADAS ---
+#
+# Listas e fragmentos HTML que as páginas repetiam a cada requisição, guardados
+# em sala.visoes e refeitos só quando as partes do estado de que dependem
+# mudam (ver visoes.py). Os dicts e listas devolvidos são os do cache: só leitura.
+
+MARCA_IDEMPOTENCIA = '<!--idempotencia-->'
+
+def nomes_por_id(sala, banco='Banco'):
+    """Nome de cada jogador por id; o banco aparece com o rótulo `banco`."""
+    return sala.visoes.obter(('nomes', banco), (), lambda: {**{pid: dados['name'] for pid, dados in sala.jogadores()}, 'Banco': banco})
+
+def destinatarios_de(sala, player_id):
+    """(id, nome) de quem pode receber um pagamento do jogador: o banco e os outros jogadores."""
+    return sala.visoes.obter(('destinatarios', player_id), (), lambda: [('Banco', 'Banco')] + [
+        (pid, dados['name']) for pid, dados in sala.jogadores() if pid != player_id])
+
+def cobrancas_por_jogador(sala):
+    """{id do jogador: {'dividas': [(id, cobrança)], 'creditos': [...]}}, numa passada pelas cobranças."""
+    def montar():
+        por_jogador = {}
+        for inst_id, c in sala.cobrancas_parceladas.items():
+            por_jogador.setdefault(c['devedor_id'], {'dividas': [], 'creditos': []})['dividas'].append((inst_id, c))
+            if c['credor_id'] != c['devedor_id']:
+                por_jogador.setdefault(c['credor_id'], {'dividas': [], 'creditos': []})['creditos'].append((inst_id, c))
+        return por_jogador
+    return sala.visoes.obter('cobrancas', ('cobrancas',), montar)
+
+def fragmento(sala, chave, partes, modelo, contexto):
+    """HTML de `modelo` com o contexto de contexto(), renderizado de novo só se alguma das `partes` mudou.
+
+    No cache, os campos de idempotência ficam marcados: cada página servida recebe chaves novas.
+    """
+    html = sala.visoes.obter(chave, partes, lambda: render_template(
+        modelo, campo_idempotencia=lambda: Markup(MARCA_IDEMPOTENCIA), **contexto()))
+    pedacos = html.split(MARCA_IDEMPOTENCIA)
+    # Todas as chaves de uma vez: uma lista de contratos pode ter milhares de formulários.
+    chaves = os.urandom(16 * (len(pedacos) - 1)).hex()
+    return Markup(''.join(pedaco + HTML_CAMPO_IDEMPOTENCIA.format(chaves[32 * i:32 * i + 32])
+                          for i, pedaco in enumerate(pedacos[:-1])) + pedacos[-1])
+
+def paginar_extrato(sala, jogador_id=None, antes=None, limite=ITENS_POR_PAGINA):
+    """Paginação por cursor (keyset) sobre o id monotônico das transações.
+
+    Extrato do jogador (ou auditoria do banco, com jogador_id=None). Retorna as
+    `limite` transações mais novas com id < `antes` (mais novas primeiro) e o
+    cursor da página seguinte, ou None quando não há transações mais antigas.
+    """
+    if sala.modo_persistencia in MODOS_SQLITE:
+        return sala.armazenamento.transacoes(jogador_id, antes, limite)
+    posicoes = range(len(sala.ledger)) if jogador_id is None else sala.partida[jogador_id]['historico_idx']
+    fim = len(posicoes)
+    if antes is not None:
+        fim = bisect_left(posicoes, sala.ledger.posicao_do_id(antes))
+    inicio = max(0, fim - limite)
+    pagina = [sala.ledger[p] for p in reversed(posicoes[inicio:fim])]
+    cursor = pagina[-1]['id'] if inicio > 0 else None
+    return pagina, cursor
 
 # --- ROTAS ---
 
-@app.route('/', methods=['GET', 'POST'])
+@app.route('/sala/<sala_id>/', methods=['GET', 'POST'])
 def dashboard():
-    global PARTIDA, MANCHETES_VIGENTES
+    sala = g.sala
     if request.method == 'POST' and request.form.get('action') == 'iniciar':
         jogadores_data = []
         for key, value in request.form.items():
@@ -143,98 +380,292 @@ def dashboard():
             flash("Mínimo de 2 jogadores.", 'error')
             return redirect(url_for('dashboard'))
 
-        saldo_ini = int(request.form.get('saldo_inicial', SALDO_INICIAL))
-        PARTIDA = {'Banco': {'historico': [], 'poupanca_trancada': False}, 'timestamp': 0}
-        MANCHETES_VIGENTES = []
-        
-        # SORTEIO DE OBJETIVOS (CORREÇÃO CRÍTICA)
-        pool_objetivos = OBJETIVOS_LISTA.copy()
-        random.shuffle(pool_objetivos)
-        
-        for p in jogadores_data:
-            player_id = str(uuid.uuid4())
-            obj = pool_objetivos.pop() if pool_objetivos else "Dominar o Mercado: R$ 1M de saldo total."
-            PARTIDA[player_id] = {'name': p['name'], 'saldo': saldo_ini, 'historico': [], 'color': p['color'], 'poupanca': 0, 'pin': None, 'objetivo': obj}
-        
-        save_game_state()
+        iniciar_partida(sala, jogadores_data, int(request.form.get('saldo_inicial', SALDO_INICIAL)))
         return redirect(url_for('dashboard'))
     
-    jogadores = [(id, d['name']) for id, d in PARTIDA.items() if id not in ('Banco', 'timestamp')]
-    return render_template('dashboard.html', game_active=('Banco' in PARTIDA), jogadores=jogadores, PARTIDA=PARTIDA, PRESET_COLORS=PRESET_COLORS, SALDO_INICIAL=SALDO_INICIAL)
+    jogadores = [(id, d['name']) for id, d in sala.partida.items() if id not in ('Banco', 'timestamp')]
+    return render_template('dashboard.html', sala_id=sala.id, game_active=('Banco' in sala.partida), jogadores=jogadores, PARTIDA=sala.partida, PRESET_COLORS=PRESET_COLORS, SALDO_INICIAL=SALDO_INICIAL)
 
-@app.route('/banco/gerar_manchete', methods=['POST'])
+@app.route('/sala/<sala_id>/banco/gerar_manchete', methods=['POST'])
 def gerar_manchete():
-    global MANCHETES_VIGENTES
-    
-    nova = obter_proxima_manchete().copy()
-    
-    nova['id'] = str(uuid.uuid4())[:8]
-    nova['data_hora'] = time.strftime('%H:%M')
-    
-    MANCHETES_VIGENTES.insert(0, nova)
-    MANCHETES_VIGENTES = MANCHETES_VIGENTES[:4]
-    
-    save_game_state()
-    flash(f"URGENTE: {nova['titulo']}!", "warning")
+    nova = sortear_manchete(g.sala)
+    if nova is None:
+        flash("Erro: Não há manchetes no conteúdo do jogo (veja o log do servidor).", 'error')
+    else:
+        flash(f"URGENTE: {nova['titulo']}!", "warning")
     return redirect(url_for('pagina_banco'))
 
-@app.route('/jogador/<player_id>')
+@app.route('/sala/<sala_id>/banco/manchete/<manchete_id>/efeito', methods=['GET', 'POST'])
+def efeito_manchete(manchete_id):
+    """Prévia do efeito de uma manchete (GET) e confirmação pelo banco (POST)."""
+    sala = g.sala
+    if not session.get(chave_banco()): return redirect(url_for('banco_login'))
+
+    beneficiario_id = request.values.get('jogador') or None
+    if request.method == 'POST':
+        mensagem = aplicar_efeito_manchete(sala, manchete_id, beneficiario_id, request.form.get('versao'))
+        if "Erro" not in mensagem:
+            flash(mensagem, 'success')
+            return redirect(url_for('pagina_banco'))
+        flash(mensagem, 'error')
+        return redirect(url_for('efeito_manchete', manchete_id=manchete_id, jogador=beneficiario_id))
+
+    # A versão é lida antes do cálculo: se algo mudar no meio, a confirmação é recusada.
+    versao = versao_do_efeito(sala)
+    manchete, transferencias = efeito_da_manchete(sala, manchete_id, beneficiario_id)
+    if manchete is None or 'regra' not in manchete:
+        flash("Erro: Manchete fora de vigência ou sem efeito automático.", 'error')
+        return redirect(url_for('pagina_banco'))
+
+    saldos = {pid: dados['saldo'] for pid, dados in sala.jogadores()}
+    for remetente_id, recebedor_id, valor in transferencias:
+        if remetente_id != 'Banco': saldos[remetente_id] -= valor
+        if recebedor_id != 'Banco': saldos[recebedor_id] += valor
+    id_to_name = nomes_por_id(sala, 'Banco Central')
+    return render_template('efeito_manchete.html',
+                           MANCHETE=manchete,
+                           TRANSFERENCIAS=transferencias,
+                           NEGATIVOS=[id_to_name[pid] for pid, saldo in saldos.items() if saldo < 0],
+                           VERSAO=versao,
+                           beneficiario_id=beneficiario_id,
+                           jogadores_data=dict(sala.jogadores()),
+                           id_to_name=id_to_name)
+
+@app.route('/sala/<sala_id>/jogador/<player_id>')
 def pagina_jogador(player_id):
-    verificar_encerramento_leilao()
+    sala = g.sala
     if not session.get(f'auth_{player_id}'): 
         return redirect(url_for('jogador_auth', player_id=player_id))
     
-    dados = PARTIDA.get(player_id)
+    dados = sala.partida.get(player_id)
     if not dados: 
         return redirect(url_for('dashboard'))
+    avisar_lance_pendente(player_id)
 
-    destinatarios = [('Banco', 'Banco')] + [(id, d['name']) for id, d in PARTIDA.items() if id not in ('Banco', player_id, 'timestamp')]
-    historico_ordenado = sorted(dados['historico'], key=lambda x: x['id'], reverse=True)
-    
-    id_to_name = {id: data['name'] for id, data in PARTIDA.items() if id not in ('Banco', 'timestamp')}
-    id_to_name['Banco'] = 'Banco'
+    antes = request.args.get('antes', type=int)
+    id_to_name = nomes_por_id(sala)
+
+    def extrato():
+        historico, cursor = paginar_extrato(sala, player_id, antes)
+        return dict(player_id=player_id, historico=historico, antes=antes, cursor=cursor, id_to_name=id_to_name)
+
+    # Só a primeira página do extrato vai para o cache; as anteriores vêm pela rolagem.
+    if antes is None:
+        extrato_html = fragmento(sala, ('extrato', player_id), (player_id,), '_extrato_jogador.html', extrato)
+    else:
+        extrato_html = Markup(render_template('_extrato_jogador.html', **extrato()))
+    caixas_leilao = [
+        fragmento(sala, ('leilao_jogador', leilao['id'], player_id), (f"leilao:{leilao['id']}", player_id), '_leilao_jogador.html',
+                  lambda leilao=leilao: dict(leilao=leilao, player_id=player_id, dados_jogador=dados))
+        for leilao in sorted(sala.leiloes.values(), key=lambda l: l['expira_em'])
+    ]
+    contratos_html = fragmento(sala, ('cobrancas_jogador', player_id), ('cobrancas',), '_cobrancas_jogador.html', lambda: dict(
+        player_id=player_id, id_to_name=id_to_name, **cobrancas_por_jogador(sala).get(player_id, {'dividas': [], 'creditos': []})))
 
     return render_template('jogador.html', 
                            player_id=player_id, 
                            dados_jogador=dados,
-                           destinatarios=destinatarios,
-                           historico=historico_ordenado,
+                           destinatarios=destinatarios_de(sala, player_id),
+                           EXTRATO=extrato_html,
                            id_to_name=id_to_name,
-                           MANCHETES_VIGENTES=MANCHETES_VIGENTES,
-                           LEILAO_ATUAL=LEILAO_ATUAL,
-                           COBRANCAS_PARCELADAS=COBRANCAS_PARCELADAS,
-                           SOLICITACOES_SALARIO=SOLICITACOES_SALARIO,
-                           partida=PARTIDA)
-
-@app.route('/leilao/lance/<player_id>', methods=['POST'])
-def dar_lance(player_id):
-    global LEILAO_ATUAL
-    verificar_encerramento_leilao()
-    if not LEILAO_ATUAL.get('ativo'):
-        flash("Leilão encerrado.", 'error')
-        return redirect(url_for('pagina_jogador', player_id=player_id))
+                           MANCHETES_VIGENTES=sala.manchetes_vigentes,
+                           CAIXAS_LEILAO=caixas_leilao,
+                           CONTRATOS=contratos_html,
+                           SOLICITACOES_SALARIO=sala.solicitacoes_salario,
+                           POSSES=sala.posses,
+                           CLASSE_ACOES=CLASSE_ACOES,
+                           partida=sala.partida)
+
+@app.route('/sala/<sala_id>/jogador/<player_id>/extrato')
+def extrato_jogador(player_id):
+    """Fragmento HTML com a próxima página do extrato (rolagem infinita)."""
+    sala = g.sala
+    if not session.get(f'auth_{player_id}') or player_id not in sala.partida:
+        return '', 403
+    antes = request.args.get('antes', type=int)
+    historico, cursor = paginar_extrato(sala, player_id, antes)
+    return render_template('_extrato_jogador.html', player_id=player_id, historico=historico,
+                           antes=antes, cursor=cursor, id_to_name=nomes_por_id(sala))
+
+@app.route('/sala/<sala_id>/jogador/<player_id>/eventos')
+def eventos_jogador(player_id):
+    """Fluxo SSE do jogador: lances, saldo, manchetes e respostas do banco."""
+    sala = g.sala
+    if not session.get(f'auth_{player_id}') or player_id not in sala.partida:
+        return '', 403
+    fluxo = transmitir_eventos(sala, (player_id, 'todos'))
+    return Response(stream_with_context(fluxo), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def abrir_leilao(sala, propriedade, lance_inicial, duracao=LEILAO_DURACAO, extensao=LEILAO_EXTENSAO):
+    """Abre um leilão (valores já validados) e agenda o fechamento. Retorna o id."""
+    leilao_id = str(uuid.uuid4())[:8]
+    # Propriedades do catálogo ficam com o nome oficial, para o registro de posses.
+    propriedade = (CONTEUDO.atual().catalogo.buscar(propriedade) or {'nome': propriedade})['nome']
+    leilao = {
+        'id': leilao_id,
+        'ativo': True,
+        'propriedade': propriedade,
+        'lance_minimo': lance_inicial,
+        'lance_atual': lance_inicial,
+        'jogador_atual_id': None,
+        'jogador_atual_nome': None,
+        'expira_em': time.time() + duracao,
+        'extensao': extensao,
+        'total_lances': 0
+    }
+    with sala.lock_leilao:
+        sala.leiloes = {**sala.leiloes, leilao_id: leilao}
+        sala.persistir('leilao', id=leilao_id, v=leilao)
+        agendar_encerramento(sala, leilao_id)
+        sala.eventos.publicar('leilao_iniciado', {'id': leilao_id, 'propriedade': propriedade, 'lance_atual': lance_inicial}, 'todos')
+    return leilao_id
+
+def conferir_lance(sala, leilao_id, player_id, valor, instante):
+    """Confere um lance contra o estado atual. Retorna (mensagem de recusa ou None, valor em int)."""
+    leilao = sala.leiloes.get(leilao_id)
+    # Chegou depois do prazo: não vale, mesmo que o martelo ainda não tenha batido.
+    if not leilao or instante >= leilao['expira_em']:
+        return "Leilão encerrado.", None
     try:
-        lance = int(request.form['lance'])
-        if PARTIDA[player_id]['saldo'] < lance or lance <= LEILAO_ATUAL['lance_atual']:
-            flash("Saldo insuficiente ou lance baixo.", 'error')
-        else:
-            h = LEILAO_ATUAL.get('ultimos_lances', [])
-            h.insert(0, {'nome': PARTIDA[player_id]['name'], 'valor': lance})
-            LEILAO_ATUAL.update({'lance_atual': lance, 'jogador_atual_id': player_id, 'jogador_atual_nome': PARTIDA[player_id]['name'], 'expira_em': time.time() + 30, 'ultimos_lances': h[:3]})
-            save_game_state()
-    except: flash("Erro no lance.", 'error')
+        valor = int(valor)
+        if sala.partida[player_id]['saldo'] < valor or valor <= leilao['lance_atual']:
+            return "Saldo insuficiente ou lance baixo.", None
+    except (TypeError, ValueError, KeyError):
+        return "Erro no lance.", None
+    return None, valor
+
+def aplicar_lance(sala, lance):
+    """Aplica na memória um lance tirado da fila (com lock_leilao). Retorna a mensagem de recusa, ou None."""
+    erro, valor = conferir_lance(sala, lance.leilao_id, lance.player_id, lance.valor, lance.recebido_em)
+    if erro:
+        return erro
+    leilao = sala.leiloes[lance.leilao_id]
+    nome = sala.partida[lance.player_id]['name']
+    h = [{'nome': nome, 'valor': valor}] + leilao.get('ultimos_lances', [])
+    # Anti-sniping: um lance sempre deixa pelo menos `extensao` segundos, contados da chegada dele.
+    expira_em = max(leilao['expira_em'], lance.recebido_em + leilao.get('extensao', LEILAO_EXTENSAO))
+    leilao = dict(leilao, lance_atual=valor, jogador_atual_id=lance.player_id, jogador_atual_nome=nome, expira_em=expira_em,
+                  ultimos_lances=h[:3], total_lances=leilao.get('total_lances', 0) + 1)
+    sala.leiloes = {**sala.leiloes, lance.leilao_id: leilao}
+    return None
+
+def resolver_lances(grupo):
+    """Consumidor da fila de lances: aplica os de cada sala em ordem, gravando e avisando uma vez por leilão."""
+    por_sala = {}
+    for lance in grupo:
+        por_sala.setdefault(lance.sala, []).append(lance)
+    try:
+        for sala, lances in por_sala.items():
+            with sala.lock_leilao:
+                prazos = {}
+                for lance in lances:
+                    prazo_anterior = sala.leiloes.get(lance.leilao_id, {}).get('expira_em')
+                    lance.erro = aplicar_lance(sala, lance)
+                    if lance.erro is None:
+                        prazos.setdefault(lance.leilao_id, prazo_anterior)
+                for leilao_id, prazo_anterior in prazos.items():
+                    leilao = sala.leiloes[leilao_id]
+                    try:
+                        sala.persistir('leilao', id=leilao_id, v=leilao, adiar_compactacao=True)
+                    except ErroPersistencia:
+                        # Os lances já valem na memória (a sala suja é regravada inteira depois), mas quem deu precisa saber.
+                        for lance in lances:
+                            if lance.leilao_id == leilao_id and lance.erro is None:
+                                lance.erro = "Erro: o lance não foi gravado no disco. Confira o leilão antes de repetir."
+                    if leilao['expira_em'] > prazo_anterior:
+                        agendar_encerramento(sala, leilao_id)
+                    sala.eventos.publicar('lance', {k: leilao[k] for k in ('id', 'lance_atual', 'jogador_atual_nome', 'expira_em', 'ultimos_lances')}, 'todos')
+            if sala.compactacao_pendente:
+                # O snapshot inteiro fica para o agendador: regravado aqui, pararia os lances de todas as salas.
+                SALAS.reter(sala)
+                AGENDADOR.agendar(time.time(), compactar_sala, sala)
+            for lance in lances:
+                sala.eventos.publicar('lance_resultado', {
+                    'seq': lance.seq, 'leilao_id': lance.leilao_id, 'aceito': lance.erro is None,
+                    'mensagem': mensagem_lance(lance.erro, lance.valor)
+                }, lance.player_id)
+    finally:
+        for lance in grupo:
+            SALAS.soltar(lance.sala)
+
+def compactar_sala(sala):
+    """Tarefa do agendador: a compactação que a fila de lances deixou pendente (a sala vem retida)."""
+    try:
+        if sala.compactacao_pendente:
+            sala.salvar()
+    finally:
+        SALAS.soltar(sala)
+
+def mensagem_lance(erro, valor):
+    """Resultado de um lance já resolvido pela fila, como o jogador lê."""
+    return erro or f"Lance de R$ {format_brl(valor)} aceito!"
+
+LANCES = FilaLances(resolver_lances)
+
+def enviar_lance(sala, leilao_id, player_id, valor):
+    """Põe o lance na fila, sem esperar. Retorna (mensagem de recusa, None) ou (None, Lance na fila).
+
+    Um lance que já não vale contra o estado de agora é recusado antes da fila;
+    a decisão final é do consumidor, com os lances na ordem de chegada.
+    """
+    erro, _ = conferir_lance(sala, leilao_id, player_id, valor, time.time())
+    if erro:
+        return erro, None
+    return None, enfileirar_lance(sala, leilao_id, player_id, valor)
+
+def enfileirar_lance(sala, leilao_id, player_id, valor):
+    # A sala fica retida até o consumidor resolver o lance (resolver_lances solta).
+    SALAS.reter(sala)
+    return LANCES.enviar(sala, leilao_id, player_id, valor)
+
+def registrar_lance(sala, leilao_id, player_id, valor):
+    """Dá um lance e espera a fila resolvê-lo. Retorna a mensagem de erro, ou None se o lance valeu.
+
+    Para scripts e benchmarks; as rotas usam enviar_lance.
+    """
+    lance = enfileirar_lance(sala, leilao_id, player_id, valor)
+    lance.esperar()
+    return lance.erro
+
+@app.route('/sala/<sala_id>/leilao/<leilao_id>/lance/<player_id>', methods=['POST'])
+def dar_lance(leilao_id, player_id):
+    erro, lance = enviar_lance(g.sala, leilao_id, player_id, request.form.get('lance'))
+    if erro:
+        flash(erro, 'error')
+    else:
+        # Sem esperar a fila: o resultado chega pelo SSE e, sem ele, no aviso da próxima página (avisar_lance_pendente).
+        session[chave_lance_pendente(player_id)] = {'seq': lance.seq, 'avisado': False}
     return redirect(url_for('pagina_jogador', player_id=player_id))
 
-@app.route('/banco_login', methods=['GET', 'POST'])
+def chave_lance_pendente(player_id):
+    return f'lance_{g.sala.id}_{player_id}'
+
+def avisar_lance_pendente(player_id):
+    """Aviso do último lance dado pelo formulário: o resultado, se a fila já o resolveu; senão, que foi enviado."""
+    chave = chave_lance_pendente(player_id)
+    pendente = session.get(chave)
+    if not pendente:
+        return
+    resultado = LANCES.resultado(pendente['seq'])
+    if resultado is not None:
+        session.pop(chave)
+        flash(mensagem_lance(*resultado), 'error' if resultado[0] else 'success')
+    elif not pendente['avisado']:
+        session[chave] = dict(pendente, avisado=True)
+        flash(f"Lance nº {pendente['seq']} enviado: o leilão mostra se ele venceu.", 'success')
+
+@app.route('/sala/<sala_id>/banco_login', methods=['GET', 'POST'])
 def banco_login():
-    if 'Banco' not in PARTIDA:
+    sala = g.sala
+    if 'Banco' not in sala.partida:
         flash("Partida não iniciada.", 'error')
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
         pin = request.form['pin']
         if pin == BANK_PIN:
-            session['bank_logged_in'] = True
+            session[chave_banco()] = True
             flash("Bem vindo ao Banco Central!", 'success')
             return redirect(url_for('pagina_banco'))
         else:
@@ -244,51 +675,12 @@ def banco_login():
     # GET request: Exibir o formulário de login
     return render_template('banco_login.html')
 
-@app.route('/banco_logout')
+@app.route('/sala/<sala_id>/banco_logout')
 def banco_logout():
-    session.pop('bank_logged_in', None)
+    session.pop(chave_banco(), None)
     flash("Sessão do Banco encerrada.", 'success')
     return redirect(url_for('dashboard'))
 
-# --- FUNÇÕES DE PERSISTÊNCIA DE DADOS (NOVAS) ---
-
-def load_game_state():
-    """Carrega o estado do jogo do arquivo JSON, se existir."""
-    global PARTIDA, LEILAO_ATUAL, COBRANCAS_PARCELADAS
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                PARTIDA = data.get('partida', {})
-                LEILAO_ATUAL = data.get('leilao', {})
-                COBRANCAS_PARCELADAS = data.get('cobrancas_parceladas', {})
-            print(f"Estado do jogo carregado de {DATA_FILE}.")
-        except Exception as e:
-            print(f"Erro ao carregar o estado do jogo: {e}. Iniciando nova partida vazia.")
-            PARTIDA = {}
-            LEILAO_ATUAL = {}
-            COBRANCAS_PARCELADAS = {}
-    else:
-        print("Arquivo de estado do jogo não encontrado. Iniciando nova partida vazia.")
-        PARTIDA = {}
-        LEILAO_ATUAL = {}
-        COBRANCAS_PARCELADAS = {}
-
-def save_game_state():
-    """Salva o estado atual do jogo no arquivo JSON."""
-    global PARTIDA, LEILAO_ATUAL, COBRANCAS_PARCELADAS
-    try:
-        data_to_save = {
-            'partida': PARTIDA,
-            'leilao': LEILAO_ATUAL,
-            'cobrancas_parceladas': COBRANCAS_PARCELADAS
-        }
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data_to_save, f, indent=4)
-        print(f"Estado do jogo salvo em {DATA_FILE}.")
-    except Exception as e:
-        print(f"Erro ao salvar o estado do jogo: {e}")
-
 # --- FUNÇÕES DE LÓGICA DO JOGO ---
 
 def calcular_valor_parcela(valor_total, num_parcelas):
@@ -301,15 +693,17 @@ def calcular_valor_parcela(valor_total, num_parcelas):
     
     return parcela_1, valor_parcela_outras
 
-def criar_parcelamento(credor_id, devedor_id, valor_total, num_parcelas):
-    global COBRANCAS_PARCELADAS
+@com_trava
+def criar_parcelamento(sala, credor_id, devedor_id, valor_total, num_parcelas):
     
     try:
         valor_total = int(valor_total)
         num_parcelas = int(num_parcelas)
         if valor_total <= 0 or num_parcelas <= 0 or num_parcelas > 12:
             return "Erro: Valores inválidos. O número de parcelas deve ser entre 1 e 12."
-    except ValueError:
+        if valor_total > VALOR_MAXIMO:
+            return "Erro: O valor passa do limite do banco."
+    except (TypeError, ValueError):
         return "Erro: Valores devem ser números inteiros."
         
     if credor_id == devedor_id:
@@ -319,7 +713,7 @@ def criar_parcelamento(credor_id, devedor_id, valor_total, num_parcelas):
     
     installment_id = str(uuid.uuid4())
     
-    COBRANCAS_PARCELADAS[installment_id] = {
+    cobranca = {
         'devedor_id': devedor_id,
         'credor_id': credor_id,
         'valor_total': valor_total,
@@ -328,13 +722,14 @@ def criar_parcelamento(credor_id, devedor_id, valor_total, num_parcelas):
         'valor_primeira_parcela': parcela_1,
         'valor_outras_parcelas': valor_parcela_outras
     }
-    save_game_state()
+    sala.cobrancas_parceladas = {**sala.cobrancas_parceladas, installment_id: cobranca}
+    sala.persistir('cobranca', id=installment_id, v=cobranca)
     return f"Parcelamento criado! R$ {format_brl(valor_total)} em {num_parcelas}x (Primeira de R$ {format_brl(parcela_1)})."
 
-def pagar_parcela(devedor_id, installment_id):
-    global COBRANCAS_PARCELADAS
+@com_trava
+def pagar_parcela(sala, devedor_id, installment_id):
     
-    cobranca = COBRANCAS_PARCELADAS.get(installment_id)
+    cobranca = sala.cobrancas_parceladas.get(installment_id)
     
     # Validações
     if not cobranca: return "Erro: Cobrança parcelada não encontrada."
@@ -347,16 +742,12 @@ def pagar_parcela(devedor_id, installment_id):
     valor_parcela = cobranca['valor_primeira_parcela'] if num_pagas == 0 else cobranca['valor_outras_parcelas']
         
     # Verificar Saldo (reusa a lógica de verificação de saldo da transação individual)
-    saldo_devedor = PARTIDA[devedor_id]['saldo']
+    saldo_devedor = sala.partida[devedor_id]['saldo']
     if saldo_devedor < valor_parcela:
         return f"Erro: Saldo R$ {format_brl(saldo_devedor)} insuficiente para pagar a parcela de R$ {format_brl(valor_parcela)}."
 
-    # Executar a Transação
-    PARTIDA[devedor_id]['saldo'] -= valor_parcela
-    PARTIDA[cobranca['credor_id']]['saldo'] += valor_parcela
-    
-    # Registrar a transação (Débito e Crédito)
-    registrar_transacao(devedor_id, cobranca['credor_id'], valor_parcela) 
+    # Executar e registrar a transação (Débito e Crédito)
+    registrar_transacao(sala, devedor_id, cobranca['credor_id'], valor_parcela) 
     
     # Atualizar o estado da cobrança
     cobranca['num_parcelas_pagas'] += 1
@@ -365,56 +756,49 @@ def pagar_parcela(devedor_id, installment_id):
     num_restante = num_total - cobranca['num_parcelas_pagas']
     
     if num_restante == 0:
-        del COBRANCAS_PARCELADAS[installment_id] # Remover a cobrança quitada
-        save_game_state()
+        # Remover a cobrança quitada
+        sala.cobrancas_parceladas = {k: v for k, v in sala.cobrancas_parceladas.items() if k != installment_id}
+        sala.persistir('cobranca', id=installment_id, v=None)
         return f"Parcelamento quitado! Parabéns!"
         
-    save_game_state()
+    sala.persistir('cobranca', id=installment_id, v=cobranca)
     return f"Parcela paga com sucesso! Restam {num_restante} de {num_total}."
 
-def format_brl(value):
-    """Formata um número inteiro para o formato BRL com separador de milhar (ex: 1.500)."""
-    if isinstance(value, str):
-        try:
-            value = int(value)
-        except ValueError:
-            return value # Retorna o valor original se não puder ser convertido
-    
-    # Usa a formatação local para o Brasil
-    # No seu ambiente Python 3.13, isto deve funcionar bem.
-    # Ex: 1500 -> 1.500
-    return f"{value:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".")
-
-def transferir_poupanca(player_id, valor, para_poupanca=True):
+@com_trava
+def transferir_poupanca(sala, player_id, valor, para_poupanca=True):
     """Transfere valor entre saldo e poupança de um jogador."""
     try:
         valor = int(valor)
         if valor <= 0: return "Erro: Valor deve ser positivo."
-    except ValueError: return "Erro: Valor inválido."
+    except (TypeError, ValueError): return "Erro: Valor inválido."
 
-    jogador = PARTIDA.get(player_id)
+    jogador = sala.partida.get(player_id)
     if not jogador: return "Erro: Jogador não encontrado."
     
     if para_poupanca: # Saldo -> Poupança
         if jogador['saldo'] < valor: return "Erro: Saldo insuficiente para investir."
-        jogador['saldo'] -= valor
-        jogador['poupanca'] += valor
+        sala.atualizar_jogador(player_id, {'saldo': jogador['saldo'] - valor, 'poupanca': jogador['poupanca'] + valor})
+        sala.persistir('jogador', id=player_id, campos={'saldo': jogador['saldo'], 'poupanca': jogador['poupanca']})
+        publicar_saldos(sala, player_id)
         return f"R$ {format_brl(valor)} investido na poupança com sucesso!"
     else: # Poupança -> Saldo (só se não estiver trancado)
-        if PARTIDA['Banco']['poupanca_trancada']: return "Erro: Poupança está trancada. Não é possível resgatar."
+        if sala.partida['Banco']['poupanca_trancada']: return "Erro: Poupança está trancada. Não é possível resgatar."
         if jogador['poupanca'] < valor: return "Erro: Valor de resgate maior que a poupança."
-        jogador['saldo'] += valor
-        jogador['poupanca'] -= valor
+        sala.atualizar_jogador(player_id, {'saldo': jogador['saldo'] + valor, 'poupanca': jogador['poupanca'] - valor})
+        sala.persistir('jogador', id=player_id, campos={'saldo': jogador['saldo'], 'poupanca': jogador['poupanca']})
+        publicar_saldos(sala, player_id)
         return f"R$ {format_brl(valor)} resgatado da poupança com sucesso!"
 
-def trancar_poupanca(trancar):
+@com_trava
+def trancar_poupanca(sala, trancar):
     """Tranca/Destranca a poupança globalmente."""
-    PARTIDA['Banco']['poupanca_trancada'] = trancar
-    save_game_state()
+    sala.partida['Banco']['poupanca_trancada'] = trancar
+    sala.persistir('banco', campos={'poupanca_trancada': trancar})
     return "Poupança trancada com sucesso." if trancar else "Poupança destrancada com sucesso."
 
-def aplicar_rendimento(percentual):
-    if not PARTIDA['Banco']['poupanca_trancada']: 
+@com_trava
+def aplicar_rendimento(sala, percentual):
+    if not sala.partida['Banco']['poupanca_trancada']: 
         return "Erro: Poupança não está trancada."
     try:
         percentual = float(percentual)
@@ -423,103 +807,142 @@ def aplicar_rendimento(percentual):
     
     fator = percentual / 100
     total_movimentado = 0
-    for player_id, data in PARTIDA.items():
+    for player_id, data in sala.partida.items():
         if player_id not in ('Banco', 'timestamp'):
             rendimento = int(data['poupanca'] * fator)
-            data['poupanca'] += rendimento
+            sala.atualizar_jogador(player_id, {'poupanca': data['poupanca'] + rendimento})
             total_movimentado += rendimento
-    save_game_state()
+            sala.persistir('jogador', id=player_id, campos={'poupanca': data['poupanca']})
+    publicar_saldos(sala, *(pid for pid, _ in sala.jogadores()))
     tipo = "Rendimento" if percentual >= 0 else "Taxa/Deflação"
     return f"{tipo} de {percentual}% aplicado! Total: R$ {format_brl(total_movimentado)}."
 
-app.jinja_env.filters['format_brl'] = format_brl
-
-def registrar_transacao(remetente_id, recebedor_id, valor):
+@com_trava
+def registrar_transacao(sala, remetente_id, recebedor_id, valor):
     """
-    Função para registrar uma transação.
+    Função para registrar uma transação: movimenta os saldos, grava no journal
+    e avisa as páginas abertas dos envolvidos.
     """
-    agora = PARTIDA.get('timestamp', 0) + 1
-    PARTIDA['timestamp'] = agora
-    
-    transacao = {
-        'id': agora,
-        'valor': valor,
-        'remetente_id': remetente_id,
-        'recebedor_id': recebedor_id,
-        'timestamp': agora
-    }
-    
-    # Adiciona ao histórico do remetente
-    if remetente_id != 'Banco':
-        PARTIDA[remetente_id]['historico'].append(transacao)
-    
-    # Adiciona ao histórico do recebedor
-    if recebedor_id != 'Banco':
-        PARTIDA[recebedor_id]['historico'].append(transacao)
-    
-    # Adiciona ao histórico geral do Banco
-    PARTIDA['Banco']['historico'].append(transacao)
-
-def executar_transacao(remetente_id, recebedor_id, valor):
+    agora = sala.partida.get('timestamp', 0) + 1
+    data_hora = time.strftime('%H:%M:%S')
+    sala.aplicar_transacao(agora, remetente_id, recebedor_id, valor, data_hora)
+    sala.persistir('tx', id=agora, r=remetente_id, d=recebedor_id, v=valor, h=data_hora)
+    publicar_saldos(sala, remetente_id, recebedor_id)
+
+@com_trava
+def executar_transacao(sala, remetente_id, recebedor_id, valor):
     try:
         valor = int(valor)
-    except ValueError:
+    except (TypeError, ValueError):
         return "Erro: O valor deve ser um número inteiro."
     
     if valor <= 0:
         return "Erro: O valor da transação deve ser positivo."
+    if valor > VALOR_MAXIMO:
+        return "Erro: O valor passa do limite do banco."
 
-    if remetente_id != 'Banco':
-        if remetente_id not in PARTIDA:
-            return f"Erro: Remetente ID '{remetente_id}' não encontrado."
-            
-        if PARTIDA[remetente_id]['saldo'] < valor:
-            flash(f"ALERTA: {PARTIDA[remetente_id]['name']} ficou com saldo negativo!", "warning")
-        
-        PARTIDA[remetente_id]['saldo'] -= valor
-    
-    if recebedor_id != 'Banco':
-        if recebedor_id not in PARTIDA:
-            return f"Erro: Recebedor ID '{recebedor_id}' não encontrado."
-        PARTIDA[recebedor_id]['saldo'] += valor
+    if remetente_id != 'Banco' and remetente_id not in sala.partida:
+        return f"Erro: Remetente ID '{remetente_id}' não encontrado."
+    if recebedor_id != 'Banco' and recebedor_id not in sala.partida:
+        return f"Erro: Recebedor ID '{recebedor_id}' não encontrado."
 
-    registrar_transacao(remetente_id, recebedor_id, valor)
-    save_game_state()
+    if remetente_id != 'Banco' and sala.partida[remetente_id]['saldo'] < valor:
+        flash(f"ALERTA: {sala.partida[remetente_id]['name']} ficou com saldo negativo!", "warning")
+
+    registrar_transacao(sala, remetente_id, recebedor_id, valor)
     return "Transação realizada com sucesso!"
 
-def executar_transacao_massa(tipo, valor):
+@com_trava
+def registrar_lote(sala, transferencias, manchetes=None):
+    """
+    Registra várias transferências (remetente_id, recebedor_id, valor) de uma vez:
+    uma única gravação no journal e um único aviso por página aberta.
+    Quem chama já validou o lote inteiro. Com `manchetes`, as manchetes
+    vigentes são trocadas na mesma gravação (efeito de manchete aplicado).
+    """
+    data_hora = time.strftime('%H:%M:%S')
+    registros = []
+    for remetente_id, recebedor_id, valor in transferencias:
+        agora = sala.partida.get('timestamp', 0) + 1
+        sala.aplicar_transacao(agora, remetente_id, recebedor_id, valor, data_hora)
+        registros.append([agora, remetente_id, recebedor_id, valor])
+    extras = {}
+    if manchetes is not None:
+        sala.manchetes_vigentes = extras['manchetes'] = manchetes
+    if registros:
+        sala.persistir('lote', t=registros, h=data_hora, **extras)
+        publicar_saldos(sala, *(pid for t in transferencias for pid in t[:2]))
+    elif extras:
+        sala.persistir('manchetes', v=manchetes)
+    return [r[0] for r in registros]
+
+@com_trava
+def executar_lote(sala, transferencias):
+    """
+    Valida o lote inteiro antes de aplicar qualquer transferência: ou todas
+    entram, ou nenhuma. Saldos que ficarem negativos geram um único alerta.
+    Retorna (mensagem, ids das transações criadas).
+    """
+    ids_validos = {pid for pid, _ in sala.jogadores()} | {'Banco'}
+    lote = []
+    for n, (remetente_id, recebedor_id, valor) in enumerate(transferencias, start=1):
+        # Sem conversão: 1.7 não vira 1, nem true vira 1 (bool é subclasse de int).
+        if type(valor) is not int:
+            return f"Erro na linha {n}: O valor deve ser um número inteiro.", []
+        if valor <= 0:
+            return f"Erro na linha {n}: O valor da transação deve ser positivo.", []
+        if valor > VALOR_MAXIMO:
+            return f"Erro na linha {n}: O valor passa do limite do banco.", []
+        for pid in (remetente_id, recebedor_id):
+            if pid not in ids_validos:
+                return f"Erro na linha {n}: Jogador ID '{pid}' não encontrado.", []
+        if remetente_id == recebedor_id:
+            return f"Erro na linha {n}: Remetente e recebedor são o mesmo.", []
+        lote.append((remetente_id, recebedor_id, valor))
+    if not lote:
+        return "Erro: Nenhuma transferência no lote.", []
+
+    saldos = {pid: dados['saldo'] for pid, dados in sala.jogadores()}
+    for remetente_id, recebedor_id, valor in lote:
+        if remetente_id != 'Banco': saldos[remetente_id] -= valor
+        if recebedor_id != 'Banco': saldos[recebedor_id] += valor
+    negativos = [sala.partida[pid]['name'] for pid, saldo in saldos.items() if saldo < 0]
+    if negativos:
+        flash(f"ALERTA: {', '.join(negativos)} ficou(aram) com saldo negativo!", "warning")
+
+    ids = registrar_lote(sala, lote)
+    total = sum(valor for _, _, valor in lote)
+    return f"Lote de {len(lote)} transferência(s) realizado com sucesso! Total movimentado: R$ {format_brl(total)}.", ids
+
+@com_trava
+def executar_transacao_massa(sala, tipo, valor):
     try:
         valor = int(valor)
-    except ValueError:
+    except (TypeError, ValueError, OverflowError):
         return "Erro: O valor deve ser um número inteiro."
     
     if valor <= 0:
         return "Erro: O valor da transação deve ser positivo."
 
-    jogadores_ativos = [id for id in PARTIDA if id not in ('Banco', 'timestamp')]
+    jogadores_ativos = [id for id, _ in sala.jogadores()]
     
     if tipo == 'COBRAR':
-        for player_id in jogadores_ativos:
-            # 1. Verifica saldo antes de cobrar
-            if PARTIDA[player_id]['saldo'] < valor:
-                flash(f"Aviso: Saldo insuficiente para {PARTIDA[player_id]['name']}. O saldo dele será negativo.", 'warning')
-            
-            PARTIDA[player_id]['saldo'] -= valor # Cobra o valor
-            registrar_transacao(player_id, 'Banco', valor) # Registra (Jogador -> Banco)
-        
+        # Jogador -> Banco; um único aviso para quem ficar negativo
+        mensagem, ids = executar_lote(sala, [(player_id, 'Banco', valor) for player_id in jogadores_ativos])
+        if not ids:
+            return mensagem
         return f"Cobrança de R$ {valor} realizada com sucesso para todos os {len(jogadores_ativos)} jogadores."
 
     elif tipo == 'PAGAR':
-        for player_id in jogadores_ativos:
-            PARTIDA[player_id]['saldo'] += valor # Paga o valor
-            registrar_transacao('Banco', player_id, valor) # Registra (Banco -> Jogador)
-            
+        mensagem, ids = executar_lote(sala, [('Banco', player_id, valor) for player_id in jogadores_ativos])
+        if not ids:
+            return mensagem
         return f"Pagamento de R$ {valor} realizado com sucesso para todos os {len(jogadores_ativos)} jogadores."
     
-    save_game_state()
-    return f"Cobrança de R$ {valor} realizada com sucesso para todos os {len(jogadores_ativos)} jogadores."
+    return "Erro: Tipo de transação em massa desconhecido."
 
-def executar_transacao_percentual(tipo, percentual):
+@com_trava
+def executar_transacao_percentual(sala, tipo, percentual):
     """
     Executa transação em massa baseada em um percentual do saldo atual do jogador.
     """
@@ -531,59 +954,236 @@ def executar_transacao_percentual(tipo, percentual):
         return "Erro: O percentual deve ser um número válido."
         
     fator = percentual / 100
-    jogadores_ativos = [id for id in PARTIDA if id not in ('Banco', 'timestamp')]
-    
-    total_movimentado = 0
+    # Arredonda para baixo/inteiro; quem tem 0 (ou negativo) não entra no lote
+    valores = [(player_id, int(dados['saldo'] * fator)) for player_id, dados in sala.jogadores()]
+    valores = [(player_id, valor) for player_id, valor in valores if valor > 0]
+    total_movimentado = sum(valor for _, valor in valores)
     
     if tipo == 'COBRAR_PCT':
-        for player_id in jogadores_ativos:
-            saldo_jogador = PARTIDA[player_id]['saldo']
-            valor_movimentado = int(saldo_jogador * fator) # Arredonda para baixo/inteiro para simplificar
-            
-            if valor_movimentado > 0:
-                PARTIDA[player_id]['saldo'] -= valor_movimentado
-                registrar_transacao(player_id, 'Banco', valor_movimentado)
-                total_movimentado += valor_movimentado
-        
+        registrar_lote(sala, [(player_id, 'Banco', valor) for player_id, valor in valores])
         return f"Cobrança de {percentual}% (Total R$ {format_brl(total_movimentado)}) realizada com sucesso para todos os jogadores."
 
     elif tipo == 'PAGAR_PCT':
-        for player_id in jogadores_ativos:
-            saldo_jogador = PARTIDA[player_id]['saldo']
-            valor_movimentado = int(saldo_jogador * fator) # Arredonda para baixo/inteiro
-            
-            if valor_movimentado > 0:
-                PARTIDA[player_id]['saldo'] += valor_movimentado
-                registrar_transacao('Banco', player_id, valor_movimentado)
-                total_movimentado += valor_movimentado
-                
+        registrar_lote(sala, [('Banco', player_id, valor) for player_id, valor in valores])
         return f"Pagamento de {percentual}% (Total R$ {format_brl(total_movimentado)}) realizado com sucesso para todos os jogadores."
         
     return "Erro desconhecido na transação percentual."
 
-def get_id_to_name_map():
-    m = {id: data['name'] for id, data in PARTIDA.items() if id not in ('Banco', 'timestamp')}
-    m['Banco'] = 'Banco'
-    return m
-
 # --- ROTAS DA APLICAÇÃO ---
 
-load_game_state()
+def migrar_estado_legado():
+    """Leva o arquivo de estado da versão de partida única para a sala padrão."""
+    destino = os.path.join(SALAS_DIR, f'{SALA_PADRAO}.json')
+    if os.path.exists(destino) or not os.path.exists(DATA_FILE):
+        return
+    os.makedirs(SALAS_DIR, exist_ok=True)
+    shutil.copyfile(DATA_FILE, destino)
+    if os.path.exists(JOURNAL_FILE):
+        shutil.copyfile(JOURNAL_FILE, os.path.join(SALAS_DIR, f'{SALA_PADRAO}.journal'))
+
+migrar_estado_legado()
+SALAS.ao_carregar = agendar_leiloes_da_sala
+SALAS.ao_sincronizar = publicar_mudancas
+
+@app.url_value_preprocessor
+def carregar_sala(endpoint, values):
+    """Resolve o <sala_id> da URL para o estado da sala (carregado sob demanda)."""
+    if values and 'sala_id' in values:
+        # Retida até o fim da requisição: não é despejada no meio dela.
+        g.sala = g.sala_retida = SALAS.obter(values.pop('sala_id'), reter=True)
+        if g.sala is None:
+            abort(404)
+
+@app.teardown_request
+def soltar_sala(erro):
+    # pop: com stream_with_context o teardown roda de novo no fim do fluxo (que retém a sala por conta própria).
+    sala = g.pop('sala_retida', None)
+    if sala is not None:
+        SALAS.soltar(sala)
+
+@app.url_defaults
+def incluir_sala(endpoint, values):
+    """url_for() dentro de uma sala aponta para a mesma sala sem precisar repassar o id."""
+    if 'sala_id' not in values and 'sala' in g and app.url_map.is_endpoint_expecting(endpoint, 'sala_id'):
+        values['sala_id'] = g.sala.id
+
+@app.route('/estatico/<path:nome>')
+def estatico_versionado(nome):
+    """CSS/JS de static/: com o hash no nome, cache de um ano; já comprimido em memória."""
+    arquivo, imutavel = ESTATICOS.buscar(nome)
+    if arquivo is None:
+        abort(404)
+    codificacao = escolher_codificacao(request.accept_encodings)
+    resposta = Response(arquivo[codificacao] if codificacao in arquivo else arquivo['identity'], mimetype=arquivo['tipo'])
+    if codificacao in arquivo:
+        resposta.headers['Content-Encoding'] = codificacao
+    resposta.headers['Cache-Control'] = CACHE_IMUTAVEL if imutavel else 'no-cache'
+    resposta.vary.add('Accept-Encoding')
+    return resposta
+
+app.jinja_env.globals['estatico'] = lambda caminho: url_for('estatico_versionado', nome=ESTATICOS.nome_versionado(caminho))
+def campo_idempotencia():
+    """Campo oculto com uma chave nova: o reenvio do mesmo formulário repete a chave."""
+    return Markup(HTML_CAMPO_IDEMPOTENCIA.format(uuid.uuid4().hex))
+
+app.jinja_env.globals['campo_idempotencia'] = campo_idempotencia
+
+# --- IDEMPOTÊNCIA ---
+
+METRICAS.contador('banco_idempotencia_total', 'POSTs com chave de idempotência, por resultado.')
+
+@app.before_request
+def repetir_requisicao_atendida():
+    """POST com chave já vista: devolve a resposta guardada sem executar a rota de novo."""
+    chave = request.headers.get('Idempotency-Key') or request.form.get(CAMPO_IDEMPOTENCIA) if request.method == 'POST' else None
+    if not chave:
+        return None
+    # A mesma chave em salas diferentes são operações diferentes.
+    chave = f"{g.sala.id if 'sala' in g else ''}:{chave}"
+    situacao, resultado = IDEMPOTENCIA.iniciar(chave, (request.method, request.path))
+    METRICAS.incrementar('banco_idempotencia_total', resultado=situacao)
+    if situacao == NOVA:
+        g.chave_idempotencia = chave
+        g.flashes_antes = len(session.get('_flashes', []))
+        return None
+    if situacao in (CONFLITO, EM_ANDAMENTO):
+        mensagem = ("Erro: chave de idempotência já usada em outra operação." if situacao == CONFLITO
+                    else "Erro: a requisição original ainda está em andamento; tente de novo.")
+        return jsonify(ok=False, mensagem=mensagem), 422 if situacao == CONFLITO else 409
+    corpo, status, cabecalhos, flashes = resultado
+    registrar_evento(logging.INFO, 'requisicao_repetida', metodo=request.method, caminho=request.path, status=status)
+    for categoria, mensagem in flashes:
+        flash(mensagem, categoria)
+    return Response(corpo, status, cabecalhos + [('Idempotent-Replayed', 'true')])
+
+# --- MÉTRICAS ---
+
+METRICAS.contador('banco_requisicoes_total', 'Requisições atendidas, por rota, método e status.')
+METRICAS.histograma('banco_requisicao_segundos', 'Latência das requisições, por rota.')
+METRICAS.histograma('banco_template_segundos', 'Tempo de renderização de cada template.')
+
+def coletar_por_sala(medida):
+    return lambda: [({'sala': sala.id}, medida(sala)) for sala in SALAS.em_memoria() if sala.partida]
+
+METRICAS.medidor('banco_salas_carregadas', 'Salas em memória.', lambda: [({}, len(SALAS.em_memoria()))])
+METRICAS.medidor('banco_ledger_transacoes', 'Transações no ledger de cada sala carregada.', coletar_por_sala(lambda sala: sala.total_transacoes()))
+METRICAS.medidor('banco_leiloes_ativos', 'Leilões em andamento em cada sala carregada.', coletar_por_sala(lambda sala: len(sala.leiloes)))
+METRICAS.medidor('banco_cobrancas_abertas', 'Cobranças parceladas em aberto em cada sala carregada.',
+                 coletar_por_sala(lambda sala: len(sala.cobrancas_parceladas)))
+METRICAS.medidor('banco_lances_pendentes', 'Lances na fila, ainda não resolvidos.', lambda: [({}, LANCES.pendentes())])
+
+@request_started.connect_via(app)
+def iniciar_cronometro(sender, **extra):
+    # Antes do url_value_preprocessor: a carga da sala do disco entra na latência.
+    g.inicio_requisicao = time.perf_counter()
+
+@before_render_template.connect_via(app)
+def iniciar_cronometro_template(sender, template, context, **extra):
+    g.setdefault('inicio_templates', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def medir_template(sender, template, context, **extra):
+    METRICAS.observar('banco_template_segundos', time.perf_counter() - g.inicio_templates.pop(), template=template.name)
+
+# Registrado antes de comprimir_resposta, roda depois dele: a compressão entra na latência.
+@app.after_request
+def medir_requisicao(resposta):
+    duracao = time.perf_counter() - g.inicio_requisicao
+    # A regra (/sala/<sala_id>/banco), não o caminho: uma série por rota, não por sala.
+    rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+    METRICAS.incrementar('banco_requisicoes_total', rota=rota, metodo=request.method, status=resposta.status_code)
+    METRICAS.observar('banco_requisicao_segundos', duracao, rota=rota)
+    registrar_evento(logging.DEBUG, 'requisicao', metodo=request.method, caminho=request.path, status=resposta.status_code,
+                     duracao_ms=duracao * 1000)
+    return resposta
+
+@app.route('/metricas')
+def metricas():
+    """Métricas no formato texto do Prometheus. Exige o login do banco (em qualquer sala)
+    ou o cabeçalho 'Authorization: Bearer <PIN do banco>', para o coletor."""
+    autorizado = (request.headers.get('Authorization') == f'Bearer {BANK_PIN}'
+                  or any(chave.startswith('bank_logged_in_') and valor for chave, valor in session.items()))
+    if not autorizado:
+        return Response('Acesso negado.\n', 401, {'WWW-Authenticate': 'Bearer'}, mimetype='text/plain')
+    return Response(METRICAS.exportar(), mimetype='text/plain', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.after_request
+def comprimir_resposta(resposta):
+    """Comprime HTML e JSON (gzip, ou brotli se instalado). SSE e arquivos passam direto."""
+    if resposta.mimetype not in TIPOS_COMPRIMIVEIS or resposta.direct_passthrough or resposta.is_streamed:
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+    codificacao = escolher_codificacao(request.accept_encodings)
+    if codificacao is None or 'Content-Encoding' in resposta.headers or resposta.status_code in (204, 304):
+        return resposta
+    dados = resposta.get_data()
+    if len(dados) < TAMANHO_MINIMO_COMPRESSAO:
+        return resposta
+    resposta.set_data(comprimir(dados, codificacao))
+    resposta.headers['Content-Encoding'] = codificacao
+    # A representação comprimida não é byte a byte a original: a ETag passa a ser fraca.
+    etag, _ = resposta.get_etag()
+    if etag:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+# Registrado depois de comprimir_resposta, roda antes dele: guarda o corpo ainda sem compressão.
+@app.after_request
+def guardar_resultado_idempotente(resposta):
+    chave = g.pop('chave_idempotencia', None)
+    if chave is None:
+        return resposta
+    if resposta.status_code >= 500 or resposta.is_streamed or resposta.direct_passthrough:
+        IDEMPOTENCIA.abandonar(chave)
+        return resposta
+    # Os avisos (flash) que a rota deixou vão junto: a repetição mostra a mesma mensagem.
+    flashes = session.get('_flashes', [])[g.flashes_antes:]
+    cabecalhos = [(nome, valor) for nome, valor in resposta.headers.items() if nome in ('Location', 'Content-Type', 'ETag')]
+    IDEMPOTENCIA.concluir(chave, (resposta.get_data(), resposta.status_code, cabecalhos, flashes))
+    return resposta
+
+@app.teardown_request
+def liberar_chave_idempotente(erro):
+    # Exceção na rota: a chave não fica presa em andamento até o TTL.
+    chave = g.pop('chave_idempotencia', None)
+    if chave is not None:
+        IDEMPOTENCIA.abandonar(chave)
+
+@app.errorhandler(ErroPersistencia)
+def avisar_falha_gravacao(erro):
+    """A mudança ficou só na memória (ver Sala.persistir): a resposta avisa, em vez de dizer que deu certo."""
+    mensagem = "Erro: a operação não foi gravada no disco. Confira o saldo antes de repetir."
+    if request.is_json or '/api/' in request.path:
+        return jsonify(ok=False, mensagem=mensagem), 500
+    # Formulário: o redirecionamento guarda o aviso com a chave de idempotência, e o reenvio não aplica de novo.
+    flash(mensagem, 'error')
+    return redirect(request.referrer or url_for('dashboard' if 'sala' in g else 'lobby'))
+
+def chave_banco():
+    """Chave de sessão do login do banco: o PIN vale só para a sala atual."""
+    return f'bank_logged_in_{g.sala.id}'
+
+@app.route('/', methods=['GET', 'POST'])
+def lobby():
+    if request.method == 'POST':
+        sala_id = slug_sala(request.form.get('nome', '')) or uuid.uuid4().hex[:6]
+        return redirect(url_for('dashboard', sala_id=sala_id))
+    return render_template('salas.html', salas=SALAS.listar(), SALA_PADRAO=SALA_PADRAO)
 
 # 2. Rota para Excluir (Resetar) o Jogo
-@app.route('/reset', methods=['POST'])
+@app.route('/sala/<sala_id>/reset', methods=['POST'])
 def reset_game():
-    global PARTIDA, LEILAO_ATUAL
-    PARTIDA = {}
-    LEILAO_ATUAL = {}
-    
-    save_game_state()
+    sala = g.sala
+    with sala.lock_leilao, sala.lock:
+        sala.zerar()
+        sala.salvar()
     
     flash("O jogo foi resetado com sucesso! Inicie uma nova partida.", 'success')
     return redirect(url_for('dashboard'))
 
-@app.route('/transacao-unificada', methods=['POST'])
+@app.route('/sala/<sala_id>/transacao-unificada', methods=['POST'])
 def transacao_unificada():
+    sala = g.sala
     value_type = request.form.get('value_type', 'FIXO') 
     action_type_final = request.form['action_type_final']
     target_id = request.form['target_id']
@@ -604,194 +1204,274 @@ def transacao_unificada():
                 flash("Erro: O valor final da transação deve ser positivo.", 'error')
                 return redirect(url_for('pagina_banco'))
                 
-    except ValueError:
+    except (ValueError, OverflowError):
         flash("Erro: Insira números válidos.", 'error')
         return redirect(url_for('pagina_banco'))
 
     if target_id == 'Todos':
         if value_type == 'PCT':
-            mensagem = executar_transacao_percentual(action_type_final + '_PCT', percentual)
+            mensagem = executar_transacao_percentual(sala, action_type_final + '_PCT', percentual)
         else:
-            mensagem = executar_transacao_massa(action_type_final, valor_final)
+            mensagem = executar_transacao_massa(sala, action_type_final, valor_final)
     else:
         if value_type == 'PCT':
-            saldo_alvo = PARTIDA[target_id]['saldo']
-            valor_calculado_pct = int(saldo_alvo * (percentual / 100))
-            
-            if valor_calculado_pct <= 0:
-                flash(f"Erro: {percentual}% do saldo de {PARTIDA[target_id]['name']} é R$ 0. Operação cancelada.", 'error')
-                return redirect(url_for('pagina_banco'))
-            
-            remetente_id = target_id if action_type_final == 'COBRAR' else 'Banco'
-            recebedor_id = 'Banco' if action_type_final == 'COBRAR' else target_id
-            mensagem = executar_transacao(remetente_id, recebedor_id, valor_calculado_pct)
+            with sala.lock:
+                saldo_alvo = sala.partida[target_id]['saldo']
+                valor_calculado_pct = int(saldo_alvo * (percentual / 100))
+                
+                if valor_calculado_pct <= 0:
+                    flash(f"Erro: {percentual}% do saldo de {sala.partida[target_id]['name']} é R$ 0. Operação cancelada.", 'error')
+                    return redirect(url_for('pagina_banco'))
+                
+                remetente_id = target_id if action_type_final == 'COBRAR' else 'Banco'
+                recebedor_id = 'Banco' if action_type_final == 'COBRAR' else target_id
+                mensagem = executar_transacao(sala, remetente_id, recebedor_id, valor_calculado_pct)
             mensagem = f"({percentual}%) " + mensagem
         else:
             remetente_id = target_id if action_type_final == 'COBRAR' else 'Banco'
             recebedor_id = 'Banco' if action_type_final == 'COBRAR' else target_id
-            mensagem = executar_transacao(remetente_id, recebedor_id, valor_final)
+            mensagem = executar_transacao(sala, remetente_id, recebedor_id, valor_final)
 
     flash(mensagem, 'error' if "Erro" in mensagem else 'success')
     return redirect(url_for('pagina_banco'))
 
-@app.route('/jogador/solicitar_salario/<player_id>', methods=['POST'])
-def solicitar_salario(player_id):
-    global SOLICITACOES_SALARIO
-    num_propriedades = int(request.form.get('num_propriedades', 0))
-    
-    SOLICITACOES_SALARIO[player_id] = {
-        'nome': PARTIDA[player_id]['name'],
+@app.route('/sala/<sala_id>/banco/lote', methods=['POST'])
+@app.route('/sala/<sala_id>/api/v1/banco/lote', methods=['POST'])
+def transferencias_em_lote():
+    """
+    Várias transferências numa só requisição, aplicadas de forma atômica.
+    Aceita JSON {"transferencias": [{"de": id, "para": id, "valor": n}, ...]}
+    (ou a lista sozinha); 'Banco' vale como remetente ou recebedor.
+    """
+    sala = g.sala
+    if not session.get(chave_banco()):
+        return jsonify(ok=False, mensagem="Acesso restrito ao Banco."), 403
+    corpo = request.get_json(silent=True)
+    itens = corpo.get('transferencias') if isinstance(corpo, dict) else corpo
+    if not isinstance(itens, list) or not all(isinstance(item, dict) for item in itens):
+        return jsonify(ok=False, mensagem="Erro: Envie uma lista de transferências {de, para, valor}."), 400
+    for indice, item in enumerate(itens):
+        if type(item.get('valor')) is not int:
+            return jsonify(ok=False, indice=indice,
+                           mensagem=f"Erro na transferência {indice}: O valor deve ser um número inteiro, sem conversão."), 400
+
+    mensagem, ids = executar_lote(sala, [(item.get('de'), item.get('para'), item.get('valor')) for item in itens])
+    if not ids:
+        return jsonify(ok=False, mensagem=mensagem), 400
+    return jsonify(ok=True, mensagem=mensagem, ids=ids)
+
+@com_trava
+def pedir_salario(sala, player_id):
+    """Pede o salário ao banco; o valor depende das propriedades do jogador no registro de posses."""
+    num_propriedades = sala.posses.quantas(player_id) - sala.posses.quantas(player_id, classe=CLASSE_ACOES)
+    pedido = {
+        'nome': sala.partida[player_id]['name'],
         'qtd': num_propriedades,
         'valor': 200000 + (num_propriedades * 50000),
         'timestamp': time.time()
     }
-    save_game_state()
-    flash("Solicitação de salário enviada ao Banco Central!", "info")
+    sala.solicitacoes_salario = {**sala.solicitacoes_salario, player_id: pedido}
+    sala.persistir('salario', id=player_id, v=pedido)
+    sala.eventos.publicar('salario_solicitado', {'nome': pedido['nome'], 'valor': pedido['valor']}, 'banco')
+    return "Solicitação de salário enviada ao Banco Central!"
+
+@app.route('/sala/<sala_id>/jogador/solicitar_salario/<player_id>', methods=['POST'])
+def solicitar_salario(player_id):
+    flash(pedir_salario(g.sala, player_id), "info")
     return redirect(url_for('pagina_jogador', player_id=player_id))
 
-@app.route('/banco/aprovar_salario/<player_id>', methods=['POST'])
+@app.route('/sala/<sala_id>/banco/aprovar_salario/<player_id>', methods=['POST'])
 def aprovar_salario(player_id):
-    global SOLICITACOES_SALARIO
-    pedido = SOLICITACOES_SALARIO.pop(player_id, None)
+    sala = g.sala
+    with sala.lock:
+        pedido = sala.solicitacoes_salario.get(player_id)
+        if pedido:
+            sala.solicitacoes_salario = {k: v for k, v in sala.solicitacoes_salario.items() if k != player_id}
+            sala.persistir('salario', id=player_id, v=None)
+            registrar_transacao(sala, 'Banco', player_id, pedido['valor'])
+            sala.eventos.publicar('salario_aprovado', {'valor': pedido['valor']}, player_id)
     
     if pedido:
-        PARTIDA[player_id]['saldo'] += pedido['valor']
-        
-        registrar_transacao('Banco', player_id, pedido['valor'])
         
-        save_game_state()
         flash(f"SALÁRIO LIBERADO: R$ {format_brl(pedido['valor'])} creditados para {pedido['nome']}.", "success")
     else:
         flash("Erro: Solicitação de salário não encontrada ou já processada.", "error")
         
     return redirect(url_for('pagina_banco'))
 
-@app.route('/banco/reprovar_salario/<player_id>', methods=['POST'])
+@app.route('/sala/<sala_id>/banco/reprovar_salario/<player_id>', methods=['POST'])
 def reprovar_salario(player_id):
-    if not session.get('bank_logged_in'): return redirect(url_for('banco_login'))
+    sala = g.sala
+    if not session.get(chave_banco()): return redirect(url_for('banco_login'))
     
-    if player_id in SOLICITACOES_SALARIO:
-        pedido = SOLICITACOES_SALARIO.pop(player_id)
+    with sala.lock:
+        pedido = sala.solicitacoes_salario.get(player_id)
+        if pedido:
+            sala.solicitacoes_salario = {k: v for k, v in sala.solicitacoes_salario.items() if k != player_id}
+            sala.persistir('salario', id=player_id, v=None)
+            sala.eventos.publicar('salario_reprovado', {'valor': pedido['valor']}, player_id)
+    if pedido:
         flash(f"Pedido de salário de {pedido['nome']} REPROVADO pelo Banco.", "warning")
-        save_game_state()
     return redirect(url_for('pagina_banco'))
 
-@app.route('/banco/deletar_divida/<installment_id>', methods=['POST'])
+@app.route('/sala/<sala_id>/banco/deletar_divida/<installment_id>', methods=['POST'])
 def deletar_divida(installment_id):
-    if not session.get('bank_logged_in'): return redirect(url_for('banco_login'))
+    sala = g.sala
+    if not session.get(chave_banco()): return redirect(url_for('banco_login'))
     
-    if installment_id in COBRANCAS_PARCELADAS:
-        divida = COBRANCAS_PARCELADAS.pop(installment_id)
-        flash("Contrato de dívida anulado com sucesso.", "success")
-        save_game_state()
+    with sala.lock:
+        if installment_id in sala.cobrancas_parceladas:
+            sala.cobrancas_parceladas = {k: v for k, v in sala.cobrancas_parceladas.items() if k != installment_id}
+            sala.persistir('cobranca', id=installment_id, v=None)
+            flash("Contrato de dívida anulado com sucesso.", "success")
+    return redirect(url_for('pagina_banco'))
+
+@app.route('/sala/<sala_id>/banco/propriedade', methods=['POST'])
+def transferir_posse():
+    """Acerto manual do registro de posses (trocas, manchetes que tomam propriedades)."""
+    sala = g.sala
+    if not session.get(chave_banco()): return redirect(url_for('banco_login'))
+
+    nome = request.form.get('propriedade', '').strip()
+    dono_id = request.form.get('dono_id') or 'Banco'
+    if not nome or (dono_id != 'Banco' and dono_id not in dict(sala.jogadores())):
+        flash("Erro: Informe a propriedade e um dono válido.", 'error')
+    else:
+        transferir_propriedade(sala, nome, dono_id)
+        dono = 'o Banco' if dono_id == 'Banco' else sala.partida[dono_id]['name']
+        flash(f"{(CONTEUDO.atual().catalogo.buscar(nome) or {'nome': nome})['nome']} agora pertence a {dono}.", 'success')
     return redirect(url_for('pagina_banco'))
 
-@app.route('/leilao/iniciar', methods=['POST'])
+@app.route('/sala/<sala_id>/leilao/iniciar', methods=['POST'])
 def iniciar_leilao():
-    global LEILAO_ATUAL
-    tempo_segundos = 90
-    
-    # 1. Verificação de Pré-condição
-    if LEILAO_ATUAL.get('ativo', False):
-        flash("Erro: Já existe um leilão ativo. Finalize-o antes de começar outro.", 'error')
-        return redirect(url_for('pagina_banco'))
-        
+    sala = g.sala
     propriedade = request.form['propriedade']
-    lance_inicial = request.form['lance_inicial']
     
     try:
-        lance_inicial = int(lance_inicial)
-        if lance_inicial <= 0: raise ValueError
+        lance_inicial = int(request.form['lance_inicial'])
+        duracao = int(request.form.get('duracao') or LEILAO_DURACAO)
+        extensao = int(request.form.get('extensao') or LEILAO_EXTENSAO)
+        if lance_inicial <= 0 or not 10 <= duracao <= 3600 or not 0 <= extensao <= 300: raise ValueError
     except ValueError:
-        flash("Erro: O lance inicial deve ser um número inteiro positivo.", 'error')
+        flash("Erro: Lance inicial positivo, duração entre 10s e 1h e prorrogação até 5min.", 'error')
         return redirect(url_for('pagina_banco'))
 
-    # 2. Inicializa o Leilão
-    LEILAO_ATUAL = {
-        'ativo': True,
-        'propriedade': propriedade,
-        'lance_minimo': lance_inicial,
-        'lance_atual': lance_inicial,
-        'jogador_atual_id': None,
-        'jogador_atual_nome': None,
-        'expira_em': time.time() + tempo_segundos
-    }
-    save_game_state()
+    abrir_leilao(sala, propriedade, lance_inicial, duracao, extensao)
     flash(f"Leilão da propriedade '{propriedade}' iniciado com lance inicial de R$ {format_brl(lance_inicial)}!", 'success')
     return redirect(url_for('pagina_banco'))
 
-@app.route('/leilao/finalizar', methods=['POST'])
-def finalizar_leilao():
-    global LEILAO_ATUAL
-    
-    if not LEILAO_ATUAL.get('ativo'):
+@app.route('/sala/<sala_id>/leilao/<leilao_id>/finalizar', methods=['POST'])
+def finalizar_leilao(leilao_id):
+    sala = g.sala
+    mensagem = encerrar_leilao(sala, leilao_id, forcar=True)
+    if mensagem is None:
         flash("Erro: Não há leilão ativo.", 'error')
-        return redirect(url_for('pagina_banco'))
-        
-    vencedor_id = LEILAO_ATUAL['jogador_atual_id']
-    valor_final = LEILAO_ATUAL['lance_atual']
-    propriedade = LEILAO_ATUAL['propriedade']
-    
-    if vencedor_id is None:
-        LEILAO_ATUAL = {}
-        save_game_state()
-        flash("Leilão encerrado sem licitantes.", 'warning')
-        return redirect(url_for('pagina_banco'))
-
-    mensagem = executar_transacao(vencedor_id, 'Banco', valor_final)
-    
-    if "Erro" not in mensagem:
-        vencedor_nome = PARTIDA[vencedor_id]['name']
-        flash(f"SUCESSO: {vencedor_nome} comprou {propriedade} por R$ {format_brl(valor_final)}!", 'success')
-        LEILAO_ATUAL = {}
-        save_game_state()
     else:
-        flash(f"Erro ao processar venda: {mensagem}", 'error')
-
+        flash(mensagem, 'success')
     return redirect(url_for('pagina_banco'))
 
-@app.route('/banco')
+@app.route('/sala/<sala_id>/banco')
 def pagina_banco():
-    verificar_encerramento_leilao()
-    if not session.get('bank_logged_in'): 
+    sala = g.sala
+    if not session.get(chave_banco()): 
         return redirect(url_for('banco_login'))
     
-    jogadores_monitor = {id: data for id, data in PARTIDA.items() if id not in ('Banco', 'timestamp')}
-    
-    id_to_name = {pid: data['name'] for pid, data in PARTIDA.items() if pid not in ('Banco', 'timestamp')}
-    id_to_name['Banco'] = 'Banco Central'
-    
-    historico_global = PARTIDA.get('Banco', {}).get('historico', [])
+    jogadores_monitor = dict(sala.jogadores())
+    id_to_name = nomes_por_id(sala, 'Banco Central')
+    antes = request.args.get('antes', type=int)
+    leiloes = sorted(sala.leiloes.values(), key=lambda l: l['expira_em'])
+
+    def auditoria():
+        historico, cursor = paginar_extrato(sala, antes=antes)
+        return dict(historico=historico, antes=antes, cursor=cursor, id_to_name=id_to_name)
+
+    if antes is None:
+        auditoria_html = fragmento(sala, 'auditoria', ('ledger',), '_auditoria_banco.html', auditoria)
+    else:
+        auditoria_html = Markup(render_template('_auditoria_banco.html', **auditoria()))
+    # O cartão de cada jogador muda com o saldo, a poupança e o fluxo dele (tudo carimbado no id do jogador).
+    cartoes = {pid: fragmento(sala, ('cartao_banco', pid), (pid,), '_cartao_jogador_banco.html',
+                              lambda pid=pid, dados=dados: dict(player_id=pid, data=dados, AGREGADOS=sala.agregados))
+               for pid, dados in jogadores_monitor.items()}
+    contratos_html = fragmento(sala, 'cobrancas_banco', ('cobrancas',), '_cobrancas_banco.html',
+                               lambda: dict(COBRANCAS_PARCELADAS=sala.cobrancas_parceladas, id_to_name=id_to_name))
+    caixas_leilao = [fragmento(sala, ('leilao_banco', leilao['id']), (f"leilao:{leilao['id']}",), '_leilao_banco.html',
+                               lambda leilao=leilao: dict(leilao=leilao))
+                     for leilao in leiloes]
 
     return render_template('banco.html', 
                            jogadores_data=jogadores_monitor,
-                           partida=PARTIDA,
-                           LEILAO_ATUAL=LEILAO_ATUAL,
-                           MANCHETES_VIGENTES=MANCHETES_VIGENTES,
-                           SOLICITACOES_SALARIO=SOLICITACOES_SALARIO,
-                           COBRANCAS_PARCELADAS=COBRANCAS_PARCELADAS,
-                           historico=reversed(historico_global),
+                           CARTOES=cartoes,
+                           partida=sala.partida,
+                           LEILOES=leiloes,
+                           CAIXAS_LEILAO=caixas_leilao,
+                           HISTORICO_LEILOES=sala.historico_leiloes[::-1][:ITENS_POR_PAGINA],
+                           LEILAO_DURACAO=LEILAO_DURACAO,
+                           LEILAO_EXTENSAO=LEILAO_EXTENSAO,
+                           MANCHETES_VIGENTES=sala.manchetes_vigentes,
+                           SOLICITACOES_SALARIO=sala.solicitacoes_salario,
+                           CONTRATOS=contratos_html,
+                           AGREGADOS=sala.agregados,
+                           POSSES=sala.posses,
+                           CATALOGO=CONTEUDO.atual().catalogo,
+                           AUDITORIA=auditoria_html,
                            id_to_name=id_to_name)
 
-@app.route('/banco/reset_pin/<player_id>', methods=['POST'])
+@app.route('/sala/<sala_id>/banco/auditoria')
+def auditoria_banco():
+    """Fragmento HTML com a próxima página da auditoria (rolagem infinita)."""
+    sala = g.sala
+    if not session.get(chave_banco()):
+        return '', 403
+    id_to_name = nomes_por_id(sala, 'Banco Central')
+    antes = request.args.get('antes', type=int)
+    historico, cursor = paginar_extrato(sala, antes=antes)
+    return render_template('_auditoria_banco.html', historico=historico, antes=antes,
+                           cursor=cursor, id_to_name=id_to_name)
+
+@app.route('/sala/<sala_id>/banco/relatorio')
+def relatorio_partida():
+    """Relatório de fim de partida: fluxo de caixa, credores, concentração, manchetes e leilões."""
+    sala = g.sala
+    if not session.get(chave_banco()):
+        return redirect(url_for('banco_login'))
+    if not analise.disponivel():
+        flash("Erro: O relatório precisa do pacote numpy instalado no servidor.", 'error')
+        return redirect(url_for('pagina_banco'))
+    return render_template('relatorio.html', sala_id=sala.id, RELATORIO=analise.relatorio(sala, CONTEUDO.atual().manchetes))
+
+@app.route('/sala/<sala_id>/banco/eventos')
+def eventos_banco():
+    """Fluxo SSE do banco: saldos de todos, lances e pedidos de salário."""
+    sala = g.sala
+    if not session.get(chave_banco()):
+        return '', 403
+    fluxo = transmitir_eventos(sala, ('banco', 'todos'))
+    return Response(stream_with_context(fluxo), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/sala/<sala_id>/banco/reset_pin/<player_id>', methods=['POST'])
 def reset_pin(player_id):
-    if not session.get('bank_logged_in'):
+    sala = g.sala
+    if not session.get(chave_banco()):
         return redirect(url_for('banco_login'))
     
-    if player_id in PARTIDA:
-        PARTIDA[player_id]['pin'] = None
-        save_game_state()
-        flash(f"PIN de {PARTIDA[player_id]['name']} resetado!", "success")
+    if player_id in sala.partida:
+        with sala.lock:
+            sala.partida[player_id]['pin'] = None
+            sala.persistir('jogador', id=player_id, campos={'pin': None})
+        flash(f"PIN de {sala.partida[player_id]['name']} resetado!", "success")
     return redirect(url_for('pagina_banco'))
 
 # 5. Rota de Transação Individual
-@app.route('/transacao', methods=['POST'])
+@app.route('/sala/<sala_id>/transacao', methods=['POST'])
 def transacao():
+    sala = g.sala
     remetente_id = request.form['remetente_id']
     recebedor_id = request.form['recebedor_id']
     valor = request.form['valor']
     
-    mensagem = executar_transacao(remetente_id, recebedor_id, valor)
+    mensagem = executar_transacao(sala, remetente_id, recebedor_id, valor)
     
     if "Erro" in mensagem:
         flash(mensagem, 'error')
@@ -803,27 +1483,32 @@ def transacao():
     else:
         return redirect(url_for('pagina_jogador', player_id=remetente_id))
 
-@app.route('/acessar_perfil/<player_id>')
+@app.route('/sala/<sala_id>/acessar_perfil/<player_id>')
 def acessar_perfil(player_id):
     session.pop(f'auth_{player_id}', None)
     return redirect(url_for('jogador_auth', player_id=player_id))
 
-@app.route('/jogador_auth/<player_id>', methods=['GET', 'POST'])
+@app.route('/sala/<sala_id>/jogador_auth/<player_id>', methods=['GET', 'POST'])
 def jogador_auth(player_id):
-    if player_id not in PARTIDA:
+    sala = g.sala
+    if player_id not in sala.partida:
         return redirect(url_for('dashboard'))
     
     session.pop(f'auth_{player_id}', None)
-    jogador = PARTIDA[player_id]
+    jogador = sala.partida[player_id]
 
     if request.method == 'POST':
         if jogador.get('pin') is None:
             novo_pin = request.form.get('pin')
             if len(novo_pin) == 4 and novo_pin.isdigit():
-                PARTIDA[player_id]['pin'] = novo_pin
-                save_game_state()
-                session[f'auth_{player_id}'] = True
-                return redirect(url_for('pagina_jogador', player_id=player_id))
+                with sala.lock:
+                    # Dois aparelhos cadastrando ao mesmo tempo: só o primeiro PIN vale.
+                    if jogador.get('pin') is None:
+                        jogador['pin'] = novo_pin
+                        sala.persistir('jogador', id=player_id, campos={'pin': novo_pin})
+                if jogador['pin'] == novo_pin:
+                    session[f'auth_{player_id}'] = True
+                    return redirect(url_for('pagina_jogador', player_id=player_id))
         
         else:
             pin_inserido = request.form.get('pin')
@@ -833,60 +1518,336 @@ def jogador_auth(player_id):
         flash("PIN Incorreto!", "error")
     return render_template('jogador_login.html', jogador=jogador, jogador_id=player_id)
 
-@app.route('/jogador_logout/<player_id>')
+@app.route('/sala/<sala_id>/jogador_logout/<player_id>')
 def logout_jogador(player_id):
     session.pop(f'auth_{player_id}', None)
     return redirect(url_for('dashboard'))
 
-@app.route('/poupanca/controle', methods=['POST'])
+@app.route('/sala/<sala_id>/poupanca/controle', methods=['POST'])
 def controle_poupanca():
+    sala = g.sala
     action = request.form['action']
     
     if action == 'trancar':
-        mensagem = trancar_poupanca(True)
+        mensagem = trancar_poupanca(sala, True)
     elif action == 'destrancar':
-        mensagem = trancar_poupanca(False)
+        mensagem = trancar_poupanca(sala, False)
     elif action == 'render':
         percentual = request.form.get('percentual_render')
-        mensagem = aplicar_rendimento(percentual)
+        mensagem = aplicar_rendimento(sala, percentual)
     else:
         mensagem = "Ação de poupança inválida."
         
     flash(mensagem, 'error' if "Erro" in mensagem else 'success')
     return redirect(url_for('pagina_banco'))
 
-@app.route('/jogador/poupanca/<player_id>', methods=['POST'])
+@app.route('/sala/<sala_id>/jogador/poupanca/<player_id>', methods=['POST'])
 def poupanca_jogador(player_id):
+    sala = g.sala
     action = request.form['action']
     valor = request.form['valor']
     
     if action == 'investir':
-        mensagem = transferir_poupanca(player_id, valor, True)
+        mensagem = transferir_poupanca(sala, player_id, valor, True)
     elif action == 'resgatar':
-        mensagem = transferir_poupanca(player_id, valor, False)
+        mensagem = transferir_poupanca(sala, player_id, valor, False)
     else:
         mensagem = "Ação inválida."
 
     flash(mensagem, 'error' if "Erro" in mensagem else 'success')
     return redirect(url_for('pagina_jogador', player_id=player_id))
 
-@app.route('/cobrar/parcelar/<credor_id>', methods=['POST'])
+@app.route('/sala/<sala_id>/cobrar/parcelar/<credor_id>', methods=['POST'])
 def criar_cobranca_parcelada(credor_id):
+    sala = g.sala
     devedor_id = request.form['devedor_id']
     valor_total = request.form['valor_total']
     num_parcelas = request.form['num_parcelas']
     
-    mensagem = criar_parcelamento(credor_id, devedor_id, valor_total, num_parcelas)
+    mensagem = criar_parcelamento(sala, credor_id, devedor_id, valor_total, num_parcelas)
     
     flash(mensagem, 'error' if "Erro" in mensagem else 'success')
     return redirect(url_for('pagina_jogador', player_id=credor_id))
 
-@app.route('/pagar/parcela/<devedor_id>/<installment_id>', methods=['POST'])
+@app.route('/sala/<sala_id>/pagar/parcela/<devedor_id>/<installment_id>', methods=['POST'])
 def pagar_cobranca_parcelada(devedor_id, installment_id):
-    mensagem = pagar_parcela(devedor_id, installment_id)
+    sala = g.sala
+    mensagem = pagar_parcela(sala, devedor_id, installment_id)
     flash(mensagem, 'error' if "Erro" in mensagem else 'success')
     return redirect(url_for('pagina_jogador', player_id=devedor_id))
 
+# --- API JSON (v1) ---
+#
+# Os mesmos dados das páginas em respostas pequenas, para celulares e para as
+# atualizações parciais das próprias páginas. Cada leitura leva uma ETag com a
+# versão das partes da sala que ela usa (Sala.etag): revalidar algo que não
+# mudou devolve 304 sem corpo, sem montar a resposta.
+
+API_V1 = '/sala/<sala_id>/api/v1'
+LIMITE_MAXIMO_API = 100
+
+def responder_versionado(partes, montar):
+    """Resposta JSON condicional: `montar()` só roda se a ETag do cliente estiver velha."""
+    # A ETag é lida antes dos dados: se algo mudar no meio, o cliente só busca de novo.
+    etag = g.sala.etag(*partes)
+    resposta = Response(status=304) if request.if_none_match.contains_weak(etag) else jsonify(montar())
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+def responder_operacao(mensagem, **extras):
+    ok = "Erro" not in mensagem
+    return jsonify(ok=ok, mensagem=mensagem, **extras), (200 if ok else 400)
+
+def negar_acesso():
+    return jsonify(ok=False, mensagem="Acesso negado."), 403
+
+def corpo_json():
+    corpo = request.get_json(silent=True)
+    return corpo if isinstance(corpo, dict) else {}
+
+def e_jogador(player_id):
+    return isinstance(player_id, str) and player_id not in ('Banco', 'timestamp') and player_id in g.sala.partida
+
+def pode_ver_jogador(player_id):
+    """O próprio jogador (logado pelo PIN) ou o banco."""
+    return e_jogador(player_id) and bool(session.get(f'auth_{player_id}') or session.get(chave_banco()))
+
+def participa_da_sala():
+    return bool(session.get(chave_banco())) or any(session.get(f'auth_{pid}') for pid, _ in g.sala.jogadores())
+
+def jogador_json(player_id, dados):
+    return {'id': player_id, 'nome': dados['name'], 'cor': dados['color'], 'saldo': dados['saldo'], 'poupanca': dados['poupanca']}
+
+def transacao_json(t):
+    return {'id': t['id'], 'valor': t['valor'], 'de': t['remetente_id'], 'para': t['recebedor_id'], 'hora': t.get('data_hora')}
+
+def extrato_json(sala, jogador_id=None):
+    antes = request.args.get('antes', type=int)
+    limite = min(max(request.args.get('limite', ITENS_POR_PAGINA, type=int), 1), LIMITE_MAXIMO_API)
+    pagina, cursor = paginar_extrato(sala, jogador_id, antes, limite)
+    return {'transacoes': [transacao_json(t) for t in pagina], 'cursor': cursor}
+
+def filtrar_por_jogador(itens, chave_jogador):
+    """Banco vê tudo; com ?jogador=<id>, só o que é daquele jogador (se ele puder ver)."""
+    player_id = request.args.get('jogador')
+    if player_id is None:
+        return (lambda: itens) if session.get(chave_banco()) else None
+    if not pode_ver_jogador(player_id):
+        return None
+    return lambda: {k: v for k, v in itens.items() if player_id in chave_jogador(k, v)}
+
+@app.route(f'{API_V1}/jogadores/<player_id>')
+def api_jogador(player_id):
+    sala = g.sala
+    if not pode_ver_jogador(player_id):
+        return negar_acesso()
+    return responder_versionado((player_id,), lambda: dict(jogador_json(player_id, sala.partida[player_id]),
+                                                            objetivo=sala.partida[player_id].get('objetivo')))
+
+@app.route(f'{API_V1}/jogadores/<player_id>/extrato')
+def api_extrato_jogador(player_id):
+    sala = g.sala
+    if not pode_ver_jogador(player_id):
+        return negar_acesso()
+    return responder_versionado((player_id,), lambda: extrato_json(sala, player_id))
+
+@app.route(f'{API_V1}/saldos')
+def api_saldos():
+    sala = g.sala
+    if not session.get(chave_banco()):
+        return negar_acesso()
+    jogadores = sala.jogadores()
+    return responder_versionado([pid for pid, _ in jogadores] + ['Banco'], lambda: {
+        'jogadores': [jogador_json(pid, dados) for pid, dados in jogadores],
+        'poupanca_trancada': sala.partida['Banco'].get('poupanca_trancada', False)
+    })
+
+@app.route(f'{API_V1}/economia')
+def api_economia():
+    """Totais da economia (agregados mantidos a cada transação)."""
+    sala = g.sala
+    if not session.get(chave_banco()):
+        return negar_acesso()
+    return responder_versionado([pid for pid, _ in sala.jogadores()] + ['ledger'], lambda: sala.agregados)
+
+@app.route(f'{API_V1}/extrato')
+def api_auditoria():
+    sala = g.sala
+    if not session.get(chave_banco()):
+        return negar_acesso()
+    return responder_versionado(('ledger',), lambda: extrato_json(sala))
+
+@app.route(f'{API_V1}/leiloes')
+def api_leiloes():
+    sala = g.sala
+    if not participa_da_sala():
+        return negar_acesso()
+    return responder_versionado(('leiloes',), lambda: {
+        'ativos': sorted(sala.leiloes.values(), key=lambda l: l['expira_em']),
+        'encerrados': sala.historico_leiloes[::-1][:ITENS_POR_PAGINA]
+    })
+
+@app.route(f'{API_V1}/manchetes')
+def api_manchetes():
+    sala = g.sala
+    if not participa_da_sala():
+        return negar_acesso()
+    return responder_versionado(('manchetes',), lambda: {'manchetes': sala.manchetes_vigentes})
+
+@app.route(f'{API_V1}/cobrancas')
+def api_cobrancas():
+    sala = g.sala
+    montar = filtrar_por_jogador(sala.cobrancas_parceladas, lambda _, c: (c['devedor_id'], c['credor_id']))
+    if montar is None:
+        return negar_acesso()
+    return responder_versionado(('cobrancas',), lambda: {'cobrancas': montar()})
+
+@app.route(f'{API_V1}/salarios')
+def api_salarios():
+    sala = g.sala
+    montar = filtrar_por_jogador(sala.solicitacoes_salario, lambda pid, _: (pid,))
+    if montar is None:
+        return negar_acesso()
+    return responder_versionado(('salarios',), lambda: {'solicitacoes': montar()})
+
+@app.route(f'{API_V1}/propriedades')
+def api_propriedades():
+    """Registro de posses; com ?jogador=<id>, só as daquele jogador, com as contagens por atributo."""
+    sala = g.sala
+    player_id = request.args.get('jogador')
+    if player_id is not None:
+        if not pode_ver_jogador(player_id):
+            return negar_acesso()
+        return responder_versionado(('propriedades',), lambda: {
+            'propriedades': sala.posses.registros_de(player_id),
+            'contagens': sala.posses.resumo(player_id)
+        })
+    if not participa_da_sala():
+        return negar_acesso()
+    return responder_versionado(('propriedades',), lambda: {'propriedades': list(sala.posses.registros.values())})
+
+@app.route(f'{API_V1}/jogadores/<player_id>/transacoes', methods=['POST'])
+def api_transacao(player_id):
+    if not pode_ver_jogador(player_id):
+        return negar_acesso()
+    corpo = corpo_json()
+    recebedor_id = corpo.get('para')
+    if recebedor_id != 'Banco' and not e_jogador(recebedor_id) or recebedor_id == player_id:
+        return responder_operacao("Erro: Recebedor inválido.")
+    return responder_operacao(executar_transacao(g.sala, player_id, recebedor_id, corpo.get('valor')))
+
+@app.route(f'{API_V1}/jogadores/<player_id>/poupanca', methods=['POST'])
+def api_poupanca(player_id):
+    if not pode_ver_jogador(player_id):
+        return negar_acesso()
+    corpo = corpo_json()
+    if corpo.get('acao') not in ('investir', 'resgatar'):
+        return responder_operacao("Erro: Ação deve ser 'investir' ou 'resgatar'.")
+    return responder_operacao(transferir_poupanca(g.sala, player_id, corpo.get('valor'), corpo['acao'] == 'investir'))
+
+@app.route(f'{API_V1}/jogadores/<player_id>/salario', methods=['POST'])
+def api_salario(player_id):
+    if not pode_ver_jogador(player_id):
+        return negar_acesso()
+    return responder_operacao(pedir_salario(g.sala, player_id))
+
+@app.route(f'{API_V1}/jogadores/<player_id>/cobrancas', methods=['POST'])
+def api_criar_cobranca(player_id):
+    if not pode_ver_jogador(player_id):
+        return negar_acesso()
+    corpo = corpo_json()
+    if not e_jogador(corpo.get('devedor')):
+        return responder_operacao("Erro: Devedor não encontrado.")
+    return responder_operacao(criar_parcelamento(g.sala, player_id, corpo['devedor'], corpo.get('valor_total'), corpo.get('parcelas')))
+
+@app.route(f'{API_V1}/jogadores/<player_id>/cobrancas/<installment_id>/pagar', methods=['POST'])
+def api_pagar_parcela(player_id, installment_id):
+    if not pode_ver_jogador(player_id):
+        return negar_acesso()
+    return responder_operacao(pagar_parcela(g.sala, player_id, installment_id))
+
+@app.route(f'{API_V1}/leiloes/<leilao_id>/lances', methods=['POST'])
+def api_lance(leilao_id):
+    corpo = corpo_json()
+    player_id = corpo.get('jogador')
+    if not pode_ver_jogador(player_id):
+        return negar_acesso()
+    erro, lance = enviar_lance(g.sala, leilao_id, player_id, corpo.get('valor'))
+    if erro:
+        return jsonify(ok=False, mensagem=erro), 400
+    # O resultado chega ao jogador pelo evento 'lance_resultado', com o mesmo seq.
+    return jsonify(ok=True, mensagem=f"Lance nº {lance.seq} na fila.", seq=lance.seq), 202
+
+@app.cli.command('auditar-agregados')
+@click.argument('salas', nargs=-1)
+def auditar_agregados(salas):
+    """Confere os agregados da economia de cada sala contra um recálculo completo."""
+    divergentes = 0
+    for sala_id in salas or SALAS.listar():
+        sala = SALAS.obter(sala_id)
+        if sala is None or not sala.partida:
+            continue
+        divergencias = sala.auditar_agregados()
+        if not divergencias:
+            click.echo(f"{sala_id}: OK")
+            continue
+        divergentes += 1
+        for chave, mantido, recalculado in divergencias:
+            click.echo(f"{sala_id}: {chave} mantido={mantido} recalculado={recalculado}")
+    if divergentes:
+        raise SystemExit(1)
+
+@app.cli.command('relatorio-partidas')
+@click.argument('diretorio', default=SALAS_DIR)
+@click.option('--saida', type=click.File('w'), default='-', help='Arquivo JSON Lines (padrão: saída padrão).')
+def relatorio_partidas(diretorio, saida):
+    """Gera o relatório de cada partida salva no diretório (uma linha JSON por sala)."""
+    if not analise.disponivel():
+        raise click.ClickException("O relatório precisa do pacote numpy.")
+    arquivos = {}
+    # Se a sala tem banco SQLite, ele é a versão mais recente; depois, o snapshot binário.
+    for extensao, modo, formato in (('.json', 'journal', 'json'), ('.bin', 'journal', 'binario'), ('.sqlite3', 'sqlite', 'json')):
+        for nome in sorted(os.listdir(diretorio)):
+            if nome.endswith(extensao):
+                arquivos[nome[:-len(extensao)]] = (modo, formato)
+    for sala_id, (modo, formato) in arquivos.items():
+        sala = Sala(sala_id, diretorio, modo, formato_snapshot=formato)
+        try:
+            sala.carregar()
+            if sala.partida:
+                saida.write(json.dumps(analise.relatorio(sala, CONTEUDO.atual().manchetes), ensure_ascii=False) + '\n')
+        finally:
+            sala.armazenamento.fechar()
+
+@app.cli.command('converter-snapshot')
+@click.argument('origem', type=click.Path(exists=True, dir_okay=False))
+@click.argument('destino', type=click.Path(dir_okay=False))
+@click.option('--compressao', type=click.Choice(['zlib', 'zstd']), default=None, help='Só para o destino .bin.')
+def converter_snapshot_cli(origem, destino, compressao):
+    """Converte o snapshot de uma sala entre JSON (.json) e binário (.bin)."""
+    if destino.endswith('.bin') == origem.endswith('.bin') or not destino.endswith(('.json', '.bin')):
+        raise click.ClickException("Converte de .json para .bin ou de .bin para .json.")
+    if compressao not in compressoes_disponiveis():
+        raise click.ClickException(f"Compressão {compressao} indisponível (instale o pacote zstandard).")
+    gravados = converter_snapshot(origem, destino, compressao)
+    click.echo(f"{origem} -> {destino}: {gravados} bytes (antes {os.path.getsize(origem)})")
+
+@app.cli.command('validar-conteudo')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False), default=CONTEUDO.caminho)
+def validar_conteudo(arquivo):
+    """Confere o conteudo_jogo.json (ou outro arquivo) antes de pôr no ar."""
+    try:
+        with open(arquivo, 'r', encoding='utf-8') as f:
+            problemas = validar(json.load(f))
+    except ValueError as e:
+        problemas = [f"JSON inválido: {e}"]
+    for problema in problemas:
+        click.echo(problema)
+    if problemas:
+        raise SystemExit(1)
+    click.echo(f"{arquivo}: OK")
+
 if __name__ == '__main__':
-    load_game_state()
+    ESTATICOS.verificar_mudancas = True
     app.run(debug=True)
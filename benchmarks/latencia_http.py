@@ -0,0 +1,220 @@
+"""Latência das rotas HTTP conforme o estado da partida cresce.
+
+Monta salas com ledgers de tamanhos crescentes (por padrão 1k, 10k e 100k
+transações, mais leilões encerrados e cobranças em aberto) e mede, pelo
+cliente de teste do Flask, p50/p95/p99 e bytes da resposta de:
+
+    GET  /jogador/<id>            GET  /banco
+    POST /transacao               POST /transacao-unificada
+    POST /leilao/<id>/lance/<id>  POST /pagar/parcela/<devedor>/<id>
+
+e o tempo de um salvamento completo da sala (Sala.salvar).
+
+O resultado vai para um JSON e é comparado com a linha de base guardada em
+benchmarks/baseline_latencia.json. Duas coisas são sinalizadas:
+  - crescimento: o expoente de escala de uma rota (inclinação de log(p50)
+    contra log(transações) entre a menor e a maior sala) passou o da linha
+    de base em mais de TOLERANCIA_EXPOENTE; é o que pega uma renderização ou
+    um salvamento que ficou superlinear, em qualquer máquina;
+  - lentidão: o p95 passou FATOR_LENTIDAO vezes o da linha de base.
+Com algo sinalizado o script termina com código 1.
+
+Uso: python benchmarks/latencia_http.py [--tamanhos 1000 10000 100000]
+     [--repeticoes 100] [--saida resultado.json] [--gravar-baseline]
+(BANCO_PERSISTENCIA=sqlite ou snapshot para medir os outros armazenamentos.)
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+DIRETORIO_CHAMADA = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix='latencia-banco-'))
+os.environ['BANCO_SALAS_DIR'] = 'salas'
+
+import app as banco  # noqa: E402
+
+BASELINE = os.path.join(RAIZ, 'benchmarks', 'baseline_latencia.json')
+TAMANHOS = (1000, 10000, 100000)
+N_JOGADORES = 6
+SALDO = 10 ** 9
+TAMANHO_LOTE = 1000
+N_LEILOES = 50
+TOLERANCIA_EXPOENTE = 0.3
+FATOR_LENTIDAO = 3.0
+SEMENTE = 42
+
+
+def percentil(amostras, p):
+    """Percentil pelo posto mais próximo (amostras já ordenadas)."""
+    return amostras[max(math.ceil(p / 100 * len(amostras)) - 1, 0)]
+
+
+def popular(sala_id, n_transacoes, n_cobrancas, rnd):
+    """Cria a sala com o ledger, o histórico de leilões e as cobranças para o teste."""
+    sala = banco.SALAS.obter(sala_id)
+    with banco.app.test_request_context():
+        banco.iniciar_partida(sala, [{'name': f'J{i}', 'color': '#000000'} for i in range(N_JOGADORES)], SALDO)
+        jogadores = [pid for pid, _ in sala.jogadores()]
+        participantes = jogadores + ['Banco']
+        for inicio in range(0, n_transacoes, TAMANHO_LOTE):
+            lote = []
+            for _ in range(min(TAMANHO_LOTE, n_transacoes - inicio)):
+                remetente, recebedor = rnd.sample(participantes, 2)
+                lote.append((remetente, recebedor, rnd.randint(1, 5000)))
+            banco.registrar_lote(sala, lote)
+        for i in range(N_LEILOES):
+            leilao_id = banco.abrir_leilao(sala, f'Propriedade {i}', 1000, duracao=3600)
+            banco.registrar_lance(sala, leilao_id, rnd.choice(jogadores), 1000 + rnd.randint(1, 5000))
+            banco.encerrar_leilao(sala, leilao_id, forcar=True)
+        for _ in range(n_cobrancas):
+            credor, devedor = rnd.sample(jogadores, 2)
+            banco.criar_parcelamento(sala, credor, devedor, 12000, 12)
+        leilao_id = banco.abrir_leilao(sala, 'Leilão do benchmark', 1, duracao=3600)
+    return sala, jogadores, leilao_id
+
+
+def medir(chamada, repeticoes):
+    """Executa a chamada `repeticoes` vezes; devolve p50/p95/p99 (ms) e bytes da última resposta."""
+    tempos = []
+    tamanho = 0
+    for i in range(repeticoes):
+        inicio = time.perf_counter()
+        resposta = chamada(i)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        if resposta is not None:
+            tamanho = len(resposta.get_data())
+    tempos.sort()
+    return {'p50': round(percentil(tempos, 50), 3), 'p95': round(percentil(tempos, 95), 3),
+            'p99': round(percentil(tempos, 99), 3), 'bytes': tamanho}
+
+
+def medir_sala(n_transacoes, repeticoes, rnd):
+    sala_id = f'latencia-{n_transacoes}'
+    sala, jogadores, leilao_id = popular(sala_id, n_transacoes, repeticoes, rnd)
+    base = f'/sala/{sala_id}'
+    cliente = banco.app.test_client()
+    with cliente.session_transaction() as s:
+        s[f'bank_logged_in_{sala_id}'] = True
+        for pid in jogadores:
+            s[f'auth_{pid}'] = True
+    jogador = jogadores[0]
+    cobrancas = list(sala.cobrancas_parceladas.items())
+
+    def sem_avisos(resposta):
+        # Os POSTs deixam flashes na sessão; sem a página seguinte, a sessão só cresceria.
+        with cliente.session_transaction() as s:
+            s.pop('_flashes', None)
+        return resposta
+
+    def pares(i):
+        return jogadores[i % N_JOGADORES], jogadores[(i + 1) % N_JOGADORES]
+
+    rotas = {
+        'GET /jogador/<id>': lambda i: cliente.get(f'{base}/jogador/{jogador}'),
+        'GET /banco': lambda i: cliente.get(f'{base}/banco'),
+        'POST /transacao': lambda i: sem_avisos(cliente.post(f'{base}/transacao', data={
+            'remetente_id': pares(i)[0], 'recebedor_id': pares(i)[1], 'valor': '10'})),
+        'POST /transacao-unificada': lambda i: sem_avisos(cliente.post(f'{base}/transacao-unificada', data={
+            'value_type': 'FIXO', 'action_type_final': 'PAGAR' if i % 2 else 'COBRAR', 'target_id': 'Todos', 'valor': '10'})),
+        'POST /leilao/<id>/lance/<id>': lambda i: sem_avisos(cliente.post(f'{base}/leilao/{leilao_id}/lance/{pares(i)[0]}',
+                                                                         data={'lance': str(10 * (i + 1))})),
+        'POST /pagar/parcela/<devedor>/<id>': lambda i: sem_avisos(cliente.post(
+            f'{base}/pagar/parcela/{cobrancas[i][1]["devedor_id"]}/{cobrancas[i][0]}')),
+    }
+    # Primeira renderização compila os templates: fica fora da medida.
+    rotas['GET /jogador/<id>'](0), rotas['GET /banco'](0)
+    resultado = {rota: medir(chamada, repeticoes) for rota, chamada in rotas.items()}
+
+    def salvar(i):
+        sala.salvar()
+    resultado['Sala.salvar'] = medir(salvar, max(repeticoes // 10, 3))
+    banco.SALAS.despejar(sala_id)
+    return resultado
+
+
+def expoentes(medidas, tamanhos):
+    """Inclinação de log(p50) contra log(tamanho) entre a menor e a maior sala, por rota."""
+    menor, maior = str(min(tamanhos)), str(max(tamanhos))
+    if menor == maior:
+        return {}
+    escala = math.log(int(maior) / int(menor))
+    return {rota: round(math.log(max(m[maior]['p50'], 1e-3) / max(m[menor]['p50'], 1e-3)) / escala, 3)
+            for rota, m in medidas.items()}
+
+
+def comparar(resultado, baseline):
+    """Lista de avisos (texto) do resultado contra a linha de base."""
+    avisos = []
+    # Expoentes só são comparáveis entre as mesmas faixas de tamanho.
+    expoentes_base = baseline.get('expoentes', {}) if baseline.get('tamanhos') == resultado['tamanhos'] else {}
+    for rota, expoente in resultado['expoentes'].items():
+        referencia = expoentes_base.get(rota)
+        if referencia is not None and expoente > referencia + TOLERANCIA_EXPOENTE:
+            avisos.append(f'crescimento: {rota} escala com expoente {expoente} (linha de base {referencia})')
+    for rota, por_tamanho in resultado['rotas'].items():
+        for tamanho, medida in por_tamanho.items():
+            referencia = baseline.get('rotas', {}).get(rota, {}).get(tamanho)
+            if referencia and medida['p95'] > FATOR_LENTIDAO * referencia['p95']:
+                avisos.append(f"lentidão: {rota} com {tamanho} transações tem p95 {medida['p95']}ms "
+                              f"(linha de base {referencia['p95']}ms)")
+    return avisos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=list(TAMANHOS))
+    parser.add_argument('--repeticoes', type=int, default=100)
+    parser.add_argument('--saida', help='grava o resultado neste arquivo JSON')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--gravar-baseline', action='store_true', help='grava o resultado como a nova linha de base')
+    args = parser.parse_args()
+
+    rnd = random.Random(SEMENTE)
+    random.seed(SEMENTE)
+    medidas = {}
+    for n in args.tamanhos:
+        for rota, medida in medir_sala(n, args.repeticoes, rnd).items():
+            medidas.setdefault(rota, {})[str(n)] = medida
+
+    resultado = {
+        'ambiente': {'python': platform.python_version(), 'plataforma': platform.platform(), 'persistencia': banco.MODO_PERSISTENCIA},
+        'repeticoes': args.repeticoes,
+        'tamanhos': args.tamanhos,
+        'rotas': medidas,
+        'expoentes': expoentes(medidas, args.tamanhos)
+    }
+
+    print(f"{'rota':<36} {'transações':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'bytes':>9}")
+    for rota, por_tamanho in medidas.items():
+        for tamanho, m in por_tamanho.items():
+            print(f"{rota:<36} {tamanho:>10} {m['p50']:>9.2f} {m['p95']:>9.2f} {m['p99']:>9.2f} {m['bytes']:>9}")
+        if rota in resultado['expoentes']:
+            print(f"{'':<36} {'expoente':>10} {resultado['expoentes'][rota]:>9.2f}")
+
+    for caminho in filter(None, [args.saida and os.path.join(DIRETORIO_CHAMADA, args.saida),
+                                 args.gravar_baseline and os.path.join(DIRETORIO_CHAMADA, args.baseline)]):
+        with open(caminho, 'w') as f:
+            json.dump(resultado, f, indent=4, ensure_ascii=False)
+
+    baseline = os.path.join(DIRETORIO_CHAMADA, args.baseline)
+    if args.gravar_baseline or not os.path.exists(baseline):
+        return
+    with open(baseline) as f:
+        avisos = comparar(resultado, json.load(f))
+    for aviso in avisos:
+        print(f'!!! {aviso}')
+    if avisos:
+        raise SystemExit(1)
+    print('Sem regressões em relação à linha de base.')
+
+
+if __name__ == '__main__':
+    main()
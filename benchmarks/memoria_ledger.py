@@ -0,0 +1,69 @@
+"""Memória por transação: ledger de dicts (formato antigo) x ledger colunar.
+
+Monta o mesmo ledger de N transações nos dois formatos e mede com
+tracemalloc quanto cada um ocupa. O formato antigo é uma lista com um dict
+de seis chaves por transação, com o UUID dos jogadores e a data/hora como
+strings; o colunar é o ledger.Ledger usado pelas salas.
+
+Uso: python benchmarks/memoria_ledger.py [transacoes] [jogadores]
+"""
+import random
+import sys
+import os
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import Ledger  # noqa: E402
+
+
+def transacoes(n, n_jogadores, semente=42):
+    """(id, valor, remetente_id, recebedor_id, data_hora), como chegam das rotas."""
+    rnd = random.Random(semente)
+    participantes = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(n_jogadores)] + ['Banco']
+    for id in range(1, n + 1):
+        remetente, recebedor = rnd.sample(participantes, 2)
+        # Uma string nova por transação, como time.strftime('%H:%M:%S') devolve.
+        segundo = id // 3
+        data_hora = f'{segundo // 3600 % 24:02d}:{segundo // 60 % 60:02d}:{segundo % 60:02d}'
+        yield id, rnd.randint(1, 500000), remetente, recebedor, data_hora
+
+
+def em_dicts(linhas):
+    return [{'id': id, 'valor': valor, 'remetente_id': remetente_id, 'recebedor_id': recebedor_id,
+             'timestamp': id, 'data_hora': data_hora}
+            for id, valor, remetente_id, recebedor_id, data_hora in linhas]
+
+
+def em_colunas(linhas):
+    ledger = Ledger()
+    for linha in linhas:
+        ledger.anotar(*linha)
+    return ledger
+
+
+def medir(montar, linhas):
+    tracemalloc.start()
+    inicio = tracemalloc.get_traced_memory()[0]
+    ledger = montar(linhas)
+    usado = tracemalloc.get_traced_memory()[0] - inicio
+    tracemalloc.stop()
+    return ledger, usado
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_jogadores = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    # As transações são geradas durante a medida, uma a uma: conta-se o que cada formato retém.
+    antigo, bytes_antigo = medir(em_dicts, transacoes(n, n_jogadores))
+    del antigo
+    colunar, bytes_colunar = medir(em_colunas, transacoes(n, n_jogadores))
+    print(f'{n} transações, {n_jogadores} jogadores')
+    print(f'  dicts:    {bytes_antigo / n:8.1f} bytes/transação ({bytes_antigo / 2 ** 20:.1f} MiB)')
+    print(f'  colunar:  {bytes_colunar / n:8.1f} bytes/transação ({bytes_colunar / 2 ** 20:.1f} MiB)')
+    print(f'  redução:  {bytes_antigo / bytes_colunar:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
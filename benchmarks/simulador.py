@@ -0,0 +1,173 @@
+"""Simulador de partidas sem HTTP e benchmark do núcleo de transações.
+
+Joga uma partida inteira chamando direto as funções do jogo
+(executar_transacao, pagar_parcela, executar_transacao_massa, leilões e
+manchetes), com um RNG de semente fixa: a mesma linha de comando produz
+sempre a mesma sequência de jogadas.
+
+A cada rodada cada jogador paga um aluguel a outro jogador ou ao banco; a
+cada 10 rodadas o banco paga um salário a todos. Leilões, parcelamentos e
+manchetes caem em rodadas sorteadas (pela mesma semente).
+
+Nos pontos de controle (100, 1k, 10k, 100k transações no ledger) mede:
+transações/s desde o ponto anterior, o tempo gasto em persistir() no trecho,
+quanto leva um salvamento completo da sala e o tamanho do estado no disco.
+A simulação para no último ponto de controle ou no fim das rodadas. No modo
+'snapshot' cada jogada regrava o arquivo inteiro: use menos rodadas.
+
+Uso: python benchmarks/simulador.py [--jogadores 6] [--rodadas N] [--leiloes 200]
+     [--parcelamentos 500] [--manchetes 300] [--semente 42] [--json resultado.json]
+(BANCO_PERSISTENCIA=sqlite ou snapshot para comparar os armazenamentos.)
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+DIRETORIO_CHAMADA = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix='simulador-banco-'))
+os.environ['BANCO_SALAS_DIR'] = 'salas'
+
+import app as banco  # noqa: E402
+from flask import session  # noqa: E402
+
+SALA = 'simulacao'
+PONTOS_DE_CONTROLE = (100, 1000, 10000, 100000)
+SALDO = 500000
+ALUGUEL_MAXIMO = 20000
+SALARIO = 2000
+INTERVALO_SALARIO = 10
+
+
+def tamanho_no_disco(sala):
+    """Bytes do estado salvo da sala (snapshot + journal, ou o banco SQLite com o WAL)."""
+    caminhos = [sala.caminho_snapshot, sala.caminho_journal]
+    if sala.modo_persistencia in ('sqlite', 'compartilhado'):
+        caminhos = [sala.armazenamento.caminho, sala.armazenamento.caminho + '-wal']
+    return sum(os.path.getsize(c) for c in caminhos if os.path.exists(c))
+
+
+def espalhar(total, rodadas, rnd):
+    """Rodadas (sorteadas, com repetição) em que acontecem `total` eventos de um tipo."""
+    contagem = {}
+    for _ in range(total):
+        r = rnd.randrange(rodadas)
+        contagem[r] = contagem.get(r, 0) + 1
+    return contagem
+
+
+def simular(args):
+    rnd = random.Random(args.semente)
+    # As funções do jogo usam random (objetivos, baralho de manchetes) e uuid: a semente cobre o random.
+    random.seed(args.semente)
+    sala = banco.SALAS.obter(SALA)
+    banco.iniciar_partida(sala, [{'name': f'J{i}', 'color': '#000000'} for i in range(args.jogadores)], SALDO)
+    jogadores = [pid for pid, _ in sala.jogadores()]
+
+    # Cronometra a persistência de cada mutação (journal, linhas do SQLite ou snapshot inteiro).
+    tempo_persistencia = [0.0]
+    persistir = sala.persistir
+
+    def persistir_cronometrado(op, **dados):
+        inicio = time.perf_counter()
+        try:
+            persistir(op, **dados)
+        finally:
+            tempo_persistencia[0] += time.perf_counter() - inicio
+    sala.persistir = persistir_cronometrado
+
+    leiloes = espalhar(args.leiloes, args.rodadas, rnd)
+    parcelamentos = espalhar(args.parcelamentos, args.rodadas, rnd)
+    manchetes = espalhar(args.manchetes, args.rodadas, rnd)
+    pontos = list(PONTOS_DE_CONTROLE)
+    resultados = []
+    inicio_trecho = time.perf_counter()
+    ledger_trecho = 0
+
+    for rodada in range(args.rodadas):
+        for _ in range(manchetes.get(rodada, 0)):
+            banco.sortear_manchete(sala)
+
+        for pid in jogadores:
+            destino = rnd.choice([p for p in jogadores if p != pid] + ['Banco'])
+            banco.executar_transacao(sala, pid, destino, rnd.randint(1, ALUGUEL_MAXIMO))
+
+        if rodada % INTERVALO_SALARIO == 0:
+            banco.executar_transacao_massa(sala, 'PAGAR', SALARIO)
+
+        for _ in range(parcelamentos.get(rodada, 0)):
+            credor, devedor = rnd.sample(jogadores, 2)
+            banco.criar_parcelamento(sala, credor, devedor, rnd.randint(1000, 50000), rnd.randint(1, 12))
+        # Cada devedor tenta pagar a próxima parcela de uma cobrança aberta.
+        for installment_id, cobranca in list(sala.cobrancas_parceladas.items())[:args.jogadores]:
+            banco.pagar_parcela(sala, cobranca['devedor_id'], installment_id)
+
+        for _ in range(leiloes.get(rodada, 0)):
+            leilao_id = banco.abrir_leilao(sala, f'Propriedade {rodada}', rnd.randint(1000, 100000), duracao=3600)
+            for _ in range(rnd.randint(0, 2 * args.jogadores)):
+                lance = sala.leiloes[leilao_id]['lance_atual'] + rnd.randint(100, 10000)
+                banco.registrar_lance(sala, leilao_id, rnd.choice(jogadores), lance)
+            banco.encerrar_leilao(sala, leilao_id, forcar=True)
+
+        # Os alertas de saldo negativo não têm página para exibi-los.
+        session.pop('_flashes', None)
+
+        while pontos and len(sala.ledger) >= pontos[0]:
+            agora = time.perf_counter()
+            n = len(sala.ledger)
+            trecho = agora - inicio_trecho
+            inicio = time.perf_counter()
+            sala.salvar()
+            salvar = time.perf_counter() - inicio
+            resultados.append({
+                'transacoes': n,
+                'tx_por_segundo': round((n - ledger_trecho) / trecho) if trecho else None,
+                'persistencia_s': round(tempo_persistencia[0], 4),
+                'salvar_ms': round(salvar * 1000, 2),
+                'tamanho_bytes': tamanho_no_disco(sala)
+            })
+            pontos.pop(0)
+            tempo_persistencia[0] = 0.0
+            ledger_trecho = n
+            inicio_trecho = time.perf_counter()
+        if not pontos:
+            break
+
+    return sala, resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jogadores', type=int, default=6)
+    parser.add_argument('--rodadas', type=int, help='padrão: o bastante para 100k transações')
+    parser.add_argument('--leiloes', type=int, default=200)
+    parser.add_argument('--parcelamentos', type=int, default=500)
+    parser.add_argument('--manchetes', type=int, default=300)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--json', help='grava os pontos de controle neste arquivo')
+    args = parser.parse_args()
+    if args.rodadas is None:
+        args.rodadas = PONTOS_DE_CONTROLE[-1] // args.jogadores + 1
+
+    with banco.app.test_request_context():
+        sala, resultados = simular(args)
+
+    print(f'Modo {banco.MODO_PERSISTENCIA}, {args.jogadores} jogadores, semente {args.semente}')
+    print(f"{'transações':>11} {'tx/s':>8} {'persistir (s)':>14} {'salvar (ms)':>12} {'disco (KB)':>11}")
+    for r in resultados:
+        print(f"{r['transacoes']:>11} {r['tx_por_segundo'] or '-':>8} {r['persistencia_s']:>14.3f} "
+              f"{r['salvar_ms']:>12.1f} {r['tamanho_bytes'] / 1024:>11.1f}")
+    assert not sala.auditar_agregados(), sala.auditar_agregados()
+
+    if args.json:
+        with open(os.path.join(DIRETORIO_CHAMADA, args.json), 'w') as f:
+            json.dump({'modo': banco.MODO_PERSISTENCIA, 'parametros': vars(args), 'pontos': resultados}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
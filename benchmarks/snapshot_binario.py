@@ -0,0 +1,100 @@
+"""Snapshot JSON x snapshot binário: tamanho, tempo de salvar e partida a frio.
+
+Monta uma sala com N transações e salva o mesmo estado em cada formato
+(JSON indent=4, binário sem compressão, binário com zlib e, se o pacote
+zstandard estiver instalado, com zstd). Para cada um mede:
+
+  tamanho    bytes do arquivo
+  salvar     Sala.salvar() (o snapshot completo, como na compactação)
+  a frio     Sala.carregar() numa sala nova: saldos e contratos prontos
+  + ledger   o primeiro acesso ao ledger depois da carga (no JSON é zero:
+             o ledger já foi montado na carga)
+
+Uso: python benchmarks/snapshot_binario.py [transacoes] [jogadores] [repeticoes]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from salas import Sala  # noqa: E402
+from snapshot_binario import compressoes_disponiveis  # noqa: E402
+
+
+def montar_sala(diretorio, n, n_jogadores, semente=42):
+    rnd = random.Random(semente)
+    sala = Sala('origem', diretorio)
+    jogadores = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(n_jogadores)]
+    sala.partida = {'Banco': {'name': 'Banco', 'pin': '2525'}, 'timestamp': 0}
+    for i, pid in enumerate(jogadores):
+        sala.partida[pid] = {'name': f'Jogador {i + 1}', 'saldo': 500000, 'historico_idx': array('l'),
+                             'color': '#3B82F6', 'poupanca': 0, 'pin': None, 'objetivo': None}
+    sala.agregados = sala.calcular_agregados()
+    participantes = jogadores + ['Banco']
+    for id in range(1, n + 1):
+        remetente, recebedor = rnd.sample(participantes, 2)
+        segundo = id // 3
+        sala.aplicar_transacao(id, remetente, recebedor, rnd.randint(1, 5000),
+                               f'{segundo // 3600 % 24:02d}:{segundo // 60 % 60:02d}:{segundo % 60:02d}')
+    sala.cobrancas_parceladas = {f'c{i}': {'devedor': jogadores[i % n_jogadores], 'credor': 'Banco', 'valor_parcela': 1000,
+                                           'parcelas_restantes': 5} for i in range(20)}
+    return sala
+
+
+def melhor(medida, repeticoes):
+    return min(medida() for _ in range(repeticoes))
+
+
+def medir(origem, diretorio, formato, compressao, repeticoes):
+    sala = Sala('bench', diretorio, 'snapshot', formato_snapshot=formato, compressao=compressao)
+    for atributo in ('partida', 'ledger', 'cobrancas_parceladas', 'agregados'):
+        setattr(sala, atributo, getattr(origem, atributo))
+
+    def salvar():
+        inicio = time.perf_counter()
+        sala.salvar()
+        return time.perf_counter() - inicio
+
+    tempo_salvar = melhor(salvar, repeticoes)
+    tamanho = os.path.getsize(sala.caminho_snapshot)
+
+    tempos = []
+    for _ in range(repeticoes):
+        fria = Sala('bench', diretorio, 'snapshot', formato_snapshot=formato, compressao=compressao)
+        inicio = time.perf_counter()
+        fria.carregar()
+        carga = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        assert len(fria.ledger) == len(origem.ledger)
+        tempos.append((carga, time.perf_counter() - inicio))
+        assert fria.partida[fria.jogadores()[0][0]]['saldo'] == origem.jogadores()[0][1]['saldo']
+    carga, ledger = min(tempos)
+    return tamanho, tempo_salvar, carga, ledger
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_jogadores = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    repeticoes = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    diretorio = tempfile.mkdtemp(prefix='snapshot-banco-')
+    origem = montar_sala(diretorio, n, n_jogadores)
+
+    variantes = [('json', None)] + [('binario', compressao) for compressao in compressoes_disponiveis()]
+    print(f'{n} transações, {n_jogadores} jogadores (melhor de {repeticoes})')
+    print(f"{'formato':<16}{'tamanho':>12}{'salvar':>12}{'a frio':>12}{'+ ledger':>12}")
+    base = None
+    for formato, compressao in variantes:
+        tamanho, salvar, carga, ledger = medir(origem, os.path.join(diretorio, f'{formato}-{compressao}'), formato, compressao, repeticoes)
+        base = base or (tamanho, salvar, carga)
+        nome = formato + (f'+{compressao}' if compressao else '')
+        print(f'{nome:<16}{tamanho / 1024:>9.0f} KB{salvar * 1000:>9.1f} ms{carga * 1000:>9.1f} ms{ledger * 1000:>9.1f} ms'
+              f'   ({base[0] / tamanho:.1f}x menor, salvar {base[1] / salvar:.1f}x, a frio {base[2] / carga:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Teste de estresse da concorrência de uma sala.
+
+Várias threads, cada uma com o seu cliente de teste, disparam pagamentos entre
+jogadores, lances e parcelas na mesma sala. No fim confere os invariantes:
+dinheiro conservado, um lançamento no ledger por pagamento aceito, índices
+dos jogadores e agregados batendo com o ledger e o journal reproduzindo o
+estado em memória.
+
+Uso: python benchmarks/stress_concorrencia.py [threads] [operacoes_por_thread]
+(BANCO_PERSISTENCIA=sqlite para exercitar o armazenamento SQLite.)
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.chdir(tempfile.mkdtemp(prefix='stress-banco-'))
+os.environ['BANCO_SALAS_DIR'] = 'salas'
+
+import app as banco  # noqa: E402
+from salas import GerenciadorSalas  # noqa: E402
+
+SALA = 'estresse'
+SALDO = 1000000
+N_JOGADORES = 6
+
+
+def preparar():
+    cliente = banco.app.test_client()
+    form = {'action': 'iniciar', 'saldo_inicial': str(SALDO)}
+    for i in range(N_JOGADORES):
+        form[f'jogador_name_{i}'] = f'J{i}'
+        form[f'jogador_color_{i}'] = '#000000'
+    cliente.post(f'/sala/{SALA}/', data=form)
+    sala = banco.SALAS.obter(SALA)
+    # Compacta com frequência para exercitar o snapshot no meio das jogadas.
+    if hasattr(sala.armazenamento, 'compactar_a_cada'):
+        sala.armazenamento.compactar_a_cada = 37
+    return sala, [pid for pid, _ in sala.jogadores()]
+
+
+def trabalhador(jogadores, leilao_id, n_operacoes, contagem, semente):
+    rnd = random.Random(semente)
+    cliente = banco.app.test_client()
+    with cliente.session_transaction() as s:
+        s[f'bank_logged_in_{SALA}'] = True
+        for pid in jogadores:
+            s[f'auth_{pid}'] = True
+    base = f'/sala/{SALA}'
+    for _ in range(n_operacoes):
+        a, b = rnd.sample(jogadores, 2)
+        sorteio = rnd.random()
+        if sorteio < 0.6:
+            cliente.post(f'{base}/transacao', data={'remetente_id': a, 'recebedor_id': b, 'valor': str(rnd.randint(1, 500))})
+            contagem['pagamentos'] += 1
+        elif sorteio < 0.8:
+            cliente.post(f'{base}/leilao/{leilao_id}/lance/{a}', data={'lance': str(rnd.randint(1, 5000))})
+        elif sorteio < 0.9:
+            cliente.post(f'{base}/cobrar/parcelar/{a}', data={'devedor_id': b, 'valor_total': '600', 'num_parcelas': '3'})
+        else:
+            sala = banco.SALAS.obter(SALA)
+            for iid, c in list(sala.cobrancas_parceladas.items()):
+                cliente.post(f'{base}/pagar/parcela/{c["devedor_id"]}/{iid}')
+                break
+
+
+def main():
+    n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    n_operacoes = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    sala, jogadores = preparar()
+    cliente = banco.app.test_client()
+    with cliente.session_transaction() as s:
+        s[f'bank_logged_in_{SALA}'] = True
+    cliente.post(f'/sala/{SALA}/leilao/iniciar', data={'propriedade': 'Av. Paulista', 'lance_inicial': '1', 'duracao': '3600'})
+    leilao_id = next(iter(sala.leiloes))
+
+    contagens = [{'pagamentos': 0} for _ in range(n_threads)]
+    threads = [threading.Thread(target=trabalhador, args=(jogadores, leilao_id, n_operacoes, contagens[i], i)) for i in range(n_threads)]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cliente.post(f'/sala/{SALA}/leilao/{leilao_id}/finalizar')
+    duracao = time.perf_counter() - inicio
+
+    # Tudo o que sai de um jogador e não vai para o Banco chega a outro jogador.
+    para_banco = sum(t['valor'] for t in sala.ledger if t['recebedor_id'] == 'Banco')
+    total = sum(d['saldo'] + d['poupanca'] for _, d in sala.jogadores())
+    assert total == SALDO * N_JOGADORES - para_banco, (total, para_banco)
+
+    ids = [t['id'] for t in sala.ledger]
+    assert ids == sorted(set(ids)), 'ids do ledger repetidos ou fora de ordem'
+    entre_jogadores = sum(1 for t in sala.ledger if t['recebedor_id'] != 'Banco')
+    assert entre_jogadores >= sum(c['pagamentos'] for c in contagens)
+    for pid, dados in sala.jogadores():
+        esperado = [p for p, t in enumerate(sala.ledger) if pid in (t['remetente_id'], t['recebedor_id'])]
+        assert list(dados['historico_idx']) == esperado, f'índice de {pid} diverge do ledger'
+    assert not sala.auditar_agregados(), sala.auditar_agregados()
+
+    # O que está no disco (snapshot + journal, ou o SQLite) reproduz o estado em memória.
+    copia = GerenciadorSalas(banco.SALAS_DIR, banco.MODO_PERSISTENCIA, formato_snapshot=banco.FORMATO_SNAPSHOT,
+                             compressao=banco.COMPRESSAO_SNAPSHOT).obter(SALA)
+    assert [(t['id'], t['valor']) for t in copia.ledger] == [(t['id'], t['valor']) for t in sala.ledger]
+    assert {pid: d['saldo'] for pid, d in copia.jogadores()} == {pid: d['saldo'] for pid, d in sala.jogadores()}
+    assert copia.cobrancas_parceladas == sala.cobrancas_parceladas
+    assert copia.agregados == sala.agregados and not copia.auditar_agregados()
+
+    total_ops = n_threads * n_operacoes
+    print(f'{total_ops} operações em {n_threads} threads: {duracao:.2f}s ({total_ops / duracao:.0f} op/s), '
+          f'{len(sala.ledger)} transações no ledger. Invariantes OK.')
+
+
+if __name__ == '__main__':
+    main()
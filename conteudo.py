@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from efeitos import validar_regra
+from metricas import registrar_evento
+from propriedades import ATRIBUTOS, Catalogo
+
+# --- CONTEÚDO DO JOGO (conteudo_jogo.json) ---
+#
+# Objetivos, manchetes e o catálogo de propriedades são lidos do arquivo e
+# guardados em cache. A cada consulta (atual()) o mtime e o tamanho do
+# arquivo são conferidos com um stat; se mudaram, o arquivo é lido de novo
+# e validado. Um arquivo com erro não derruba nada: o conteúdo anterior
+# continua valendo e o erro vai para o log, com o caminho de cada problema.
+#
+# Cada versão do conteúdo tem uma 'versao' (hash das manchetes): o baralho
+# de uma sala guarda a versão com que foi embaralhado e é refeito quando as
+# manchetes mudam.
+
+
+class ConteudoInvalido(ValueError):
+    def __init__(self, problemas):
+        super().__init__('; '.join(problemas))
+        self.problemas = problemas
+
+
+class Versao:
+    """Um conteúdo já validado. Não é alterado depois de criado."""
+
+    def __init__(self, objetivos=(), manchetes=(), propriedades=()):
+        self.objetivos = list(objetivos)
+        self.manchetes = list(manchetes)
+        self.catalogo = Catalogo(propriedades)
+        self.versao = hashlib.sha1(json.dumps(self.manchetes, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def _texto(valor):
+    return isinstance(valor, str) and valor.strip() != ''
+
+
+def validar(conteudo):
+    """Lista de problemas do conteúdo (vazia se estiver tudo certo)."""
+    if not isinstance(conteudo, dict):
+        return ['o arquivo deve ser um objeto JSON']
+    problemas = []
+    for chave in ('objetivos', 'manchetes', 'propriedades'):
+        if not isinstance(conteudo.get(chave, []), list):
+            problemas.append(f'{chave}: deve ser uma lista')
+    if problemas:
+        return problemas
+
+    for i, objetivo in enumerate(conteudo.get('objetivos', [])):
+        if not _texto(objetivo):
+            problemas.append(f'objetivos[{i}]: deve ser um texto')
+
+    for i, manchete in enumerate(conteudo.get('manchetes', [])):
+        if not isinstance(manchete, dict):
+            problemas.append(f'manchetes[{i}]: deve ser um objeto')
+            continue
+        for campo in ('titulo', 'texto', 'efeito', 'tipo'):
+            if not _texto(manchete.get(campo)):
+                problemas.append(f'manchetes[{i}].{campo}: obrigatório (texto)')
+        if 'regra' in manchete:
+            if not isinstance(manchete['regra'], dict):
+                problemas.append(f'manchetes[{i}].regra: deve ser um objeto')
+            else:
+                problemas.extend(f'manchetes[{i}].regra: {p}' for p in validar_regra(manchete['regra']))
+
+    nomes = set()
+    for i, propriedade in enumerate(conteudo.get('propriedades', [])):
+        if not isinstance(propriedade, dict) or not _texto(propriedade.get('nome')):
+            problemas.append(f'propriedades[{i}].nome: obrigatório (texto)')
+            continue
+        if propriedade['nome'] in nomes:
+            problemas.append(f"propriedades[{i}].nome: '{propriedade['nome']}' repetido")
+        nomes.add(propriedade['nome'])
+        for campo in ATRIBUTOS:
+            if propriedade.get(campo) is not None and not _texto(propriedade[campo]):
+                problemas.append(f'propriedades[{i}].{campo}: deve ser texto ou null')
+    return problemas
+
+
+class Conteudo:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._assinatura = None
+        self._atual = Versao()
+        self._lock = threading.Lock()
+        self.atual()
+
+    def atual(self):
+        """O conteúdo em vigor, relido se o arquivo mudou desde a última consulta."""
+        try:
+            info = os.stat(self.caminho)
+            assinatura = (info.st_mtime_ns, info.st_size)
+        except OSError:
+            assinatura = None
+        if assinatura != self._assinatura:
+            with self._lock:
+                if assinatura != self._assinatura:
+                    self._recarregar(assinatura)
+        return self._atual
+
+    def _recarregar(self, assinatura):
+        # A assinatura é guardada mesmo com erro: o mesmo arquivo quebrado não é relido a cada consulta.
+        self._assinatura = assinatura
+        if assinatura is None:
+            registrar_evento(logging.ERROR, 'conteudo_ausente', caminho=self.caminho)
+            return
+        try:
+            with open(self.caminho, 'r', encoding='utf-8') as f:
+                conteudo = json.load(f)
+            problemas = validar(conteudo)
+            if problemas:
+                raise ConteudoInvalido(problemas)
+        except (OSError, ValueError) as e:
+            registrar_evento(logging.ERROR, 'conteudo_invalido', caminho=self.caminho, erro=e)
+            return
+        self._atual = Versao(conteudo.get('objetivos', []), conteudo.get('manchetes', []), conteudo.get('propriedades', []))
+        registrar_evento(logging.INFO, 'conteudo_carregado', caminho=self.caminho, versao=self._atual.versao,
+                         manchetes=len(self._atual.manchetes), objetivos=len(self._atual.objetivos),
+                         propriedades=len(self._atual.catalogo.itens))
@@ -0,0 +1,136 @@
+from propriedades import ATRIBUTOS
+
+# --- EFEITOS DAS MANCHETES ---
+#
+# Uma manchete pode trazer, além do texto do 'efeito', uma 'regra' que a
+# máquina entende. A regra diz quem é atingido e quanto cada um paga ao
+# banco ou recebe dele:
+#
+#   alvo        'todos', 'individual' (o jogador escolhido pelo banco),
+#               'metade_rica', 'metade_pobre' (pela base) ou 'donos' (quem
+#               tem alguma propriedade que passa no filtro)
+#   sentido     'receber' ou 'pagar'
+#   valor       quantia fixa, ou
+#   percentual  percentual da base: 'saldo' (padrão), 'total' (saldo +
+#               poupança) ou 'poupanca'
+#   filtro      {atributo: valor ou [valores]} sobre o registro de posses
+#               (ex.: {"setor": ["Tech Solutions", "EcoEnergia"]})
+#   por_propriedade     multiplica pelo número de propriedades do filtro
+#   maximo_percentual   teto do percentual depois de multiplicar
+#   senao_valor         no alvo individual com filtro: quantia para quem
+#                       não tem nenhuma propriedade do filtro
+#   pagadores   'banco' (padrão) ou 'jogadores': no sentido 'receber', cada
+#               um dos outros jogadores paga o valor ao alvo
+#
+# As manchetes sem regra (dados, prisão, trocas de propriedade) continuam
+# sendo resolvidas à mão pelo banco.
+
+ALVOS = ('todos', 'individual', 'metade_rica', 'metade_pobre', 'donos')
+BASES = ('saldo', 'total', 'poupanca')
+
+
+def validar_regra(regra):
+    """Lista de problemas da regra (vazia se ela puder ser aplicada)."""
+    problemas = []
+    if regra.get('alvo') not in ALVOS:
+        problemas.append(f"alvo deve ser um de {', '.join(ALVOS)}")
+    if regra.get('sentido') not in ('receber', 'pagar'):
+        problemas.append("sentido deve ser 'receber' ou 'pagar'")
+    if ('valor' in regra) == ('percentual' in regra):
+        problemas.append("informe 'valor' ou 'percentual' (um dos dois)")
+    # Os números vão direto para a conta: texto, null ou true quebrariam o cálculo na hora da manchete.
+    for campo in ('valor', 'senao_valor', 'percentual', 'maximo_percentual'):
+        if campo in regra and not (_numero(regra[campo]) and regra[campo] >= 0):
+            problemas.append(f"{campo} deve ser um número maior ou igual a zero")
+        elif campo in ('valor', 'senao_valor') and campo in regra and not isinstance(regra[campo], int):
+            problemas.append(f"{campo} deve ser inteiro (reais, sem centavos)")
+        elif campo in ('percentual', 'maximo_percentual') and campo in regra and regra[campo] > 100:
+            problemas.append(f"{campo} deve estar entre 0 e 100")
+    if regra.get('base', 'saldo') not in BASES:
+        problemas.append(f"base deve ser uma de {', '.join(BASES)}")
+    filtro = regra.get('filtro', {})
+    if not isinstance(filtro, dict):
+        problemas.append("filtro deve ser um objeto {atributo: valor ou [valores]}")
+        filtro = {}
+    elif len(filtro) > 1 or any(campo not in ATRIBUTOS for campo in filtro):
+        problemas.append(f"filtro deve ter um único atributo entre {', '.join(ATRIBUTOS)}")
+    elif any(not _valores_do_filtro(valores) for valores in filtro.values()):
+        problemas.append("filtro: o valor do atributo deve ser um texto ou uma lista de textos")
+    if (regra.get('alvo') == 'donos' or regra.get('por_propriedade')) and not filtro:
+        problemas.append("alvo 'donos' e por_propriedade precisam de filtro")
+    if regra.get('pagadores', 'banco') not in ('banco', 'jogadores') or (
+            regra.get('pagadores') == 'jogadores' and (regra.get('sentido') != 'receber' or 'percentual' in regra)):
+        problemas.append("pagadores 'jogadores' só vale com sentido 'receber' e valor fixo")
+    return problemas
+
+
+def _numero(valor):
+    # bool é subclasse de int no Python: true não é um valor em reais.
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+
+def _valores_do_filtro(valores):
+    valores = valores if isinstance(valores, list) else [valores]
+    return bool(valores) and all(isinstance(valor, str) and valor for valor in valores)
+
+
+def propriedades_no_filtro(posses, player_id, filtro):
+    """Quantas propriedades do jogador passam no filtro (uma consulta ao índice por valor)."""
+    if not filtro:
+        return 0
+    ((campo, valores),) = filtro.items()
+    valores = valores if isinstance(valores, list) else [valores]
+    return sum(posses.quantas(player_id, **{campo: valor}) for valor in valores)
+
+
+def _base(dados, base):
+    if base == 'total':
+        return dados['saldo'] + dados.get('poupanca', 0)
+    return dados.get(base, 0)
+
+
+def _alvos(regra, jogadores, posses, beneficiario_id):
+    alvo = regra['alvo']
+    if alvo == 'individual':
+        return [(pid, dados) for pid, dados in jogadores if pid == beneficiario_id]
+    if alvo == 'donos':
+        return [(pid, dados) for pid, dados in jogadores if propriedades_no_filtro(posses, pid, regra['filtro'])]
+    if alvo in ('metade_rica', 'metade_pobre'):
+        ordenados = sorted(jogadores, key=lambda j: _base(j[1], regra.get('base', 'saldo')))
+        metade = len(ordenados) // 2
+        return ordenados[len(ordenados) - metade:] if alvo == 'metade_rica' else ordenados[:metade]
+    return list(jogadores)
+
+
+def _valor(regra, dados, quantidade):
+    """Quanto um jogador atingido paga ou recebe."""
+    if regra.get('filtro') and regra['alvo'] == 'individual' and not regra.get('por_propriedade') and not quantidade:
+        return regra.get('senao_valor', 0)
+    multiplicador = quantidade if regra.get('por_propriedade') else 1
+    if 'valor' in regra:
+        return regra['valor'] * multiplicador
+    percentual = regra['percentual'] * multiplicador
+    if 'maximo_percentual' in regra:
+        percentual = min(percentual, regra['maximo_percentual'])
+    return int(_base(dados, regra.get('base', 'saldo')) * percentual / 100)
+
+
+def calcular_transferencias(regra, jogadores, posses, beneficiario_id=None):
+    """Transferências (remetente_id, recebedor_id, valor) que a regra produz agora.
+
+    `jogadores` são os pares (id, dados) da sala; `posses`, o registro de
+    posses. Jogadores com valor zero (saldo negativo, nenhuma propriedade)
+    ficam de fora.
+    """
+    transferencias = []
+    for pid, dados in _alvos(regra, jogadores, posses, beneficiario_id):
+        valor = _valor(regra, dados, propriedades_no_filtro(posses, pid, regra.get('filtro')))
+        if valor <= 0:
+            continue
+        if regra.get('pagadores') == 'jogadores':
+            transferencias.extend((outro, pid, valor) for outro, _ in jogadores if outro != pid)
+        elif regra['sentido'] == 'receber':
+            transferencias.append(('Banco', pid, valor))
+        else:
+            transferencias.append((pid, 'Banco', valor))
+    return transferencias
@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:  # opcional: sem o pacote, só gzip
+    brotli = None
+
+# --- ESTÁTICOS: CSS/JS COM HASH NO NOME E COMPRESSÃO ---
+#
+# Os arquivos de static/css e static/js são lidos uma vez e servidos com o
+# hash do conteúdo no nome (app.3f2a9c1b.css): o navegador guarda por um ano
+# sem revalidar, e um arquivo alterado ganha outro nome. As versões gzip (e
+# brotli, se o pacote estiver instalado) ficam prontas em memória.
+# As respostas dinâmicas (HTML e JSON) são comprimidas na saída.
+
+PASTAS_PUBLICAS = ('css', 'js')
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+TIPOS_COMPRIMIVEIS = ('text/html', 'application/json')
+TAMANHO_MINIMO_COMPRESSAO = 512
+
+
+def comprimir(dados, codificacao, nivel_maximo=False):
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=11 if nivel_maximo else 5)
+    return gzip.compress(dados, 9 if nivel_maximo else 6, mtime=0)
+
+
+def escolher_codificacao(aceitas):
+    """Melhor Content-Encoding que o cliente aceita ('br', 'gzip' ou None)."""
+    if brotli is not None and aceitas['br']:
+        return 'br'
+    if aceitas['gzip']:
+        return 'gzip'
+    return None
+
+
+class Estaticos:
+    def __init__(self, diretorio, verificar_mudancas=False):
+        self.diretorio = diretorio
+        # Em desenvolvimento, arquivos editados são relidos sem reiniciar o servidor.
+        self.verificar_mudancas = verificar_mudancas
+        self._arquivos = {}
+
+    def _ler(self, caminho):
+        """Lê (ou relê, se mudou no disco) um arquivo público. Retorna None se não existir."""
+        if caminho.split('/', 1)[0] not in PASTAS_PUBLICAS or '..' in caminho.split('/'):
+            return None
+        arquivo = self._arquivos.get(caminho)
+        if arquivo is not None and not self.verificar_mudancas:
+            return arquivo
+        completo = os.path.join(self.diretorio, *caminho.split('/'))
+        try:
+            mtime = os.path.getmtime(completo)
+        except OSError:
+            return None
+        if arquivo is not None and arquivo['mtime'] == mtime:
+            return arquivo
+        with open(completo, 'rb') as f:
+            dados = f.read()
+        raiz, extensao = os.path.splitext(caminho)
+        arquivo = {
+            'mtime': mtime,
+            'nome': f'{raiz}.{hashlib.sha256(dados).hexdigest()[:10]}{extensao}',
+            'tipo': mimetypes.guess_type(caminho)[0] or 'application/octet-stream',
+            'identity': dados,
+            'gzip': comprimir(dados, 'gzip', nivel_maximo=True),
+        }
+        if brotli is not None:
+            arquivo['br'] = comprimir(dados, 'br', nivel_maximo=True)
+        self._arquivos[caminho] = arquivo
+        return arquivo
+
+    def nome_versionado(self, caminho):
+        """'css/app.css' -> 'css/app.<hash>.css' (o próprio caminho se o arquivo não existir)."""
+        arquivo = self._ler(caminho)
+        return arquivo['nome'] if arquivo else caminho
+
+    def buscar(self, nome):
+        """Resolve o nome pedido na URL: (arquivo, imutavel) ou (None, False).
+
+        Aceita o nome com hash (só se for o conteúdo atual) e o nome simples,
+        que não leva cache longo.
+        """
+        raiz, extensao = os.path.splitext(nome)
+        original = raiz.rpartition('.')[0]
+        if original:
+            arquivo = self._ler(original + extensao)
+            if arquivo is not None and arquivo['nome'] == nome:
+                return arquivo, True
+        arquivo = self._ler(nome)
+        return arquivo, False
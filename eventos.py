@@ -0,0 +1,100 @@
+import itertools
+import json
+import queue
+import threading
+
+# --- EVENTOS: PUSH VIA SERVER-SENT EVENTS ---
+#
+# Cada sala tem um barramento. As páginas assinam canais (o id do jogador,
+# 'banco' e 'todos') e recebem pequenos eventos com o que mudou, em vez de
+# recarregar a página inteira. Quem publica nunca espera: um assinante que
+# não dá conta da fila perde a assinatura e recebe 'recarregar' para
+# ressincronizar a página.
+
+TAMANHO_FILA = 64
+INTERVALO_PING = 15
+
+
+def formatar_sse(tipo, dados, id=None):
+    linhas = [] if id is None else [f'id: {id}']
+    linhas.append(f'event: {tipo}')
+    linhas.append('data: ' + json.dumps(dados, separators=(',', ':')))
+    return '\n'.join(linhas) + '\n\n'
+
+
+class Assinatura:
+    def __init__(self, canais):
+        self.canais = canais
+        self.fila = queue.Queue(TAMANHO_FILA)
+        self.perdeu_eventos = False
+
+
+class Barramento:
+    def __init__(self):
+        self._assinaturas = {}
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def assinar(self, canais):
+        assinatura = Assinatura(tuple(canais))
+        with self._lock:
+            for canal in assinatura.canais:
+                self._assinaturas.setdefault(canal, set()).add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            for canal in assinatura.canais:
+                assinantes = self._assinaturas.get(canal)
+                if assinantes is not None:
+                    assinantes.discard(assinatura)
+                    if not assinantes:
+                        del self._assinaturas[canal]
+
+    def encerrar(self):
+        """Desliga todas as assinaturas (sala tirada da memória): as páginas se reconectam."""
+        with self._lock:
+            assinaturas = set().union(*self._assinaturas.values()) if self._assinaturas else set()
+            self._assinaturas.clear()
+        for assinatura in assinaturas:
+            assinatura.perdeu_eventos = True
+
+    def publicar(self, tipo, dados, *canais):
+        """Entrega o evento a quem assina qualquer um dos canais (uma vez por assinante)."""
+        with self._lock:
+            destinos = set()
+            for canal in canais:
+                destinos.update(self._assinaturas.get(canal, ()))
+            if not destinos:
+                return
+            mensagem = formatar_sse(tipo, dados, next(self._seq))
+        for assinatura in destinos:
+            try:
+                assinatura.fila.put_nowait(mensagem)
+            except queue.Full:
+                assinatura.perdeu_eventos = True
+                self.cancelar(assinatura)
+
+    def transmitir(self, canais, tique=None):
+        """Gerador do corpo da resposta text/event-stream.
+
+        `tique`, se informado, é chamado a cada volta e devolve quantos
+        segundos esperar no máximo pelo próximo evento (por exemplo, até o
+        fim do leilão, para o martelo ser batido mesmo sem requisições).
+        """
+        assinatura = self.assinar(canais)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                espera = INTERVALO_PING if tique is None else min(INTERVALO_PING, tique())
+                try:
+                    mensagem = assinatura.fila.get(timeout=espera)
+                except queue.Empty:
+                    if assinatura.perdeu_eventos:
+                        yield formatar_sse('recarregar', {})
+                        return
+                    yield ': ping\n\n'
+                    continue
+                yield mensagem
+        finally:
+            self.cancelar(assinatura)
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+# --- IDEMPOTÊNCIA DOS POSTS ---
+#
+# Celular no Wi-Fi ruim reenvia o formulário: sem proteção, cada reenvio
+# executa a transação de novo. Os formulários e chamadas que mudam o estado
+# levam uma chave de idempotência (campo 'idempotencia' ou cabeçalho
+# Idempotency-Key). A primeira requisição com a chave é atendida e o
+# resultado guardado aqui; as repetições recebem o mesmo resultado, sem
+# tocar no estado nem no disco.
+#
+# O cache é limitado em tamanho (LRU) e em tempo (TTL). Uma repetição que
+# chega enquanto a original ainda está rodando espera por ela. Uma chave
+# reaproveitada para outra rota é recusada (conflito).
+
+NOVA = 'nova'
+REPETIDA = 'repetida'
+CONFLITO = 'conflito'
+EM_ANDAMENTO = 'em_andamento'
+
+
+class _Entrada:
+    __slots__ = ('impressao', 'resultado', 'criada')
+
+    def __init__(self, impressao):
+        self.impressao = impressao
+        self.resultado = None
+        self.criada = time.monotonic()
+
+
+class CacheIdempotencia:
+    def __init__(self, maximo=10000, ttl=600, espera=10):
+        self.maximo = maximo
+        self.ttl = ttl
+        # Quanto uma repetição espera pela original ainda em andamento (s).
+        self.espera = espera
+        self._itens = OrderedDict()
+        self._condicao = threading.Condition()
+
+    def iniciar(self, chave, impressao):
+        """Reserva a chave para esta requisição, ou devolve o resultado já guardado.
+
+        `impressao` identifica a operação (método e caminho). Retorna
+        (NOVA, None), (REPETIDA, resultado), (CONFLITO, None) ou
+        (EM_ANDAMENTO, None) se a original não terminou dentro da espera.
+        """
+        with self._condicao:
+            agora = time.monotonic()
+            limite = agora + self.espera
+            while True:
+                entrada = self._itens.get(chave)
+                if entrada is not None and agora - entrada.criada > self.ttl:
+                    del self._itens[chave]
+                    entrada = None
+                if entrada is None:
+                    # Nova, ou a original falhou e abandonou a chave: esta requisição executa.
+                    self._itens[chave] = _Entrada(impressao)
+                    self._limitar(agora)
+                    return NOVA, None
+                if entrada.impressao != impressao:
+                    return CONFLITO, None
+                self._itens.move_to_end(chave)
+                if entrada.resultado is not None:
+                    return REPETIDA, entrada.resultado
+                if agora >= limite:
+                    return EM_ANDAMENTO, None
+                self._condicao.wait(limite - agora)
+                agora = time.monotonic()
+
+    def concluir(self, chave, resultado):
+        """Guarda o resultado da requisição que reservou a chave."""
+        with self._condicao:
+            entrada = self._itens.get(chave)
+            if entrada is not None:
+                entrada.resultado = resultado
+                entrada.criada = time.monotonic()
+            self._condicao.notify_all()
+
+    def abandonar(self, chave):
+        """Libera a chave (a requisição falhou): uma repetição executa de novo."""
+        with self._condicao:
+            self._itens.pop(chave, None)
+            self._condicao.notify_all()
+
+    def __len__(self):
+        return len(self._itens)
+
+    def _limitar(self, agora):
+        # Expiradas saem pela frente (as menos usadas); passando do máximo, as mais antigas também.
+        while self._itens:
+            chave, entrada = next(iter(self._itens.items()))
+            if len(self._itens) <= self.maximo and agora - entrada.criada <= self.ttl:
+                break
+            del self._itens[chave]
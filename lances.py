@@ -0,0 +1,116 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from metricas import METRICAS, registrar_evento
+
+# --- FILA DE LANCES ---
+#
+# Nos últimos segundos de um leilão, todos os celulares dão lance ao mesmo
+# tempo. Em vez de cada requisição disputar lock_leilao, validar e gravar
+# sozinha, o lance entra numa fila com um número de sequência dado pelo
+# servidor (e a hora de chegada) e a requisição volta na hora.
+#
+# Uma única thread consumidora tira da fila tudo o que chegou desde a última
+# volta e entrega o grupo, em ordem de sequência, ao `resolver`: ele aplica os
+# lances de cada sala com uma só entrada em lock_leilao, grava cada leilão
+# alterado uma vez por grupo e avisa cada licitante do resultado. Sob disputa,
+# o grupo cresce e o custo de disco por lance cai.
+#
+# Ninguém espera a fila numa requisição. O martelo espera só os lances já
+# enviados ao seu leilão (aguardar_leilao); scripts e benchmarks esperam
+# um lance com Lance.esperar(). A página que volta do formulário consulta
+# resultado(seq): os últimos RESULTADOS_GUARDADOS lances resolvidos ficam
+# guardados, sem a sala.
+
+RESULTADOS_GUARDADOS = 4096
+
+METRICAS.contador('banco_lances_total', 'Lances resolvidos pela fila, por resultado.')
+METRICAS.histograma('banco_lances_grupo', 'Lances resolvidos juntos em cada volta da fila.', limites=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+class Lance:
+    __slots__ = ('seq', 'sala', 'leilao_id', 'player_id', 'valor', 'recebido_em', 'erro', '_resolvido')
+
+    def __init__(self, seq, sala, leilao_id, player_id, valor):
+        self.seq = seq
+        self.sala = sala
+        self.leilao_id = leilao_id
+        self.player_id = player_id
+        self.valor = valor
+        self.recebido_em = time.time()
+        # Mensagem de recusa, ou None se o lance valeu. Fica com o erro genérico se o resolver falhar antes de chegar nele.
+        self.erro = "Erro no lance."
+        self._resolvido = threading.Event()
+
+    def esperar(self, timeout=None):
+        """Espera a fila resolver este lance. Retorna False se o tempo acabou antes."""
+        return self._resolvido.wait(timeout)
+
+
+class FilaLances:
+    def __init__(self, resolver):
+        self._resolver = resolver
+        self._seq = itertools.count(1)
+        self._pendentes = []
+        # Último lance enviado a cada leilão ainda na fila, por (sala, leilão).
+        self._ultimo_do_leilao = {}
+        # seq -> (erro, valor) dos lances já resolvidos, os mais recentes.
+        self._resultados = OrderedDict()
+        self._condicao = threading.Condition()
+        self._thread = None
+
+    def enviar(self, sala, leilao_id, player_id, valor):
+        """Põe o lance na fila e devolve o Lance com o número de sequência. Não espera nada."""
+        with self._condicao:
+            lance = Lance(next(self._seq), sala, leilao_id, player_id, valor)
+            self._pendentes.append(lance)
+            self._ultimo_do_leilao[(sala.id, leilao_id)] = lance
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._rodar, name='lances', daemon=True)
+                self._thread.start()
+            self._condicao.notify_all()
+        return lance
+
+    def aguardar_leilao(self, sala, leilao_id, timeout=5):
+        """Espera a fila resolver os lances já enviados a um leilão (os das outras salas não contam).
+
+        Não chame com lock_leilao na mão: o consumidor precisa dela.
+        """
+        with self._condicao:
+            lance = self._ultimo_do_leilao.get((sala.id, leilao_id))
+        return lance is None or lance.esperar(timeout)
+
+    def resultado(self, seq):
+        """(erro, valor) de um lance já resolvido; None se ainda está na fila (ou saiu da lista)."""
+        with self._condicao:
+            return self._resultados.get(seq)
+
+    def pendentes(self):
+        with self._condicao:
+            return len(self._pendentes)
+
+    def _rodar(self):
+        while True:
+            with self._condicao:
+                while not self._pendentes:
+                    self._condicao.wait()
+                grupo, self._pendentes = self._pendentes, []
+            try:
+                self._resolver(grupo)
+            except Exception as e:
+                registrar_evento(logging.ERROR, 'erro_fila_lances', lances=len(grupo), erro=e)
+            METRICAS.observar('banco_lances_grupo', len(grupo))
+            for lance in grupo:
+                METRICAS.incrementar('banco_lances_total', resultado='recusado' if lance.erro else 'aceito')
+                lance._resolvido.set()
+            with self._condicao:
+                for lance in grupo:
+                    chave = (lance.sala.id, lance.leilao_id)
+                    if self._ultimo_do_leilao.get(chave) is lance:
+                        del self._ultimo_do_leilao[chave]
+                    self._resultados[lance.seq] = (lance.erro, lance.valor)
+                while len(self._resultados) > RESULTADOS_GUARDADOS:
+                    self._resultados.popitem(last=False)
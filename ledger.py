@@ -0,0 +1,89 @@
+from array import array
+from bisect import bisect_left
+
+# --- LEDGER COLUNAR ---
+#
+# Em vez de um dict de seis chaves por transação, o ledger guarda cada campo
+# numa coluna tipada (array): id e valor em 8 bytes, remetente e recebedor
+# como índices de 2 bytes numa tabela de participantes (o UUID de cada
+# jogador é guardado uma vez só, com o Banco na posição 0) e a data/hora
+# como índice de 4 bytes numa tabela de textos (uma partida tem poucos
+# valores distintos de 'HH:MM:SS'). São 24 bytes por transação.
+#
+# Quem precisa de uma transação no formato de sempre (templates, JSON) pede
+# ledger[posicao], que monta o dict na hora. Varreduras longas (agregados,
+# relatório, snapshot) leem as colunas direto.
+
+CAMPOS = ('id', 'valor', 'remetente_id', 'recebedor_id', 'timestamp', 'data_hora')
+# Maior valor que cabe na coluna de 8 bytes (e no INTEGER do SQLite).
+VALOR_MAXIMO = 2 ** 63 - 1
+
+
+class Ledger:
+    __slots__ = ('ids', 'valores', 'remetentes', 'recebedores', 'horas', 'participantes', '_participante', 'textos_hora', '_texto_hora')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.valores = array('q')
+        self.remetentes = array('H')
+        self.recebedores = array('H')
+        self.horas = array('I')
+        self.participantes = ['Banco']
+        self._participante = {'Banco': 0}
+        self.textos_hora = [None]
+        self._texto_hora = {None: 0}
+
+    def indice(self, participante_id):
+        """Índice (pequeno) do participante na tabela do ledger; ids novos entram no fim."""
+        indice = self._participante.get(participante_id)
+        if indice is None:
+            indice = self._participante[participante_id] = len(self.participantes)
+            self.participantes.append(participante_id)
+        return indice
+
+    def anotar(self, id, valor, remetente_id, recebedor_id, data_hora):
+        """Acrescenta uma transação (ids sempre crescentes). Retorna a posição dela.
+
+        Campos que não cabem nas colunas (valor fora de int64, tipo errado)
+        levantam OverflowError/TypeError antes de qualquer coluna crescer.
+        """
+        # Convertidos antes: um erro no meio dos appends deixaria as colunas com tamanhos diferentes.
+        numeros = array('q', (id, valor))
+        indices = array('H', (self.indice(remetente_id), self.indice(recebedor_id)))
+        hora = self._texto_hora.get(data_hora)
+        if hora is None:
+            hora = self._texto_hora[data_hora] = len(self.textos_hora)
+            self.textos_hora.append(data_hora)
+        self.ids.append(numeros[0])
+        self.valores.append(numeros[1])
+        self.remetentes.append(indices[0])
+        self.recebedores.append(indices[1])
+        self.horas.append(hora)
+        return len(self.ids) - 1
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, posicao):
+        id = self.ids[posicao]
+        return {
+            'id': id,
+            'valor': self.valores[posicao],
+            'remetente_id': self.participantes[self.remetentes[posicao]],
+            'recebedor_id': self.participantes[self.recebedores[posicao]],
+            'timestamp': id,
+            'data_hora': self.textos_hora[self.horas[posicao]]
+        }
+
+    def __iter__(self):
+        return (self[posicao] for posicao in range(len(self.ids)))
+
+    def linhas(self):
+        """Tuplas (id, valor, remetente_id, recebedor_id, data_hora), no formato do snapshot."""
+        participantes, textos = self.participantes, self.textos_hora
+        return [(id, valor, participantes[r], participantes[d], textos[h])
+                for id, valor, r, d, h in zip(self.ids, self.valores, self.remetentes, self.recebedores, self.horas)]
+
+    def posicao_do_id(self, id):
+        """Posição da primeira transação com id >= `id` (os ids estão em ordem)."""
+        return bisect_left(self.ids, id)
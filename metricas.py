@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+
+# --- MÉTRICAS E LOG ESTRUTURADO ---
+#
+# Contadores e histogramas em memória, por processo, exportados no formato
+# texto do Prometheus. Medidores (tamanho do ledger, leilões ativos, ...)
+# são funções chamadas só na hora da coleta, para não custar nada por jogada.
+#
+# O log usa o logger 'banco' com linhas chave=valor (logfmt). O nível vem de
+# BANCO_LOG_NIVEL; no padrão (WARNING) só erros são escritos, e nenhuma
+# linha é montada para eventos abaixo do nível.
+
+# Limites (em segundos) dos histogramas de latência: os padrões do Prometheus.
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger('banco')
+
+
+def configurar_log(nivel):
+    """Manda o logger 'banco' para stderr, uma linha por evento, a partir do nível dado."""
+    if not log.handlers:
+        saida = logging.StreamHandler()
+        saida.setFormatter(logging.Formatter('ts=%(asctime)s nivel=%(levelname)s %(message)s'))
+        log.addHandler(saida)
+        log.propagate = False
+    log.setLevel(nivel.upper() if isinstance(nivel, str) else nivel)
+
+
+def _valor_logfmt(valor):
+    if isinstance(valor, float):
+        return f'{valor:.3f}'
+    texto = str(valor)
+    if not texto or any(c in texto for c in ' ="\n'):
+        return '"' + texto.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return texto
+
+
+def registrar_evento(nivel, evento, **campos):
+    """Escreve 'evento=<evento> chave=valor ...' no log, se o nível estiver habilitado."""
+    if log.isEnabledFor(nivel):
+        log.log(nivel, ' '.join([f'evento={evento}'] + [f'{k}={_valor_logfmt(v)}' for k, v in campos.items()]))
+
+
+def _rotulos(rotulos, extra=None):
+    pares = list(rotulos) + ([extra] if extra else [])
+    if not pares:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for k, v in pares) + '}'
+
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # nome -> (tipo, ajuda); nome -> {rótulos (tupla ordenada): valor}
+        self._descricoes = {}
+        self._contadores = {}
+        self._histogramas = {}
+        self._medidores = {}
+
+    def contador(self, nome, ajuda):
+        self._descricoes[nome] = ('counter', ajuda)
+        self._contadores.setdefault(nome, {})
+
+    def histograma(self, nome, ajuda, limites=LIMITES_SEGUNDOS):
+        self._descricoes[nome] = ('histogram', ajuda)
+        self._histogramas.setdefault(nome, (limites, {}))
+
+    def medidor(self, nome, ajuda, coletar):
+        """Medidor calculado na coleta: `coletar()` devolve [(rótulos dict, valor)]."""
+        self._descricoes[nome] = ('gauge', ajuda)
+        self._medidores[nome] = coletar
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self._lock:
+            serie = self._contadores[nome]
+            serie[chave] = serie.get(chave, 0) + valor
+
+    def observar(self, nome, valor, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        limites, series = self._histogramas[nome]
+        with self._lock:
+            serie = series.get(chave)
+            if serie is None:
+                # Contagem por faixa (não acumulada), soma e total.
+                serie = series[chave] = [[0] * len(limites), 0.0, 0]
+            for i, limite in enumerate(limites):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def cronometrar(self, nome, **rotulos):
+        """Gerenciador de contexto que observa no histograma a duração do bloco."""
+        return _Cronometro(self, nome, rotulos)
+
+    def exportar(self):
+        """Todas as métricas no formato texto do Prometheus (versão 0.0.4)."""
+        linhas = []
+        with self._lock:
+            contadores = {nome: dict(serie) for nome, serie in self._contadores.items()}
+            histogramas = {nome: (limites, {k: ([*v[0]], v[1], v[2]) for k, v in series.items()})
+                           for nome, (limites, series) in self._histogramas.items()}
+        for nome, (tipo, ajuda) in self._descricoes.items():
+            linhas.append(f'# HELP {nome} {ajuda}')
+            linhas.append(f'# TYPE {nome} {tipo}')
+            if tipo == 'counter':
+                for chave, valor in contadores[nome].items():
+                    linhas.append(f'{nome}{_rotulos(chave)} {valor}')
+            elif tipo == 'histogram':
+                limites, series = histogramas[nome]
+                for chave, (faixas, soma, total) in series.items():
+                    acumulado = 0
+                    for limite, n in zip(limites, faixas):
+                        acumulado += n
+                        linhas.append(f'{nome}_bucket{_rotulos(chave, ("le", limite))} {acumulado}')
+                    linhas.append(f'{nome}_bucket{_rotulos(chave, ("le", "+Inf"))} {total}')
+                    linhas.append(f'{nome}_sum{_rotulos(chave)} {soma}')
+                    linhas.append(f'{nome}_count{_rotulos(chave)} {total}')
+            else:
+                for rotulos, valor in self._medidores[nome]():
+                    linhas.append(f'{nome}{_rotulos(sorted(rotulos.items()))} {valor}')
+        return '\n'.join(linhas) + '\n'
+
+
+class _Cronometro:
+    def __init__(self, metricas, nome, rotulos):
+        self.metricas = metricas
+        self.nome = nome
+        self.rotulos = rotulos
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excecao):
+        self.duracao = time.perf_counter() - self.inicio
+        self.metricas.observar(self.nome, self.duracao, **self.rotulos)
+        return False
+
+
+METRICAS = Metricas()
@@ -0,0 +1,452 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import snapshot_binario
+
+# --- PERSISTÊNCIA ---
+#
+# Os armazenamentos têm a mesma interface, usada pela Sala:
+#   existe()                -> há estado salvo?
+#   carregar()              -> (estado, registros a reaplicar)
+#   registrar(op, **dados)  -> grava uma mutação; True se é hora de compactar
+#   compactar(estado)       -> grava o estado completo; retorna os bytes gravados
+#   fechar()
+#
+# Journal: snapshot JSON + journal append-only. Cada mutação vira uma linha
+# compacta no journal, então o custo de escrita por jogada é constante. De
+# tempos em tempos o journal é "dobrado" de volta no snapshot e truncado.
+# Com um caminho .bin, o snapshot vai no formato binário (snapshot_binario).
+#
+# No estado passado a compactar(), 'ledger' é o Ledger da sala e 'indices'
+# o historico_idx de cada jogador; só o formato binário grava os índices.
+#
+# ArmazenamentoSQLite: uma tabela por entidade, em modo WAL. Cada mutação é
+# aplicada direto nas linhas afetadas, numa transação do banco.
+#
+# Compartilhado (vários processos, o mesmo .sqlite3): o banco guarda também
+# uma versão do jogo (meta 'versao') e o log das mudanças (tabela mudancas,
+# um registro no formato do journal por versão). Cada processo sabe até que
+# versão a sua cópia em memória chegou e, a cada requisição, aplica só os
+# registros mais novos. As escritas abrem uma transação BEGIN IMMEDIATE (uma
+# por vez entre os processos), trazem a cópia para a versão do banco e
+# avançam a versão com compare-and-swap.
+
+
+def linhas_do_ledger(ledger):
+    """Tuplas (id, valor, remetente_id, recebedor_id, data_hora) de um Ledger ou de uma lista já nesse formato."""
+    return ledger.linhas() if hasattr(ledger, 'linhas') else ledger
+
+
+def ler_snapshot(caminho):
+    """Lê um snapshot, JSON ou binário (pela extensão do arquivo)."""
+    if caminho.endswith('.bin'):
+        return snapshot_binario.ler(caminho)
+    with open(caminho, 'r') as f:
+        return json.load(f)
+
+
+def gravar_snapshot(caminho, estado, compressao=None):
+    """Grava um snapshot (de forma atômica), JSON ou binário pela extensão do arquivo.
+
+    Retorna os bytes gravados.
+    """
+    temporario = caminho + '.tmp'
+    if caminho.endswith('.bin'):
+        gravados = snapshot_binario.gravar(temporario, estado, compressao)
+    else:
+        estado = {chave: valor for chave, valor in estado.items() if chave != 'indices'}
+        estado['ledger'] = linhas_do_ledger(estado.get('ledger', []))
+        with open(temporario, 'w') as f:
+            json.dump(estado, f, indent=4)
+        gravados = os.path.getsize(temporario)
+    os.replace(temporario, caminho)
+    return gravados
+
+
+def converter_snapshot(origem, destino, compressao=None):
+    """Converte o snapshot de uma sala entre JSON e binário. Retorna os bytes gravados.
+
+    O journal_seq vai junto: o journal da sala continua valendo para o novo arquivo.
+    """
+    return gravar_snapshot(destino, ler_snapshot(origem), compressao)
+
+
+class Journal:
+    def __init__(self, caminho_snapshot, caminho_journal, compactar_a_cada=500, compressao=None):
+        self.caminho_snapshot = caminho_snapshot
+        self.caminho_journal = caminho_journal
+        self.compactar_a_cada = compactar_a_cada
+        # Só no snapshot binário: None, 'zlib' ou 'zstd'.
+        self.compressao = compressao
+        self.seq = 0
+        self.registros_pendentes = 0
+        self._arquivo = None
+        # Serializa seq + escrita: registros de threads diferentes nunca se intercalam.
+        self._lock = threading.Lock()
+
+    @property
+    def caminho(self):
+        return self.caminho_snapshot
+
+    def existe(self):
+        return os.path.exists(self.caminho_snapshot) or os.path.exists(self.caminho_journal)
+
+    def carregar(self):
+        """Lê o snapshot e os registros do journal ainda não compactados.
+
+        Retorna (estado, registros). Registros com seq já incluído no snapshot
+        são ignorados; uma última linha truncada (queda no meio da escrita) é
+        descartada e cortada do arquivo.
+        """
+        self.fechar()
+        estado = {}
+        if os.path.exists(self.caminho_snapshot):
+            estado = ler_snapshot(self.caminho_snapshot)
+        seq_snapshot = estado.get('journal_seq', 0)
+        self.seq = seq_snapshot
+
+        registros = []
+        if os.path.exists(self.caminho_journal):
+            validos = 0
+            with open(self.caminho_journal, 'rb') as f:
+                for linha in f:
+                    try:
+                        registro = json.loads(linha)
+                    except ValueError:
+                        break
+                    validos += len(linha)
+                    if registro['s'] > seq_snapshot:
+                        registros.append(registro)
+                        self.seq = registro['s']
+            if validos != os.path.getsize(self.caminho_journal):
+                with open(self.caminho_journal, 'r+b') as f:
+                    f.truncate(validos)
+        self.registros_pendentes = len(registros)
+        return estado, registros
+
+    def registrar(self, op, **dados):
+        """Acrescenta um registro ao journal. Retorna True se já é hora de compactar."""
+        with self._lock:
+            if self._arquivo is None:
+                self._arquivo = open(self.caminho_journal, 'a')
+            self.seq += 1
+            dados['s'] = self.seq
+            dados['op'] = op
+            self._arquivo.write(json.dumps(dados, separators=(',', ':')) + '\n')
+            self._arquivo.flush()
+            self.registros_pendentes += 1
+            return self.registros_pendentes >= self.compactar_a_cada
+
+    def compactar(self, estado):
+        """Grava o snapshot completo (de forma atômica) e zera o journal.
+
+        Quem chama garante que nenhuma mutação do estado está em andamento.
+        """
+        with self._lock:
+            estado = dict(estado, journal_seq=self.seq)
+            gravados = gravar_snapshot(self.caminho_snapshot, estado, self.compressao)
+            self._fechar()
+            open(self.caminho_journal, 'w').close()
+            self.registros_pendentes = 0
+            return gravados
+
+    def fechar(self):
+        with self._lock:
+            self._fechar()
+
+    def _fechar(self):
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+
+ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS jogadores (
+    id TEXT PRIMARY KEY,
+    saldo INTEGER NOT NULL,
+    poupanca INTEGER NOT NULL DEFAULT 0,
+    dados TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transacoes (
+    id INTEGER PRIMARY KEY,
+    valor INTEGER NOT NULL,
+    remetente_id TEXT NOT NULL,
+    recebedor_id TEXT NOT NULL,
+    data_hora TEXT
+);
+CREATE INDEX IF NOT EXISTS transacoes_remetente ON transacoes (remetente_id, id);
+CREATE INDEX IF NOT EXISTS transacoes_recebedor ON transacoes (recebedor_id, id);
+CREATE TABLE IF NOT EXISTS cobrancas (id TEXT PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS leiloes (id TEXT PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS historico_leiloes (seq INTEGER PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS historico_manchetes (seq INTEGER PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS propriedades (nome TEXT PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS solicitacoes (jogador_id TEXT PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS mudancas (versao INTEGER PRIMARY KEY, registro TEXT NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('versao', '0');
+"""
+
+COLUNAS_TRANSACAO = ('id', 'valor', 'remetente_id', 'recebedor_id', 'data_hora')
+# Modo compartilhado: mudanças mantidas no log (um processo mais atrasado que isso recarrega a sala inteira).
+MUDANCAS_RETIDAS = 10000
+
+
+class ConflitoDeVersao(RuntimeError):
+    """A versão do banco andou sem que esta cópia da sala soubesse (escrita fora da transação de escrita)."""
+
+
+class ArmazenamentoSQLite:
+    """Estado da sala num arquivo SQLite (WAL): uma transação do jogo é um INSERT
+    no ledger mais os dois UPDATEs de saldo, numa única transação do banco."""
+
+    # Nunca pede compactação: cada registro já é gravado no lugar.
+    registros_pendentes = 0
+
+    def __init__(self, caminho, compartilhado=False):
+        self.caminho = caminho
+        self.compartilhado = compartilhado
+        # Versão do banco que o estado em memória reflete (None: desconhecida, recarregar).
+        self.versao = 0
+        self._conexao = None
+        # Reentrante: registrar() roda dentro da transação aberta por iniciar_escrita().
+        self._lock = threading.RLock()
+        self._escrevendo = False
+
+    def existe(self):
+        return os.path.exists(self.caminho)
+
+    def _conectar(self):
+        if self._conexao is None:
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False)
+            self._conexao.execute('PRAGMA journal_mode=WAL')
+            self._conexao.execute('PRAGMA synchronous=NORMAL')
+            self._conexao.executescript(ESQUEMA_SQLITE)
+        return self._conexao
+
+    @contextmanager
+    def _transacao(self):
+        """Conexão para uma escrita: dentro da transação de escrita aberta, ou numa transação própria."""
+        with self._lock:
+            db = self._conectar()
+            if self._escrevendo:
+                yield db
+            else:
+                with db:
+                    yield db
+
+    @contextmanager
+    def _leitura(self):
+        """Várias consultas sobre o mesmo retrato do banco (outro processo pode estar gravando)."""
+        with self._lock:
+            db = self._conectar()
+            if db.in_transaction:
+                yield db
+                return
+            db.execute('BEGIN')
+            try:
+                yield db
+            finally:
+                db.commit()
+
+    def iniciar_escrita(self):
+        """Abre a transação de escrita (BEGIN IMMEDIATE: uma por vez entre os processos).
+
+        Segura a trava do armazenamento até concluir_escrita(), na mesma thread.
+        """
+        self._lock.acquire()
+        try:
+            self._conectar().execute('BEGIN IMMEDIATE')
+        except Exception:
+            self._lock.release()
+            raise
+        self._escrevendo = True
+
+    def concluir_escrita(self):
+        try:
+            self._escrevendo = False
+            self._conexao.commit()
+        finally:
+            self._lock.release()
+
+    def versao_atual(self):
+        """Versão do jogo gravada no banco (0 se a sala ainda não tem banco)."""
+        if not self.existe():
+            return 0
+        with self._lock:
+            (valor,) = self._conectar().execute("SELECT valor FROM meta WHERE chave = 'versao'").fetchone()
+        return json.loads(valor)
+
+    def mudancas(self):
+        """Registros gravados depois da versão do estado em memória, em ordem.
+
+        Retorna None quando o log já não tem todos (estado reescrito por
+        compactar(), processo atrasado demais): é preciso recarregar a sala.
+        """
+        with self._leitura() as db:
+            (atual,) = db.execute("SELECT valor FROM meta WHERE chave = 'versao'").fetchone()
+            atual = json.loads(atual)
+            linhas = db.execute('SELECT versao, registro FROM mudancas WHERE versao > ? ORDER BY versao', (self.versao or 0,)).fetchall()
+        if self.versao is None or (atual > self.versao and (not linhas or linhas[0][0] != self.versao + 1)):
+            return None
+        self.versao = atual
+        return [json.loads(registro) for _, registro in linhas]
+
+    def _anotar_mudanca(self, db, registro):
+        # Compare-and-swap: a versão só avança a partir da que o estado em memória conhece.
+        nova = (self.versao or 0) + 1
+        if self.versao is None or db.execute("UPDATE meta SET valor = ? WHERE chave = 'versao' AND valor = ?",
+                                             (json.dumps(nova), json.dumps(self.versao))).rowcount != 1:
+            self.versao = None
+            raise ConflitoDeVersao(f'{self.caminho}: versão do banco mudou durante a escrita')
+        db.execute('INSERT INTO mudancas VALUES (?, ?)', (nova, json.dumps(registro)))
+        if nova % 1000 == 0:
+            db.execute('DELETE FROM mudancas WHERE versao <= ?', (nova - MUDANCAS_RETIDAS,))
+        self.versao = nova
+
+    def carregar(self):
+        """Monta o estado no mesmo formato do snapshot JSON. Não há registros a reaplicar."""
+        with self._leitura() as db:
+            meta = {chave: json.loads(valor) for chave, valor in db.execute('SELECT chave, valor FROM meta')}
+            self.versao = meta['versao']
+            ledger = db.execute('SELECT id, valor, remetente_id, recebedor_id, data_hora FROM transacoes ORDER BY id').fetchall()
+            partida = {}
+            if 'banco' in meta:
+                partida = {'Banco': meta['banco'], 'timestamp': ledger[-1][0] if ledger else 0}
+                for pid, saldo, poupanca, dados in db.execute('SELECT id, saldo, poupanca, dados FROM jogadores ORDER BY rowid'):
+                    partida[pid] = dict(json.loads(dados), saldo=saldo, poupanca=poupanca)
+            estado = {
+                'partida': partida,
+                'ledger': ledger,
+                'leiloes': {id: dict(l, id=id) for id, l in ((id, json.loads(d)) for id, d in db.execute('SELECT id, dados FROM leiloes ORDER BY rowid'))
+                            if l.get('ativo')},
+                'historico_leiloes': [json.loads(d) for (d,) in db.execute('SELECT dados FROM historico_leiloes ORDER BY seq')],
+                'cobrancas_parceladas': {id: json.loads(d) for id, d in db.execute('SELECT id, dados FROM cobrancas ORDER BY rowid')},
+                'solicitacoes_salario': {id: json.loads(d) for id, d in db.execute('SELECT jogador_id, dados FROM solicitacoes ORDER BY rowid')},
+                'manchetes_vigentes': meta.get('manchetes_vigentes', []),
+                'baralho': meta.get('baralho'),
+                'historico_manchetes': [json.loads(d) for (d,) in db.execute('SELECT dados FROM historico_manchetes ORDER BY seq')],
+                'propriedades': {nome: json.loads(d) for nome, d in db.execute('SELECT nome, dados FROM propriedades ORDER BY rowid')},
+                'agregados': meta.get('agregados')
+            }
+            return estado, []
+
+    def registrar(self, op, **dados):
+        with self._transacao() as db:
+            if self.compartilhado:
+                # Os agregados vão à parte: quem aplica o registro refaz a conta.
+                self._anotar_mudanca(db, dict({k: v for k, v in dados.items() if k != 'agregados'}, op=op))
+            if op == 'tx':
+                db.execute('INSERT INTO transacoes VALUES (?, ?, ?, ?, ?)', (dados['id'], dados['v'], dados['r'], dados['d'], dados['h']))
+                db.execute('UPDATE jogadores SET saldo = saldo - ? WHERE id = ?', (dados['v'], dados['r']))
+                db.execute('UPDATE jogadores SET saldo = saldo + ? WHERE id = ?', (dados['v'], dados['d']))
+            elif op == 'lote':
+                db.executemany('INSERT INTO transacoes VALUES (?, ?, ?, ?, ?)',
+                               [(id, valor, r, d, dados['h']) for id, r, d, valor in dados['t']])
+                variacao = {}
+                for _, r, d, valor in dados['t']:
+                    variacao[r] = variacao.get(r, 0) - valor
+                    variacao[d] = variacao.get(d, 0) + valor
+                db.executemany('UPDATE jogadores SET saldo = saldo + ? WHERE id = ?', [(v, pid) for pid, v in variacao.items()])
+                if 'manchetes' in dados:
+                    db.execute("INSERT OR REPLACE INTO meta VALUES ('manchetes_vigentes', ?)", (json.dumps(dados['manchetes']),))
+            elif op == 'jogador':
+                campos = dict(dados['campos'])
+                for coluna in ('saldo', 'poupanca'):
+                    if coluna in campos:
+                        db.execute(f'UPDATE jogadores SET {coluna} = ? WHERE id = ?', (campos.pop(coluna), dados['id']))
+                if campos:
+                    (atual,) = db.execute('SELECT dados FROM jogadores WHERE id = ?', (dados['id'],)).fetchone()
+                    db.execute('UPDATE jogadores SET dados = ? WHERE id = ?', (json.dumps(dict(json.loads(atual), **campos)), dados['id']))
+            elif op == 'banco':
+                (atual,) = db.execute("SELECT valor FROM meta WHERE chave = 'banco'").fetchone()
+                db.execute("UPDATE meta SET valor = ? WHERE chave = 'banco'", (json.dumps(dict(json.loads(atual), **dados['campos'])),))
+            elif op in ('cobranca', 'salario', 'propriedade'):
+                tabela, coluna = {'cobranca': ('cobrancas', 'id'), 'salario': ('solicitacoes', 'jogador_id'),
+                                  'propriedade': ('propriedades', 'nome')}[op]
+                if dados['v'] is None:
+                    db.execute(f'DELETE FROM {tabela} WHERE {coluna} = ?', (dados['id'],))
+                else:
+                    db.execute(f'INSERT OR REPLACE INTO {tabela} VALUES (?, ?)', (dados['id'], json.dumps(dados['v'])))
+            elif op == 'leilao':
+                if dados['v']:
+                    db.execute('INSERT OR REPLACE INTO leiloes VALUES (?, ?)', (dados['id'], json.dumps(dados['v'])))
+                else:
+                    db.execute('DELETE FROM leiloes WHERE id = ?', (dados['id'],))
+                if 'fim' in dados:
+                    db.execute('INSERT INTO historico_leiloes (dados) VALUES (?)', (json.dumps(dados['fim']),))
+            elif op == 'manchetes':
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('manchetes_vigentes', ?)", (json.dumps(dados['v']),))
+                if 'nova' in dados:
+                    db.execute('INSERT INTO historico_manchetes (dados) VALUES (?)', (json.dumps(dados['nova']),))
+                if 'baralho' in dados:
+                    db.execute("INSERT OR REPLACE INTO meta VALUES ('baralho', ?)", (json.dumps(dados['baralho']),))
+            if 'agregados' in dados:
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('agregados', ?)", (json.dumps(dados['agregados']),))
+        return False
+
+    def compactar(self, estado):
+        """Regrava o estado completo (início/reset de partida, importação de um snapshot JSON).
+
+        A versão avança e o log de mudanças é esvaziado: os outros processos recarregam a sala.
+        """
+        with self._transacao() as db:
+            (versao,) = db.execute("SELECT valor FROM meta WHERE chave = 'versao'").fetchone()
+            self.versao = json.loads(versao) + 1
+            for tabela in ('jogadores', 'transacoes', 'cobrancas', 'leiloes', 'historico_leiloes', 'historico_manchetes', 'propriedades', 'solicitacoes', 'meta', 'mudancas'):
+                db.execute(f'DELETE FROM {tabela}')
+            db.execute("INSERT INTO meta VALUES ('versao', ?)", (json.dumps(self.versao),))
+            partida = estado['partida']
+            if 'Banco' in partida:
+                db.execute("INSERT INTO meta VALUES ('banco', ?)", (json.dumps(partida['Banco']),))
+            db.executemany('INSERT INTO jogadores VALUES (?, ?, ?, ?)', [
+                (pid, d['saldo'], d.get('poupanca', 0), json.dumps({k: v for k, v in d.items() if k not in ('saldo', 'poupanca')}))
+                for pid, d in partida.items() if pid not in ('Banco', 'timestamp')
+            ])
+            db.executemany('INSERT INTO transacoes VALUES (?, ?, ?, ?, ?)', linhas_do_ledger(estado['ledger']))
+            db.executemany('INSERT INTO cobrancas VALUES (?, ?)', [(id, json.dumps(c)) for id, c in estado['cobrancas_parceladas'].items()])
+            db.executemany('INSERT INTO solicitacoes VALUES (?, ?)', [(id, json.dumps(p)) for id, p in estado['solicitacoes_salario'].items()])
+            db.executemany('INSERT INTO propriedades VALUES (?, ?)', [(nome, json.dumps(p)) for nome, p in estado.get('propriedades', {}).items()])
+            db.executemany('INSERT INTO leiloes VALUES (?, ?)', [(id, json.dumps(l)) for id, l in estado['leiloes'].items()])
+            db.executemany('INSERT INTO historico_leiloes (dados) VALUES (?)', [(json.dumps(h),) for h in estado['historico_leiloes']])
+            db.executemany('INSERT INTO historico_manchetes (dados) VALUES (?)', [(json.dumps(m),) for m in estado.get('historico_manchetes', [])])
+            db.execute("INSERT INTO meta VALUES ('manchetes_vigentes', ?)", (json.dumps(estado['manchetes_vigentes']),))
+            if estado.get('baralho') is not None:
+                db.execute("INSERT INTO meta VALUES ('baralho', ?)", (json.dumps(estado['baralho']),))
+            if estado.get('agregados') is not None:
+                db.execute("INSERT INTO meta VALUES ('agregados', ?)", (json.dumps(estado['agregados']),))
+        # O SQLite não conta o que escreveu: vale o tamanho do banco e do WAL depois da regravação.
+        return sum(os.path.getsize(c) for c in (self.caminho, self.caminho + '-wal') if os.path.exists(c))
+
+    def transacoes(self, jogador_id=None, antes=None, limite=20):
+        """Página do extrato (jogador_id) ou da auditoria (None), mais novas primeiro.
+
+        Consulta indexada: a chave primária para a auditoria, os índices
+        (remetente_id, id) e (recebedor_id, id) para o extrato. Retorna
+        (transações, cursor) como a paginação em memória.
+        """
+        antes = antes if antes is not None else 2 ** 62
+        campos = ', '.join(COLUNAS_TRANSACAO)
+        with self._lock:
+            db = self._conectar()
+            if jogador_id is None:
+                linhas = db.execute(f'SELECT {campos} FROM transacoes WHERE id < ? ORDER BY id DESC LIMIT ?',
+                                    (antes, limite + 1)).fetchall()
+            else:
+                linhas = db.execute(
+                    f'SELECT * FROM (SELECT {campos} FROM transacoes WHERE remetente_id = ? AND id < ? ORDER BY id DESC LIMIT ?) '
+                    f'UNION SELECT * FROM (SELECT {campos} FROM transacoes WHERE recebedor_id = ? AND id < ? ORDER BY id DESC LIMIT ?) '
+                    f'ORDER BY id DESC LIMIT ?',
+                    (jogador_id, antes, limite + 1, jogador_id, antes, limite + 1, limite + 1)).fetchall()
+        pagina = [dict(zip(COLUNAS_TRANSACAO, linha), timestamp=linha[0]) for linha in linhas[:limite]]
+        cursor = pagina[-1]['id'] if len(linhas) > limite else None
+        return pagina, cursor
+
+    def fechar(self):
+        with self._lock:
+            if self._conexao is not None:
+                self._conexao.close()
+                self._conexao = None
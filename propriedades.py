@@ -0,0 +1,127 @@
+import unicodedata
+
+# --- PROPRIEDADES: CATÁLOGO E REGISTRO DE POSSES ---
+#
+# O catálogo (conteudo_jogo.json, chave 'propriedades') descreve cada
+# propriedade do tabuleiro: estado, setor e classe (Residencial, Industrial,
+# ..., Multinacional para as ações). Ele é o mesmo para todas as salas.
+#
+# O registro de posses é da sala: quem é dono de quê. Cada posse guarda uma
+# cópia dos atributos do catálogo, para o estado salvo não depender do
+# catálogo do momento. Além do mapa propriedade -> posse, o registro mantém
+# índices por dono (as propriedades de cada um) e contagens por dono e
+# atributo, então "quantas Residenciais o jogador X tem" é uma consulta a
+# um dict, sem varrer nada.
+#
+# Como o resto do estado da sala, o registro é alterado com sala.lock e lido
+# sem trava: os contêineres que as páginas percorrem são trocados inteiros.
+
+ATRIBUTOS = ('estado', 'setor', 'classe')
+
+
+def chave_propriedade(nome):
+    """Forma normalizada do nome para busca ('Av. Paulista' == 'av paulista')."""
+    nome = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in nome).split())
+
+
+class Catalogo:
+    def __init__(self, itens=()):
+        self.itens = [dict(item) for item in itens]
+        self._por_chave = {chave_propriedade(item['nome']): item for item in self.itens}
+        self._totais = {}
+        for item in self.itens:
+            for campo in ATRIBUTOS:
+                if item.get(campo) is not None:
+                    chave = (campo, item[campo])
+                    self._totais[chave] = self._totais.get(chave, 0) + 1
+
+    def buscar(self, nome):
+        """A propriedade do catálogo com esse nome (sem diferenciar caixa/acentos), ou None."""
+        return self._por_chave.get(chave_propriedade(nome or ''))
+
+    def posse(self, nome, dono_id):
+        """Registro de posse de `nome` para `dono_id`, com os atributos do catálogo.
+
+        Nomes fora do catálogo (itens digitados no leilão) viram posses sem atributos.
+        """
+        item = self.buscar(nome)
+        if item is None:
+            return {'nome': nome, 'dono_id': dono_id, **{campo: None for campo in ATRIBUTOS}}
+        return {'nome': item['nome'], 'dono_id': dono_id, **{campo: item.get(campo) for campo in ATRIBUTOS}}
+
+    def quantas(self, campo, valor):
+        """Quantas propriedades do catálogo têm `campo` == `valor` (ex.: estado 'BA')."""
+        return self._totais.get((campo, valor), 0)
+
+    def valores(self, campo):
+        """Valores distintos de um atributo, em ordem de aparição no catálogo."""
+        return list(dict.fromkeys(c for (atributo, c) in self._totais if atributo == campo))
+
+
+class Posses:
+    def __init__(self, registros=None):
+        # nome -> {'nome', 'dono_id', 'estado', 'setor', 'classe'}
+        self.registros = {}
+        # dono -> tupla com os nomes; (dono, campo, valor) -> quantidade
+        self._de = {}
+        self._contagem = {}
+        for registro in (registros or {}).values():
+            self.atribuir(registro['nome'], registro)
+
+    def atribuir(self, nome, registro):
+        """Passa a propriedade para registro['dono_id'] (registro None: volta para o banco).
+
+        Retorna o id do dono anterior, ou None.
+        """
+        anterior = self.registros.get(nome)
+        if anterior is not None:
+            self._indexar(anterior, -1)
+        if registro is None:
+            self.registros = {k: v for k, v in self.registros.items() if k != nome}
+        else:
+            self.registros = {**self.registros, nome: registro}
+            self._indexar(registro, 1)
+        return anterior['dono_id'] if anterior else None
+
+    def _indexar(self, registro, sinal):
+        dono = registro['dono_id']
+        nomes = self._de.get(dono, ())
+        self._de[dono] = nomes + (registro['nome'],) if sinal > 0 else tuple(n for n in nomes if n != registro['nome'])
+        for chave in [(dono, None, None)] + [(dono, campo, registro.get(campo)) for campo in ATRIBUTOS if registro.get(campo) is not None]:
+            self._contagem[chave] = self._contagem.get(chave, 0) + sinal
+
+    def dono(self, nome):
+        registro = self.registros.get(nome)
+        return registro['dono_id'] if registro else None
+
+    def de(self, dono_id):
+        """Nomes das propriedades do jogador, na ordem em que foram adquiridas."""
+        return self._de.get(dono_id, ())
+
+    def registros_de(self, dono_id):
+        """Posses do jogador (lido sem trava: ignora nomes que saíram no meio da leitura)."""
+        registros = self.registros
+        return [registros[nome] for nome in self.de(dono_id) if nome in registros]
+
+    def quantas(self, dono_id, **filtro):
+        """Quantas propriedades o jogador tem, opcionalmente filtradas por atributos.
+
+        Sem filtro ou com um atributo (classe='Residencial'), é uma consulta
+        ao índice; com vários (estado='BA', classe='Industrial'), percorre só
+        as propriedades do jogador.
+        """
+        if len(filtro) <= 1:
+            campo, valor = next(iter(filtro.items()), (None, None))
+            return self._contagem.get((dono_id, campo, valor), 0)
+        return sum(1 for nome in self.de(dono_id)
+                   if all(self.registros[nome].get(campo) == valor for campo, valor in filtro.items()))
+
+    def resumo(self, dono_id):
+        """Contagens do jogador por atributo: {'estado': {'BA': 2}, 'classe': {...}, ...}."""
+        resumo = {campo: {} for campo in ATRIBUTOS}
+        for registro in self.registros_de(dono_id):
+            for campo in ATRIBUTOS:
+                if registro.get(campo) is not None:
+                    resumo[campo][registro[campo]] = resumo[campo].get(registro[campo], 0) + 1
+        return resumo
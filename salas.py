@@ -0,0 +1,748 @@
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from eventos import Barramento
+from ledger import Ledger
+from metricas import METRICAS, registrar_evento
+from persistencia import ArmazenamentoSQLite, Journal
+from propriedades import Posses
+from snapshot_binario import LedgerAdiado
+from visoes import Visoes
+
+# --- SALAS: VÁRIAS PARTIDAS NO MESMO PROCESSO ---
+#
+# Cada sala (mesa) tem o seu próprio estado e o seu próprio shard de
+# persistência (<diretorio>/<sala_id>.json + .journal, ou <sala_id>.sqlite3
+# no modo 'sqlite'; com formato_snapshot='binario', <sala_id>.bin no lugar do
+# .json). Salas ociosas que
+# ninguém está usando (Sala.em_uso) são compactadas e tiradas da memória;
+# voltam sob demanda na próxima requisição.
+#
+# Concorrência: toda mutação do estado da sala, junto com a sua persistência,
+# acontece com sala.lock; o leilão tem a sua própria trava (sala.lock_leilao),
+# para lances não disputarem com pagamentos. Quem precisa das duas pega
+# sempre lock_leilao antes de lock. As leituras (renderização das páginas)
+# não usam trava: os contêineres que os templates percorrem são trocados
+# inteiros (copy-on-write) em vez de alterados no lugar.
+#
+# Agregados: totais da economia (dinheiro em circulação, poupança, fluxo do
+# banco, quanto cada jogador pagou e recebeu) mantidos a cada transação e a
+# cada mudança de saldo/poupança, em vez de varrer jogadores e ledger.
+# Vão para o disco junto com o estado; calcular_agregados() refaz do zero.
+#
+# Versões: cada mutação registrada avança um contador da sala e carimba com
+# ele as partes afetadas (um jogador, 'ledger', 'leiloes', ...). A API JSON
+# usa o maior carimbo das partes de uma resposta como ETag.
+#
+# Modo 'compartilhado' (vários workers, o mesmo .sqlite3): cada processo tem
+# a sua cópia da sala, que serve de cache de leitura. A cada requisição,
+# sincronizar() confere a versão do banco e aplica só as mudanças gravadas
+# por outros processos desde a versão da cópia. lock e lock_leilao viram uma
+# só TravaCompartilhada: a volta mais externa abre a transação de escrita no
+# banco e traz a cópia para a versão atual antes de a função validar
+# qualquer coisa; cada registro avança a versão com compare-and-swap.
+
+FORMATO_ID_SALA = re.compile(r'^[a-z0-9][a-z0-9-]{0,31}$')
+# Id dado ao leilão único dos arquivos antigos ('leilao' em vez de 'leiloes').
+LEILAO_LEGADO = 'legado'
+
+METRICAS.histograma('banco_salvar_segundos', 'Duração do salvamento completo de uma sala.')
+METRICAS.contador('banco_salvar_bytes_total', 'Bytes gravados pelos salvamentos completos.')
+METRICAS.histograma('banco_persistir_segundos', 'Duração da gravação de uma mutação, por operação.')
+METRICAS.contador('banco_sincronizacoes_total', 'Sincronizações com o banco compartilhado, por resultado.')
+# Modos em que o estado fica num banco SQLite (e as consultas do extrato vão a ele).
+MODOS_SQLITE = ('sqlite', 'compartilhado')
+
+
+class ErroPersistencia(Exception):
+    """A mutação ficou na memória, mas não foi gravada (ver Sala.persistir)."""
+
+
+def com_trava(func):
+    """Executa a função (que recebe a sala como primeiro argumento) com sala.lock."""
+    @wraps(func)
+    def envolvida(sala, *args, **kwargs):
+        with sala.lock:
+            return func(sala, *args, **kwargs)
+    return envolvida
+
+
+class TravaCompartilhada:
+    """Trava (reentrante) da sala no modo compartilhado.
+
+    A volta mais externa chama `ao_entrar` (abrir a escrita no banco) e a
+    saída dela, `ao_sair` (gravar). Serve nos `with` e no acquire(blocking=False)
+    da compactação, como um RLock.
+    """
+
+    def __init__(self, trava, ao_entrar, ao_sair):
+        self._trava = trava
+        self._ao_entrar = ao_entrar
+        self._ao_sair = ao_sair
+        self._profundidade = 0
+
+    def acquire(self, blocking=True):
+        if not self._trava.acquire(blocking):
+            return False
+        self._profundidade += 1
+        if self._profundidade == 1:
+            try:
+                self._ao_entrar()
+            except BaseException:
+                self._profundidade -= 1
+                self._trava.release()
+                raise
+        return True
+
+    def release(self):
+        self._profundidade -= 1
+        try:
+            if self._profundidade == 0:
+                self._ao_sair()
+        finally:
+            self._trava.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def slug_sala(nome):
+    """Converte o nome digitado ('Mesa São João') num id de sala válido ('mesa-sao-joao')."""
+    nome = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii').lower()
+    return re.sub(r'[^a-z0-9]+', '-', nome).strip('-')[:32].strip('-')
+
+
+class Sala:
+    def __init__(self, sala_id, diretorio, modo_persistencia='journal', compactar_a_cada=500,
+                 formato_snapshot='json', compressao=None):
+        self.id = sala_id
+        # O snapshot JSON é também de onde se importa uma sala salva antes em outro formato.
+        self.caminho_json = os.path.join(diretorio, f'{sala_id}.json')
+        self.caminho_snapshot = os.path.join(diretorio, f'{sala_id}.bin') if formato_snapshot == 'binario' else self.caminho_json
+        self.caminho_journal = os.path.join(diretorio, f'{sala_id}.journal')
+        self.modo_persistencia = modo_persistencia
+        if modo_persistencia in MODOS_SQLITE:
+            self.armazenamento = ArmazenamentoSQLite(os.path.join(diretorio, f'{sala_id}.sqlite3'),
+                                                     compartilhado=modo_persistencia == 'compartilhado')
+        else:
+            self.armazenamento = Journal(self.caminho_snapshot, self.caminho_journal, compactar_a_cada, compressao)
+        self.ultimo_acesso = time.monotonic()
+        # Quem está com a sala na mão agora (requisições, fluxos de eventos, lances na fila).
+        # Contado por GerenciadorSalas, que não despeja sala em uso.
+        self.em_uso = 0
+        if modo_persistencia == 'compartilhado':
+            # Uma escrita por vez no banco: lances e pagamentos da sala passam pela mesma trava.
+            self._trava = threading.RLock()
+            self.lock = self.lock_leilao = TravaCompartilhada(self._trava, self._abrir_escrita, self._concluir_escrita)
+            self._escrita_aberta = False
+        else:
+            self.lock = threading.RLock()
+            self.lock_leilao = threading.RLock()
+        # Chamado com os registros aplicados por sincronizar() (None se a sala foi recarregada inteira).
+        self.ao_sincronizar = None
+        # Protege só a leitura adiada do ledger de um snapshot binário (ver a propriedade ledger).
+        self._lock_ledger = threading.Lock()
+        self.eventos = Barramento()
+        self.visoes = Visoes(self)
+        self.zerar()
+
+    def zerar(self):
+        # Memória à frente do disco (gravação que falhou): o próximo salvamento completo regrava tudo.
+        self.suja = False
+        # Compactação devida que persistir(adiar_compactacao=True) deixou para quem chamou.
+        self.compactacao_pendente = False
+        # Uma nova geração invalida as ETags emitidas antes (nova partida, recarga do disco).
+        self.geracao = os.urandom(4).hex()
+        self.versao = 0
+        self.versoes = {}
+        self.partida = {}
+        # Ledger central (colunar): cada transação é guardada uma única vez, em ordem de id.
+        # Os jogadores guardam só as posições no ledger ('historico_idx').
+        self.ledger = Ledger()
+        # Leilões em andamento por id, e os já encerrados (para a auditoria do banco).
+        self.leiloes = {}
+        self.historico_leiloes = []
+        self.cobrancas_parceladas = {}
+        self.solicitacoes_salario = {}
+        self.manchetes_vigentes = []
+        # Manchetes já sorteadas, com o id da última transação antes de cada uma (para o relatório).
+        self.historico_manchetes = []
+        # Baralho de manchetes: permutação dos índices das manchetes do conteúdo (na versão
+        # com que foi embaralhado) e a posição da próxima carta.
+        self.baralho = {'versao': None, 'ordem': [], 'posicao': 0}
+        # Quem é dono de cada propriedade, com índices por dono, estado, setor e classe.
+        self.posses = Posses()
+        self.agregados = self.calcular_agregados()
+
+    @property
+    def ledger(self):
+        # Snapshot binário: as colunas do ledger só são lidas do arquivo no primeiro acesso.
+        if self._ledger_adiado is not None:
+            with self._lock_ledger:
+                if self._ledger_adiado is not None:
+                    self._ledger = self._ledger_adiado.carregar()
+                    self._ledger_adiado = None
+        return self._ledger
+
+    @ledger.setter
+    def ledger(self, ledger):
+        if isinstance(ledger, LedgerAdiado):
+            self._ledger, self._ledger_adiado = Ledger(), ledger
+        else:
+            self._ledger, self._ledger_adiado = ledger, None
+
+    def total_transacoes(self):
+        """Tamanho do ledger, sem ler do arquivo um ledger ainda adiado."""
+        return len(self._ledger_adiado or self._ledger)
+
+    def jogadores(self):
+        """Pares (id, dados) dos jogadores, sem as entradas 'Banco' e 'timestamp'."""
+        return [(pid, dados) for pid, dados in self.partida.items() if pid not in ('Banco', 'timestamp')]
+
+    # --- PERSISTÊNCIA ---
+
+    def sincronizar(self):
+        """Modo compartilhado: aplica o que outros processos gravaram desde a versão desta cópia.
+
+        Uma consulta à versão do banco quando não há nada novo. Fora do modo compartilhado não faz nada.
+        """
+        if self.modo_persistencia != 'compartilhado' or self.armazenamento.versao_atual() == self.armazenamento.versao:
+            return
+        with self._trava:
+            self._aplicar_mudancas()
+
+    def _aplicar_mudancas(self):
+        registros = self.armazenamento.mudancas()
+        if registros is None:
+            # O log não cobre a distância (partida reiniciada, processo muito atrasado): recarrega tudo
+            # e manda as páginas abertas se reconectarem.
+            self.carregar()
+            self.eventos.encerrar()
+            METRICAS.incrementar('banco_sincronizacoes_total', resultado='recarga')
+        elif registros:
+            for registro in registros:
+                self.aplicar_registro(registro)
+                self.tocar(*self._partes_alteradas(registro['op'], registro))
+            METRICAS.incrementar('banco_sincronizacoes_total', resultado='mudancas')
+        if registros != [] and self.ao_sincronizar is not None:
+            self.ao_sincronizar(self, registros)
+
+    def _abrir_escrita(self):
+        # Sala sem banco ainda (partida não iniciada): a primeira gravação é um compactar() com transação própria.
+        self._escrita_aberta = self.armazenamento.existe()
+        if self._escrita_aberta:
+            self.armazenamento.iniciar_escrita()
+            try:
+                self._aplicar_mudancas()
+            except BaseException:
+                self._concluir_escrita()
+                raise
+
+    def _concluir_escrita(self):
+        if self._escrita_aberta:
+            self._escrita_aberta = False
+            self.armazenamento.concluir_escrita()
+
+    def carregar(self):
+        """Carrega o estado salvo da sala e reaplica os registros pendentes do journal.
+
+        No modo 'sqlite' ou com o snapshot binário, uma sala que só tem
+        snapshot JSON é importada na primeira carga.
+        """
+        self.zerar()
+        origem = self.armazenamento
+        if origem.caminho != self.caminho_json and not os.path.exists(origem.caminho):
+            origem = Journal(self.caminho_json, self.caminho_journal)
+        if not origem.existe():
+            return
+        try:
+            data, registros = origem.carregar()
+            self.partida = data.get('partida', {})
+            self.ledger = self._carregar_ledger(data)
+            self.leiloes = data.get('leiloes') or self._leilao_legado(data.get('leilao'))
+            self.historico_leiloes = data.get('historico_leiloes', [])
+            self.cobrancas_parceladas = data.get('cobrancas_parceladas', {})
+            self.solicitacoes_salario = data.get('solicitacoes_salario', {})
+            self.manchetes_vigentes = data.get('manchetes_vigentes', [])
+            self.historico_manchetes = data.get('historico_manchetes', [])
+            self.baralho = data.get('baralho') or self.baralho
+            self.posses = Posses(data.get('propriedades'))
+            # Arquivos de antes dos agregados: calcula uma vez a partir do estado salvo.
+            self.agregados = data.get('agregados') or self.calcular_agregados()
+            for registro in registros:
+                self.aplicar_registro(registro)
+            if origem is not self.armazenamento:
+                origem.fechar()
+                try:
+                    self._salvar()
+                except Exception:
+                    # Continua no arquivo antigo; a próxima mutação tenta de novo.
+                    self.suja = True
+                registrar_evento(logging.INFO, 'sala_importada', sala=self.id, de=origem.caminho, para=self.armazenamento.caminho)
+            else:
+                registrar_evento(logging.INFO, 'sala_carregada', sala=self.id, registros_journal=len(registros))
+        except Exception as e:
+            registrar_evento(logging.ERROR, 'erro_carregar', sala=self.id, erro=e)
+            self.zerar()
+        # Só depois da carga inteira: uma visão montada no meio dela não vale mais (ver visoes.py).
+        self.tocar('jogadores')
+
+    @staticmethod
+    def _leilao_legado(leilao):
+        # O leilão único antigo prorrogava 30s a cada lance.
+        return {LEILAO_LEGADO: dict({'extensao': 30, 'total_lances': 0}, **leilao, id=LEILAO_LEGADO)} if leilao and leilao.get('ativo') else {}
+
+    def _carregar_ledger(self, data):
+        """Monta o ledger e o índice de cada jogador a partir do arquivo salvo.
+
+        Aceita o formato antigo, em que a mesma transação aparecia em
+        PARTIDA['Banco']['historico'] e no 'historico' de cada jogador envolvido.
+        Do snapshot binário vêm os índices prontos e o ledger adiado.
+        """
+        if isinstance(data.get('ledger'), LedgerAdiado):
+            for pid, dados in self.jogadores():
+                dados['historico_idx'] = data['indices'].get(pid, array('l'))
+            return data['ledger']
+        if 'ledger' in data:
+            linhas = data['ledger']
+        else:
+            vistos = {}
+            for pid, dados in self.partida.items():
+                if pid != 'timestamp':
+                    for t in dados.pop('historico', []):
+                        vistos[t['id']] = t
+            linhas = [(id, t['valor'], t['remetente_id'], t['recebedor_id'], t.get('data_hora')) for id, t in sorted(vistos.items())]
+
+        ledger = Ledger()
+        for pid, dados in self.jogadores():
+            dados['historico_idx'] = array('l')
+        for id, valor, remetente_id, recebedor_id, data_hora in linhas:
+            posicao = ledger.anotar(id, valor, remetente_id, recebedor_id, data_hora)
+            for pid in {remetente_id, recebedor_id}:
+                if pid != 'Banco':
+                    self.partida[pid]['historico_idx'].append(posicao)
+        return ledger
+
+    def salvar(self):
+        """Salva o estado completo da sala (compacta o journal / regrava o banco).
+
+        Se a gravação falhar, o erro sobe e a sala continua suja.
+        """
+        with self.lock_leilao, self.lock:
+            self._salvar()
+
+    def _salvar(self):
+        try:
+            inicio = time.perf_counter()
+            os.makedirs(os.path.dirname(self.caminho_snapshot) or '.', exist_ok=True)
+            # O índice dos jogadores vai à parte: o snapshot binário grava, o JSON reconstrói do ledger.
+            partida = {pid: ({k: v for k, v in dados.items() if k != 'historico_idx'} if isinstance(dados, dict) else dados)
+                       for pid, dados in self.partida.items()}
+            gravados = self.armazenamento.compactar({
+                'partida': partida,
+                'ledger': self.ledger,
+                'indices': {pid: dados['historico_idx'] for pid, dados in self.jogadores()},
+                'leiloes': self.leiloes,
+                'historico_leiloes': self.historico_leiloes,
+                'cobrancas_parceladas': self.cobrancas_parceladas,
+                'solicitacoes_salario': self.solicitacoes_salario,
+                'manchetes_vigentes': self.manchetes_vigentes,
+                'historico_manchetes': self.historico_manchetes,
+                'baralho': self.baralho,
+                'propriedades': self.posses.registros,
+                'agregados': self.agregados
+            })
+            duracao = time.perf_counter() - inicio
+            METRICAS.observar('banco_salvar_segundos', duracao)
+            METRICAS.incrementar('banco_salvar_bytes_total', gravados)
+            registrar_evento(logging.INFO, 'sala_salva', sala=self.id, duracao_ms=duracao * 1000, bytes=gravados,
+                             transacoes=len(self.ledger))
+        except Exception as e:
+            registrar_evento(logging.ERROR, 'erro_salvar', sala=self.id, erro=e)
+            raise
+        self.suja = self.compactacao_pendente = False
+
+    def persistir(self, op, adiar_compactacao=False, **dados):
+        """Registra uma mutação do estado.
+
+        No modo journal grava só uma linha com a mudança; a cada
+        journal.compactar_a_cada registros o snapshot completo é regravado.
+        No modo sqlite atualiza só as linhas afetadas.
+        Chamado por quem já segura lock ou lock_leilao.
+
+        Se a gravação falhar, a mutação (já feita na memória) fica sem
+        registro: a sala é marcada como suja, para o próximo salvamento
+        completo regravar tudo, e ErroPersistencia sobe para a rota avisar o
+        erro em vez do sucesso. No modo compartilhado o banco é quem vale: a
+        cópia é recarregada dele na próxima sincronização.
+
+        Com `adiar_compactacao`, a compactação devida (no modo snapshot, a
+        própria gravação) não acontece aqui: a sala fica com
+        compactacao_pendente e quem chamou faz salvar() depois, fora das
+        travas. É o caso da fila de lances, que atende todas as salas.
+        """
+        with METRICAS.cronometrar('banco_persistir_segundos', op=op):
+            try:
+                if self.modo_persistencia == 'snapshot':
+                    # O snapshot é a única gravação: com as travas ocupadas, fica para a próxima mutação.
+                    self.suja = True
+                    if adiar_compactacao:
+                        self.compactacao_pendente = True
+                    else:
+                        self._compactar_se_possivel()
+                    return
+                os.makedirs(os.path.dirname(self.caminho_journal) or '.', exist_ok=True)
+                if self.modo_persistencia in MODOS_SQLITE and op in ('tx', 'lote', 'jogador'):
+                    # No journal os agregados são refeitos no replay; no banco vão na mesma transação.
+                    dados = dict(dados, agregados=self.agregados)
+                compactar = self.armazenamento.registrar(op, **dados)
+            except Exception as e:
+                registrar_evento(logging.ERROR, 'erro_persistir', sala=self.id, op=op, erro=e)
+                if self.modo_persistencia == 'compartilhado':
+                    self.armazenamento.versao = None
+                else:
+                    self.suja = True
+                raise ErroPersistencia(f"Sala {self.id}: a operação '{op}' não foi gravada ({e}).") from e
+            finally:
+                # Só depois de gravar: quem ler a versão nova encontra o dado novo no banco.
+                self.tocar(*self._partes_alteradas(op, dados))
+            if (compactar or self.suja) and adiar_compactacao:
+                self.compactacao_pendente = True
+            elif compactar or self.suja:
+                try:
+                    self._compactar_se_possivel()
+                except Exception:
+                    # O registro já está gravado; a falha da compactação ficou em erro_salvar.
+                    pass
+
+    @staticmethod
+    def _partes_alteradas(op, dados):
+        if op == 'tx':
+            return dados['r'], dados['d'], 'ledger'
+        if op == 'lote':
+            return {pid for t in dados['t'] for pid in t[1:3]} | {'ledger'} | ({'manchetes'} if 'manchetes' in dados else set())
+        if op == 'jogador':
+            return dados['id'],
+        if op == 'leilao':
+            # Cada leilão tem a sua versão: o lance num pregão não refaz a caixa dos outros.
+            return 'leiloes', f"leilao:{dados['id']}"
+        return {'banco': 'Banco', 'cobranca': 'cobrancas', 'leilao': 'leiloes', 'salario': 'salarios', 'propriedade': 'propriedades'}.get(op, op),
+
+    def tocar(self, *partes):
+        """Avança a versão da sala e carimba as partes do estado que mudaram."""
+        self.versao += 1
+        for parte in partes:
+            self.versoes[parte] = self.versao
+
+    def etag(self, *partes):
+        """ETag de uma resposta montada a partir das partes informadas."""
+        return f"{self.geracao}-{max((self.versoes.get(p, 0) for p in partes), default=0)}"
+
+    def _compactar_se_possivel(self):
+        # A compactação precisa das duas travas. Quem está só com lock não pode
+        # esperar por lock_leilao (ordem invertida), então tenta sem bloquear;
+        # se um lance estiver em andamento, a próxima mutação tenta de novo.
+        if self.lock_leilao.acquire(blocking=False):
+            try:
+                with self.lock:
+                    self._salvar()
+            finally:
+                self.lock_leilao.release()
+
+    def aplicar_registro(self, registro):
+        """Reaplica um registro do journal sobre o estado carregado do snapshot."""
+        op = registro['op']
+        if op == 'tx':
+            self.aplicar_transacao(registro['id'], registro['r'], registro['d'], registro['v'], registro['h'])
+        elif op == 'lote':
+            for id, remetente_id, recebedor_id, valor in registro['t']:
+                self.aplicar_transacao(id, remetente_id, recebedor_id, valor, registro['h'])
+            if 'manchetes' in registro:
+                # Lote do efeito de uma manchete: a marca de aplicada vem na mesma gravação.
+                self.manchetes_vigentes = registro['manchetes']
+        elif op == 'jogador':
+            self.atualizar_jogador(registro['id'], registro['campos'])
+        elif op == 'banco':
+            self.partida['Banco'].update(registro['campos'])
+        elif op == 'cobranca':
+            self.cobrancas_parceladas = self._com_valor(self.cobrancas_parceladas, registro['id'], registro['v'])
+        elif op == 'leilao':
+            if 'id' not in registro:
+                # Registro antigo: o leilão único (v == {} ao encerrar).
+                self.leiloes = {**self.leiloes, **self._leilao_legado(registro['v'])}
+                if not registro['v']:
+                    self.leiloes.pop(LEILAO_LEGADO, None)
+            else:
+                self.leiloes = self._com_valor(self.leiloes, registro['id'], registro['v'] or None)
+            if 'fim' in registro:
+                self.historico_leiloes = self.historico_leiloes + [registro['fim']]
+        elif op == 'salario':
+            self.solicitacoes_salario = self._com_valor(self.solicitacoes_salario, registro['id'], registro['v'])
+        elif op == 'manchetes':
+            self.manchetes_vigentes = registro['v']
+            if 'nova' in registro:
+                self.historico_manchetes = self.historico_manchetes + [registro['nova']]
+            if 'baralho' in registro:
+                self.baralho = registro['baralho']
+        elif op == 'propriedade':
+            self.posses.atribuir(registro['id'], registro['v'])
+
+    @staticmethod
+    def _com_valor(dicionario, chave, valor):
+        # Cópia nova (copy-on-write): no modo compartilhado o replay roda com páginas sendo renderizadas.
+        return {**dicionario, chave: valor} if valor is not None else {k: v for k, v in dicionario.items() if k != chave}
+
+    def aplicar_transacao(self, id, remetente_id, recebedor_id, valor, data_hora):
+        """Move os saldos e anota a transação no ledger (usado também no replay do journal)."""
+        # Primeiro o ledger: se a transação não couber nele, nada do estado mudou.
+        posicao = self.ledger.anotar(id, valor, remetente_id, recebedor_id, data_hora)
+        self.partida['timestamp'] = max(self.partida.get('timestamp', 0), id)
+
+        # Indexa no extrato do remetente
+        if remetente_id != 'Banco':
+            self.partida[remetente_id]['saldo'] -= valor
+            self.partida[remetente_id]['historico_idx'].append(posicao)
+
+        # Indexa no extrato do recebedor
+        if recebedor_id != 'Banco':
+            self.partida[recebedor_id]['saldo'] += valor
+            if recebedor_id != remetente_id:
+                self.partida[recebedor_id]['historico_idx'].append(posicao)
+
+        self._contabilizar(self.agregados, remetente_id, recebedor_id, valor)
+        if remetente_id != 'Banco':
+            self.agregados['circulacao'] -= valor
+        if recebedor_id != 'Banco':
+            self.agregados['circulacao'] += valor
+
+    def atualizar_jogador(self, player_id, campos):
+        """Altera campos do jogador; mudanças de saldo/poupança entram nos agregados."""
+        jogador = self.partida.setdefault(player_id, {'historico_idx': array('l')})
+        for campo, total in (('saldo', 'circulacao'), ('poupanca', 'poupanca')):
+            if campo in campos:
+                self.agregados[total] += campos[campo] - jogador.get(campo, 0)
+        jogador.update(campos)
+        self.agregados['jogadores'].setdefault(player_id, {'pago': 0, 'recebido': 0})
+
+    # --- AGREGADOS DA ECONOMIA ---
+
+    @staticmethod
+    def _contabilizar(agregados, remetente_id, recebedor_id, valor):
+        """Soma uma transação aos fluxos (banco e jogadores)."""
+        for pid, chave, chave_banco in ((remetente_id, 'pago', 'banco_pago'), (recebedor_id, 'recebido', 'banco_recebido')):
+            if pid == 'Banco':
+                agregados[chave_banco] += valor
+            else:
+                fluxo = agregados['jogadores'].setdefault(pid, {'pago': 0, 'recebido': 0})
+                fluxo[chave] += valor
+
+    def calcular_agregados(self):
+        """Recalcula os agregados do zero, varrendo jogadores e ledger."""
+        agregados = {'circulacao': 0, 'poupanca': 0, 'banco_recebido': 0, 'banco_pago': 0, 'jogadores': {}}
+        for pid, dados in self.jogadores():
+            agregados['circulacao'] += dados.get('saldo', 0)
+            agregados['poupanca'] += dados.get('poupanca', 0)
+            agregados['jogadores'][pid] = {'pago': 0, 'recebido': 0}
+        # Soma por índice de participante nas colunas do ledger; depois traduz para os ids.
+        participantes = self.ledger.participantes
+        pago, recebido = [0] * len(participantes), [0] * len(participantes)
+        for remetente, recebedor, valor in zip(self.ledger.remetentes, self.ledger.recebedores, self.ledger.valores):
+            pago[remetente] += valor
+            recebido[recebedor] += valor
+        for indice, pid in enumerate(participantes):
+            if pid == 'Banco':
+                agregados['banco_pago'] += pago[indice]
+                agregados['banco_recebido'] += recebido[indice]
+            elif pid in agregados['jogadores'] or pago[indice] or recebido[indice]:
+                agregados['jogadores'][pid] = {'pago': pago[indice], 'recebido': recebido[indice]}
+        return agregados
+
+    def auditar_agregados(self):
+        """Compara os agregados mantidos com um recálculo completo.
+
+        Retorna a lista de divergências (chave, mantido, recalculado); vazia se estiver tudo certo.
+        """
+        with self.lock:
+            mantidos = self.agregados
+            recalculados = self.calcular_agregados()
+        divergencias = [(chave, mantidos.get(chave), valor) for chave, valor in recalculados.items()
+                        if chave != 'jogadores' and mantidos.get(chave) != valor]
+        for pid in sorted(set(mantidos.get('jogadores', {})) | set(recalculados['jogadores'])):
+            mantido = mantidos.get('jogadores', {}).get(pid)
+            if mantido != recalculados['jogadores'].get(pid):
+                divergencias.append((f'jogadores.{pid}', mantido, recalculados['jogadores'].get(pid)))
+        return divergencias
+
+
+class GerenciadorSalas:
+    def __init__(self, diretorio, modo_persistencia='journal', ociosidade_max=1800, max_carregadas=200, ao_carregar=None,
+                 formato_snapshot='json', compressao=None):
+        self.diretorio = diretorio
+        self.modo_persistencia = modo_persistencia
+        self.formato_snapshot = formato_snapshot
+        self.compressao = compressao
+        self.ociosidade_max = ociosidade_max
+        self.max_carregadas = max_carregadas
+        # Chamado com cada sala trazida do disco (ex.: reagendar os leilões abertos).
+        self.ao_carregar = ao_carregar
+        # Modo compartilhado: chamado com o que cada sala aplicou de outros processos (ver Sala.sincronizar).
+        self.ao_sincronizar = None
+        self.carregadas = OrderedDict()
+        # Salas já tiradas de `carregadas` cujo salvamento ainda não acabou. Quem pede uma delas nesse
+        # meio-tempo recebe a mesma sala de volta, em vez de ler do disco um salvamento pela metade.
+        self._despejando = {}
+        # Salas sendo lidas do disco (fora da trava): quem pede a mesma sala espera o Event dela.
+        self._carregando = {}
+        self._lock = threading.Lock()
+
+    def obter(self, sala_id, reter=False):
+        """Devolve a sala, carregando do disco se ela não estiver em memória.
+
+        Retorna None para ids inválidos. Salas novas começam vazias e só
+        ganham arquivo no disco quando a partida é iniciada. Com `reter`, a
+        sala fica em uso (não é despejada) até soltar().
+        """
+        if not FORMATO_ID_SALA.match(sala_id):
+            return None
+        while True:
+            with self._lock:
+                despejadas = self._despejar_ociosas()
+                sala = self.carregadas.get(sala_id) or self._despejando.pop(sala_id, None)
+                espera = None
+                if sala is not None:
+                    self._acessar(sala, reter)
+                else:
+                    espera = self._carregando.get(sala_id)
+                    if espera is None:
+                        self._carregando[sala_id] = threading.Event()
+            self._concluir_despejo(despejadas)
+            if espera is None:
+                break
+            # Outra requisição está lendo esta sala do disco: espera só por ela e procura de novo.
+            espera.wait()
+        if sala is None:
+            sala = self._carregar(sala_id, reter)
+        # Fora da trava do gerenciador: a consulta ao banco não segura as outras salas.
+        sala.sincronizar()
+        return sala
+
+    def _acessar(self, sala, reter):
+        # Com a trava do gerenciador.
+        self.carregadas[sala.id] = sala
+        self.carregadas.move_to_end(sala.id)
+        sala.ultimo_acesso = time.monotonic()
+        if reter:
+            sala.em_uso += 1
+
+    def _carregar(self, sala_id, reter):
+        """Lê a sala do disco sem a trava do gerenciador (obter() já marcou a carga em _carregando)."""
+        try:
+            sala = Sala(sala_id, self.diretorio, self.modo_persistencia,
+                        formato_snapshot=self.formato_snapshot, compressao=self.compressao)
+            sala.ao_sincronizar = self.ao_sincronizar
+            sala.carregar()
+            if self.ao_carregar is not None:
+                self.ao_carregar(sala)
+            with self._lock:
+                self._acessar(sala, reter)
+        finally:
+            # Também se a carga falhar: quem esperava tenta de novo (e carrega) em vez de ficar parado.
+            with self._lock:
+                carga = self._carregando.pop(sala_id)
+            carga.set()
+        return sala
+
+    def reter(self, sala):
+        """Marca mais um uso de uma sala que o chamador já tem retida (ex.: um lance que vai para a fila)."""
+        with self._lock:
+            sala.em_uso += 1
+
+    def soltar(self, sala):
+        with self._lock:
+            sala.em_uso -= 1
+
+    @contextmanager
+    def usar(self, sala_id):
+        """obter(sala_id, reter=True) e soltar() no fim do bloco."""
+        sala = self.obter(sala_id, reter=True)
+        try:
+            yield sala
+        finally:
+            if sala is not None:
+                self.soltar(sala)
+
+    def em_memoria(self):
+        """Salas carregadas agora (cópia da lista, para percorrer sem a trava)."""
+        with self._lock:
+            return list(self.carregadas.values())
+
+    def despejar_ociosas(self):
+        """Compacta e tira da memória as salas ociosas (e as mais antigas além do limite)."""
+        with self._lock:
+            despejadas = self._despejar_ociosas()
+        self._concluir_despejo(despejadas)
+
+    def _despejar_ociosas(self):
+        limite = time.monotonic() - self.ociosidade_max
+        despejadas = []
+        for sala_id, sala in list(self.carregadas.items()):
+            if len(self.carregadas) <= self.max_carregadas and sala.ultimo_acesso > limite:
+                break
+            if sala.em_uso == 0:
+                despejadas.append(self._despejar(sala_id))
+        return despejadas
+
+    def despejar(self, sala_id):
+        """Tira a sala da memória, se ninguém a estiver usando."""
+        with self._lock:
+            sala = self.carregadas.get(sala_id)
+            despejadas = [self._despejar(sala_id)] if sala is not None and sala.em_uso == 0 else []
+        self._concluir_despejo(despejadas)
+
+    def _despejar(self, sala_id):
+        # Só tira do dicionário (com a trava); o salvamento fica para _concluir_despejo, fora dela.
+        sala = self.carregadas.pop(sala_id)
+        self._despejando[sala_id] = sala
+        return sala
+
+    def _concluir_despejo(self, salas):
+        """Salva e fecha as salas despejadas, sem a trava do gerenciador: obter() não espera o disco."""
+        for sala in salas:
+            try:
+                if sala.partida and (sala.suja or sala.armazenamento.registros_pendentes):
+                    sala.salvar()
+                salva = True
+            except Exception:
+                salva = False
+            with self._lock:
+                if self._despejando.get(sala.id) is not sala:
+                    # Voltou para carregadas (obter) no meio do salvamento: continua aberta.
+                    continue
+                del self._despejando[sala.id]
+                if not salva:
+                    # Sem salvar, a sala não sai da memória: é a única cópia do que não foi gravado.
+                    # Tenta de novo depois de outra ociosidade inteira.
+                    sala.ultimo_acesso = time.monotonic()
+                    self.carregadas[sala.id] = sala
+                    continue
+            sala.armazenamento.fechar()
+            sala.eventos.encerrar()
+
+    def listar(self):
+        """Ids das salas conhecidas: as salvas no disco e as carregadas em memória."""
+        with self._lock:
+            ids = set(self.carregadas)
+        if os.path.isdir(self.diretorio):
+            ids.update(os.path.splitext(nome)[0] for nome in os.listdir(self.diretorio) if nome.endswith(('.json', '.bin', '.sqlite3')))
+        return sorted(i for i in ids if FORMATO_ID_SALA.match(i))
@@ -0,0 +1,242 @@
+import json
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+
+from ledger import Ledger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- SNAPSHOT BINÁRIO (<sala_id>.bin) ---
+#
+# Alternativa ao snapshot JSON (indent=4) para salas grandes. O arquivo é um
+# cabeçalho, uma tabela de seções (nome, codec, início, tamanho) e as seções:
+#
+#   jogadores  partida (saldos, poupança, dados de cada jogador)      JSON
+#   contratos  cobranças parceladas, pedidos de salário, posses      JSON
+#   leiloes    leilões abertos e o histórico dos encerrados          JSON
+#   geral      manchetes, baralho, agregados, journal_seq            JSON
+#   indices    posições de cada jogador no ledger (historico_idx)   binário
+#   ledger     colunas do ledger.Ledger, como estão na memória       binário
+#
+# As seções binárias começam com um JSON prefixado pelo tamanho (u32) e
+# seguem com as colunas em little-endian, gravadas com tobytes() e lidas com
+# frombytes(): não há uma linha por transação para montar nem para parsear.
+#
+# Na carga, o arquivo é mapeado com mmap e só as seções pequenas são lidas:
+# saldos, contratos e leilões ficam prontos na hora. A seção do ledger é lida
+# (e descomprimida) só no primeiro acesso ao ledger da sala (LedgerAdiado).
+#
+# Cada seção pode ser comprimida com zlib ou, com o pacote zstandard
+# instalado, zstd. O codec vai na tabela: um arquivo se lê sem configuração.
+
+MAGICO = b'BCSB'
+VERSAO = 1
+CABECALHO = struct.Struct('<4sHH')
+ENTRADA = struct.Struct('<12sBQQ')
+TAMANHO = struct.Struct('<I')
+
+CODECS = {None: 0, 'zlib': 1, 'zstd': 2}
+SECOES_JSON = (
+    ('jogadores', ('partida',)),
+    ('contratos', ('cobrancas_parceladas', 'solicitacoes_salario', 'propriedades')),
+    ('leiloes', ('leiloes', 'historico_leiloes')),
+)
+# (atributo do Ledger, tipo da coluna), na ordem em que vão para o arquivo.
+COLUNAS = (('ids', 'q'), ('valores', 'q'), ('remetentes', 'H'), ('recebedores', 'H'), ('horas', 'I'))
+
+
+def compressoes_disponiveis():
+    return [nome for nome in CODECS if nome != 'zstd' or zstandard is not None]
+
+
+def _comprimir(dados, compressao):
+    if compressao == 'zlib':
+        return zlib.compress(dados, 1)
+    if compressao == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(dados)
+    return dados
+
+
+def _descomprimir(dados, codec):
+    if codec == CODECS['zlib']:
+        return zlib.decompress(dados)
+    if codec == CODECS['zstd']:
+        if zstandard is None:
+            raise ValueError('snapshot comprimido com zstd, mas o pacote zstandard não está instalado')
+        return zstandard.ZstdDecompressor().decompress(dados)
+    return dados
+
+
+def _em_bytes(coluna):
+    if sys.byteorder == 'big':
+        coluna = array(coluna.typecode, coluna)
+        coluna.byteswap()
+    return coluna.tobytes()
+
+
+def _coluna(tipo, dados):
+    coluna = array(tipo)
+    coluna.frombytes(dados)
+    if sys.byteorder == 'big':
+        coluna.byteswap()
+    return coluna
+
+
+def _com_cabecalho(cabecalho, partes):
+    cabecalho = json.dumps(cabecalho, separators=(',', ':')).encode()
+    return b''.join([TAMANHO.pack(len(cabecalho)), cabecalho, *partes])
+
+
+def _separar_cabecalho(dados):
+    (tamanho,) = TAMANHO.unpack_from(dados, 0)
+    fim = TAMANHO.size + tamanho
+    return json.loads(dados[TAMANHO.size:fim]), memoryview(dados)[fim:]
+
+
+def _secao_ledger(ledger):
+    return _com_cabecalho({'participantes': ledger.participantes, 'textos_hora': ledger.textos_hora},
+                          [_em_bytes(getattr(ledger, nome)) for nome, _ in COLUNAS])
+
+
+def _ler_ledger(dados, n):
+    cabecalho, corpo = _separar_cabecalho(dados)
+    ledger = Ledger()
+    inicio = 0
+    for nome, tipo in COLUNAS:
+        fim = inicio + n * array(tipo).itemsize
+        setattr(ledger, nome, _coluna(tipo, corpo[inicio:fim]))
+        inicio = fim
+    ledger.participantes = cabecalho['participantes']
+    ledger._participante = {pid: i for i, pid in enumerate(ledger.participantes)}
+    ledger.textos_hora = cabecalho['textos_hora']
+    ledger._texto_hora = {texto: i for i, texto in enumerate(ledger.textos_hora)}
+    return ledger
+
+
+def _secao_indices(indices):
+    # Gravados como int64, seja qual for o tamanho do array('l') da plataforma.
+    return _com_cabecalho([[pid, len(posicoes)] for pid, posicoes in indices.items()],
+                          [_em_bytes(posicoes if posicoes.itemsize == 8 else array('q', posicoes)) for posicoes in indices.values()])
+
+
+def _ler_indices(dados):
+    contagens, corpo = _separar_cabecalho(dados)
+    indices, inicio = {}, 0
+    for pid, n in contagens:
+        posicoes = _coluna('q', corpo[inicio:inicio + 8 * n])
+        indices[pid] = posicoes if array('l').itemsize == 8 else array('l', posicoes)
+        inicio += 8 * n
+    return indices
+
+
+class LedgerAdiado:
+    """O ledger de um snapshot binário, ainda no arquivo mapeado.
+
+    len() responde sem ler a seção; carregar() lê as colunas e solta o mapa.
+    """
+
+    def __init__(self, mapa, codec, inicio, tamanho, transacoes):
+        self._mapa = mapa
+        self._secao = (codec, inicio, tamanho)
+        self._transacoes = transacoes
+
+    def __len__(self):
+        return self._transacoes
+
+    def carregar(self):
+        codec, inicio, tamanho = self._secao
+        ledger = _ler_ledger(_descomprimir(self._mapa[inicio:inicio + tamanho], codec), self._transacoes)
+        self._mapa.close()
+        return ledger
+
+    def linhas(self):
+        return self.carregar().linhas()
+
+
+def gravar(caminho, estado, compressao=None):
+    """Grava o estado no formato binário. Retorna os bytes gravados.
+
+    estado['ledger'] é um Ledger (ou as linhas do snapshot JSON) e
+    estado['indices'], o historico_idx de cada jogador (refeito a partir do
+    ledger se faltar).
+    """
+    if compressao not in compressoes_disponiveis():
+        raise ValueError(f'compressão indisponível: {compressao}')
+    ledger = estado.get('ledger', [])
+    if not isinstance(ledger, Ledger):
+        ledger = ledger.carregar() if isinstance(ledger, LedgerAdiado) else _ledger_das_linhas(ledger)
+    indices = estado.get('indices')
+    if indices is None:
+        indices = _indices_do_ledger(ledger, estado.get('partida', {}))
+
+    agrupadas = {chave for _, chaves in SECOES_JSON for chave in chaves}
+    geral = {chave: valor for chave, valor in estado.items() if chave not in agrupadas and chave not in ('ledger', 'indices')}
+    geral['transacoes'] = len(ledger)
+    secoes = [(nome, {chave: estado[chave] for chave in chaves if chave in estado}) for nome, chaves in SECOES_JSON]
+    secoes = [(nome, json.dumps(valor, separators=(',', ':')).encode()) for nome, valor in secoes + [('geral', geral)]]
+    secoes += [('indices', _secao_indices(indices)), ('ledger', _secao_ledger(ledger))]
+    secoes = [(nome, _comprimir(dados, compressao)) for nome, dados in secoes]
+
+    inicio = CABECALHO.size + ENTRADA.size * len(secoes)
+    tabela = []
+    for nome, dados in secoes:
+        tabela.append(ENTRADA.pack(nome.encode(), CODECS[compressao], inicio, len(dados)))
+        inicio += len(dados)
+    with open(caminho, 'wb') as f:
+        f.write(CABECALHO.pack(MAGICO, VERSAO, len(secoes)))
+        f.write(b''.join(tabela))
+        for _, dados in secoes:
+            f.write(dados)
+    return inicio
+
+
+def ler(caminho):
+    """Lê um snapshot binário no formato do estado da Sala.
+
+    estado['ledger'] volta como LedgerAdiado e estado['indices'] com o
+    historico_idx de cada jogador.
+    """
+    with open(caminho, 'rb') as f:
+        mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magico, versao, n = CABECALHO.unpack_from(mapa, 0)
+    if magico != MAGICO or versao != VERSAO:
+        mapa.close()
+        raise ValueError(f'{caminho}: não é um snapshot binário (versão {VERSAO})')
+    secoes = {}
+    for i in range(n):
+        nome, codec, inicio, tamanho = ENTRADA.unpack_from(mapa, CABECALHO.size + ENTRADA.size * i)
+        secoes[nome.rstrip(b'\0').decode()] = (codec, inicio, tamanho)
+
+    def secao(nome):
+        codec, inicio, tamanho = secoes[nome]
+        return _descomprimir(mapa[inicio:inicio + tamanho], codec)
+
+    estado = {}
+    for nome in [nome for nome, _ in SECOES_JSON] + ['geral']:
+        estado.update(json.loads(secao(nome)))
+    estado['indices'] = _ler_indices(secao('indices'))
+    estado['ledger'] = LedgerAdiado(mapa, *secoes['ledger'], estado.pop('transacoes'))
+    return estado
+
+
+def _ledger_das_linhas(linhas):
+    ledger = Ledger()
+    for linha in linhas:
+        ledger.anotar(*linha)
+    return ledger
+
+
+def _indices_do_ledger(ledger, partida):
+    indices = {pid: array('l') for pid in partida if pid not in ('Banco', 'timestamp')}
+    for posicao, (remetente, recebedor) in enumerate(zip(ledger.remetentes, ledger.recebedores)):
+        for indice in {remetente, recebedor}:
+            pid = ledger.participantes[indice]
+            if pid in indices:
+                indices[pid].append(posicao)
+    return indices
@@ -0,0 +1,142 @@
+// Funções de página compartilhadas pelos templates (carregado no <head>).
+
+// Troca o conteúdo de um contêiner pela primeira página do fragmento (sem
+// disparar várias buscas quando chegam eventos em sequência).
+const fragmentosPendentes = {};
+function atualizarFragmento(id, url) {
+  clearTimeout(fragmentosPendentes[id]);
+  fragmentosPendentes[id] = setTimeout(() => {
+    fetch(url).then(r => r.ok ? r.text() : Promise.reject()).then(html => {
+      document.getElementById(id).innerHTML = html;
+      observarFragmentos();
+    }).catch(() => {});
+  }, 150);
+}
+
+function mostrarAviso(texto, tipo) {
+  const aviso = document.createElement('div');
+  aviso.className = 'fixed top-2 left-2 right-2 z-50 mx-auto max-w-md p-3 rounded-xl shadow-xl border-2 bg-white/95 text-center font-black text-[10px] uppercase '
+    + (tipo === 'error' ? 'text-red-600 border-red-200' : 'text-green-600 border-green-200');
+  aviso.textContent = texto;
+  document.body.appendChild(aviso);
+  setTimeout(() => aviso.remove(), 4000);
+}
+
+// Mudança que pede a página inteira: oferece recarregar em vez de interromper quem está digitando.
+function avisarAtualizacao(texto) {
+  let botao = document.getElementById('aviso-atualizacao');
+  if (!botao) {
+    botao = document.createElement('button');
+    botao.id = 'aviso-atualizacao';
+    botao.className = 'fixed bottom-4 left-1/2 -translate-x-1/2 z-50 px-5 py-3 rounded-full shadow-2xl bg-gray-900 text-yellow-400 font-black text-[10px] uppercase';
+    botao.onclick = () => location.reload();
+    document.body.appendChild(botao);
+  }
+  botao.textContent = texto + ' ⟳';
+}
+
+// Contagem regressiva dos leilões: todo elemento com data-expira (epoch em ms).
+setInterval(() => document.querySelectorAll('[data-expira]').forEach(el => {
+  const restante = el.dataset.expira - Date.now();
+  el.textContent = Math.max(0, Math.floor(restante / 1000)) + 's';
+  // Sem SSE, o resultado do leilão só aparece recarregando.
+  if (restante < -1000 && !window.EventSource) location.reload();
+}), 1000);
+
+// Server-Sent Events: `manipuladores` recebe, por tipo de evento, os dados já decodificados.
+// `aoReconectar` roda quando a conexão volta (eventos podem ter se perdido no meio).
+function assinarEventos(url, manipuladores, aoReconectar) {
+  if (!window.EventSource) return null;
+  const fonte = new EventSource(url);
+  for (const [tipo, manipulador] of Object.entries(manipuladores)) {
+    fonte.addEventListener(tipo, e => manipulador(JSON.parse(e.data)));
+  }
+  fonte.addEventListener('recarregar', () => location.reload());
+  let conectou = false;
+  fonte.addEventListener('open', () => { if (conectou && aoReconectar) aoReconectar(); conectou = true; });
+  return fonte;
+}
+
+// API JSON: o navegador revalida com If-None-Match e o servidor responde 304
+// enquanto nada mudou; `aplicar` só roda quando a ETag muda.
+const etagsApi = {};
+function buscarApi(url, aplicar) {
+  return fetch(url, {cache: 'no-cache', headers: {Accept: 'application/json'}}).then(r => {
+    if (!r.ok) return Promise.reject();
+    const etag = r.headers.get('ETag');
+    if (etag && etagsApi[url] === etag) return;
+    etagsApi[url] = etag;
+    return r.json().then(aplicar);
+  }).catch(() => {});
+}
+// Sem SSE, acompanha o recurso consultando a API periodicamente.
+function acompanharApi(url, aplicar, intervalo = 5000) {
+  buscarApi(url, aplicar);
+  return setInterval(() => buscarApi(url, aplicar), intervalo);
+}
+
+// POST de uma operação com chave de idempotência: a falha de rede (ou a original ainda
+// em andamento, 409) é reenviada com a mesma chave, e o servidor não executa duas vezes.
+function novaChaveIdempotencia() {
+  return Date.now().toString(36) + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+}
+function enviarOperacao(url, opcoes, tentativas = 3) {
+  const chave = novaChaveIdempotencia();
+  const enviar = restantes => fetch(url, {...opcoes, headers: {...opcoes.headers, 'Idempotency-Key': chave}})
+    .then(r => (r.status === 409 && restantes > 1) ? Promise.reject() : r)
+    .catch(erro => restantes > 1
+      ? new Promise(ok => setTimeout(ok, 1000 * (tentativas - restantes + 1))).then(() => enviar(restantes - 1))
+      : Promise.reject(erro));
+  return enviar(tentativas);
+}
+
+// Paginação do extrato/auditoria: troca o link "anteriores" pelo próximo fragmento.
+function carregarFragmento(link) {
+  if (link.dataset.carregando) return;
+  link.dataset.carregando = '1';
+  fetch(link.dataset.fragmento)
+    .then(r => r.ok ? r.text() : Promise.reject())
+    .then(html => { link.outerHTML = html; observarFragmentos(); })
+    .catch(() => { delete link.dataset.carregando; });
+}
+const observadorFragmentos = 'IntersectionObserver' in window
+  ? new IntersectionObserver(entradas => entradas.forEach(e => { if (e.isIntersecting) carregarFragmento(e.target); }))
+  : null;
+function observarFragmentos() {
+  document.querySelectorAll('a[data-fragmento]').forEach(link => {
+    if (observadorFragmentos) observadorFragmentos.observe(link);
+  });
+}
+document.addEventListener('click', e => {
+  const link = e.target.closest('a[data-fragmento]');
+  if (link) { e.preventDefault(); carregarFragmento(link); }
+});
+document.addEventListener('DOMContentLoaded', observarFragmentos);
+
+// Carteira do jogador: calculadora de pagamento, missão secreta e contraste do cartão.
+let boostAtual = 0;
+function atualizarCalculo(novoBoost = null) {
+  if (novoBoost !== null) boostAtual = novoBoost;
+  const base = parseFloat(document.getElementById('valor_base').value) || 0;
+  const mult = parseInt(document.getElementById('multiplicador').value) || 1;
+  const subtotal = base * mult;
+  const final = Math.round(subtotal + (subtotal * (boostAtual / 100)));
+  document.getElementById('valor_final_input').value = final;
+  document.getElementById('valor_final_display').innerText = "R$ " + final.toLocaleString('pt-BR');
+  document.getElementById('formula_display').innerText = `R$ ${base.toLocaleString('pt-BR')} x ${mult} (${boostAtual >= 0 ? '+' : ''}${boostAtual}%)`;
+}
+
+function toggleObjetivo() {
+  const c = document.getElementById('obj-content');
+  const s = document.getElementById('obj-status');
+  c.classList.toggle('hidden');
+  s.innerText = c.classList.contains('hidden') ? 'REVELAR' : 'OCULTAR';
+}
+function getContrastYIQ(hexcolor){
+  hexcolor = hexcolor.replace("#", "");
+  var r = parseInt(hexcolor.substr(0,2),16);
+  var g = parseInt(hexcolor.substr(2,2),16);
+  var b = parseInt(hexcolor.substr(4,2),16);
+  var yiq = ((r*299)+(g*587)+(b*114))/1000;
+  return (yiq >= 128) ? 'black' : 'white';
+}
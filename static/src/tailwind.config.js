@@ -0,0 +1,22 @@
+// Gera static/css/app.css só com as classes usadas nos templates:
+//   npx tailwindcss@3 -c static/src/tailwind.config.js -i static/src/app.css -o static/css/app.css --minify
+// Rode de novo sempre que um template ganhar classes novas.
+module.exports = {
+  content: ['./templates/**/*.html', './static/js/**/*.js'],
+  theme: {
+    extend: {
+      fontFamily: {
+        sans: ['Inter', 'sans-serif'],
+      },
+      colors: {
+        monopoly: {
+          green: '#CDEAC0',
+          dark: '#1F2937',
+          board: '#FAF8EF',
+          red: '#FF6B6B',
+          blue: '#4ECDC4'
+        }
+      }
+    }
+  }
+}
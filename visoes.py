@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+
+from metricas import METRICAS
+
+# --- VISÕES DERIVADAS ---
+#
+# O que as páginas montam a partir do estado da sala e que não muda entre
+# duas mutações: o nome de cada jogador, as cobranças de cada jogador, os
+# fragmentos HTML de cartões, extratos e leilões. Cada visão fica guardada
+# com o carimbo das partes do estado de que depende (Sala.versoes: um
+# jogador, 'ledger', 'cobrancas', 'leilao:<id>'...). A mutação já carimba as
+# partes que tocou (Sala.tocar); na próxima leitura, só as visões dessas
+# partes são refeitas.
+#
+# O carimbo também leva a geração da sala e a parte 'jogadores', tocada ao
+# fim de cada carga e no início da partida: nada montado no meio de uma carga
+# sobrevive a ela.
+
+METRICAS.contador('banco_visoes_total', 'Leituras de visões derivadas (cache), por resultado.')
+
+
+class Visoes:
+    """Cache LRU das visões derivadas de uma sala, por carimbo de versão."""
+
+    def __init__(self, sala, maximo=512):
+        self._sala = sala
+        self.maximo = maximo
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave, partes, montar):
+        """A visão `chave`, montada de novo só se alguma das `partes` mudou desde a última montagem."""
+        sala = self._sala
+        carimbo = (sala.geracao, sala.versoes.get('jogadores', 0), *(sala.versoes.get(p, 0) for p in partes))
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] == carimbo:
+                self._itens.move_to_end(chave)
+                METRICAS.incrementar('banco_visoes_total', resultado='acerto')
+                return item[1]
+        # Montada fora da trava: duas leituras simultâneas podem montar a mesma visão, sem prejuízo.
+        valor = montar()
+        with self._lock:
+            self._itens[chave] = (carimbo, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+        METRICAS.incrementar('banco_visoes_total', resultado='falta')
+        return valor
+
+    def __len__(self):
+        return len(self._itens)